@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+"""Compare `get_added_lines` with the former `SequenceMatcher` based
+implementation on large wiki pages.
+
+Usage: python benchmarks/diff.py [lines]
+"""
+
+from difflib import SequenceMatcher
+import random
+import sys
+import time
+
+from tracspamfilter.diff import get_added_lines
+
+
+def sequencematcher_added_lines(old_content, new_content):
+    buf = []
+    old_lines = old_content.splitlines()
+    new_lines = new_content.splitlines()
+    matcher = SequenceMatcher(None, old_lines, new_lines)
+    for group in matcher.get_grouped_opcodes(0):
+        for tag, i1, i2, j1, j2 in group:
+            if tag in ('insert', 'replace'):
+                buf.append('\n'.join(new_lines[j1:j2]))
+    return '\n'.join(buf)
+
+
+def make_page(lines, rnd):
+    words = ['wiki', 'trac', 'ticket', 'milestone', 'report', 'the', 'a',
+             'changeset', 'source', 'browser', '||', '=', '*', '{{{', '}}}']
+    return [' '.join(rnd.choice(words) for i in range(rnd.randint(0, 12)))
+            for i in range(lines)]
+
+
+def scenarios(lines):
+    rnd = random.Random(42)
+    page = make_page(lines, rnd)
+    spam = ['[http://spam.example.com/%d cheap pills]' % i for i in range(50)]
+
+    yield 'append', page, page + spam
+    middle = lines // 2
+    yield 'insert middle', page, page[:middle] + spam + page[middle:]
+    edited = list(page)
+    for i in rnd.sample(range(lines), 200):
+        edited[i] = spam[i % len(spam)]
+    yield 'scattered edits', page, edited
+    yield 'regenerated table', page, make_page(lines, rnd)
+
+
+def measure(func, old, new, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = func(old, new)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main(lines=10000):
+    print '%d lines' % lines
+    print '%-20s %16s %16s %10s' % ('scenario', 'SequenceMatcher',
+                                     'new', 'speedup')
+    for name, old, new in scenarios(lines):
+        old = '\n'.join(old)
+        new = '\n'.join(new)
+        old_time, old_result = measure(sequencematcher_added_lines, old, new)
+        new_time, new_result = measure(get_added_lines, old, new)
+        print '%-20s %15.3fs %15.3fs %9.1fx  (%d / %d added lines)' % (
+            name, old_time, new_time, old_time / max(new_time, 1e-6),
+            len(old_result.splitlines()), len(new_result.splitlines()))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+"""Compare `PatternMatcher` with searching BadContent patterns one by one.
+
+Usage: python benchmarks/regex.py [patterns] [kilobytes]
+"""
+
+import random
+import re
+import string
+import sys
+import time
+
+from tracspamfilter.regexmatcher import PatternMatcher
+
+
+def make_patterns(count, rnd):
+    def word(low=4, high=10):
+        return ''.join(rnd.choice(string.ascii_lowercase)
+                       for i in range(rnd.randint(low, high)))
+    patterns = []
+    for i in range(count):
+        kind = rnd.random()
+        if kind < 0.6:
+            # the typical BadContent entry: a domain name
+            pattern = r'%s\.(com|net|org|info)' % word()
+        elif kind < 0.85:
+            pattern = r'\b%s[-_ ]?%s\b' % (word(3, 7), word(3, 7))
+        elif kind < 0.95:
+            pattern = r'https?://[^/]*%s' % word()
+        elif kind < 0.98:
+            pattern = r'(?i)%s' % word()
+        else:
+            pattern = r'[0-9]{%d}x' % rnd.randint(6, 12)
+        patterns.append(re.compile(pattern))
+    return patterns
+
+
+def make_content(kilobytes, patterns, rnd):
+    words = ['wiki', 'trac', 'ticket', 'milestone', 'report', 'the', 'a',
+             'changeset', 'source', 'browser', 'http://example.org/', '||']
+    buf = []
+    size = 0
+    while size < kilobytes * 1024:
+        if rnd.random() < 0.002:
+            # an occasional spam link
+            text = rnd.choice(patterns).pattern.replace('\\', '') \
+                                               .split('(')[0] + 'com'
+        else:
+            text = rnd.choice(words)
+        buf.append(text)
+        size += len(text) + 1
+    return ' '.join(buf)
+
+
+def naive_search(patterns, text):
+    return [pattern for pattern in patterns if pattern.search(text)]
+
+
+def measure(func, *args):
+    best = None
+    for i in range(3):
+        start = time.time()
+        result = func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main(count=5000, kilobytes=50):
+    rnd = random.Random(42)
+    patterns = make_patterns(count, rnd)
+    content = make_content(kilobytes, patterns, rnd)
+
+    start = time.time()
+    matcher = PatternMatcher(patterns)
+    print '%d patterns, %d KB of content' % (count, kilobytes)
+    print 'matcher built in %.3fs' % (time.time() - start)
+
+    old_time, old_result = measure(naive_search, patterns, content)
+    new_time, new_result = measure(matcher.search, content)
+    assert old_result == new_result
+    print 'one by one: %.3fs' % old_time
+    print 'matcher:    %.3fs (%.1fx, %d matching patterns)' % (
+        new_time, old_time / max(new_time, 1e-6), len(new_result))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -12,6 +12,7 @@
 # history and logs, available at http://projects.edgewall.com/trac/.
 
 import os
+import time
 import urllib2
 
 from pkg_resources import resource_filename
@@ -25,11 +26,14 @@ from trac.web.chrome import add_link, add_stylesheet, add_script, add_script_dat
 from tracspamfilter.filtersystem import FilterSystem
 from tracspamfilter.api import add_domain, _, N_, gettext
 from tracspamfilter.model import LogEntry, Statistics
+from tracspamfilter.reputation import ReputationCache
 from tracspamfilter.filters.akismet import AkismetFilterStrategy
 from tracspamfilter.filters.stopforumspam import StopForumSpamFilterStrategy
 from tracspamfilter.filters.botscout import BotScoutFilterStrategy
 from tracspamfilter.filters.fspamlist import FSpamListFilterStrategy
 from tracspamfilter.filters.blogspam import BlogSpamFilterStrategy
+from tracspamfilter.filters.ip_regex import IPRegexFilterStrategy
+from tracspamfilter.filters.regex import RegexFilterStrategy
 from tracspamfilter.captcha import ICaptchaMethod
 from tracspamfilter.captcha.recaptcha import RecaptchaCaptcha
 from tracspamfilter.captcha.keycaptcha import KeycaptchaCaptcha
@@ -44,8 +48,9 @@ except ImportError: # SpamBayes not installed
     BayesianFilterStrategy = None
 try:
     from tracspamfilter.filters.httpbl import HttpBLFilterStrategy
+    from tracspamfilter.resolver import DNSResolver
 except ImportError: # DNS python not installed
-    HttpBLFilterStrategy = None
+    HttpBLFilterStrategy = DNSResolver = None
 try:
     from tracspamfilter.captcha.image import ImageCaptcha
 except ImportError: # PIL not installed
@@ -158,6 +163,7 @@ class SpamFilterAdminPageProvider(Component):
             'trust_authenticated': filtersys.trust_authenticated,
             'logging_enabled': filtersys.logging_enabled,
             'purge_age': filtersys.purge_age,
+            'purge_status': filtersys.get_purge_status(),
             'spam_monitor_entries_min' : self.MIN_PER_PAGE,
             'spam_monitor_entries_max' : self.MAX_PER_PAGE,
             'spam_monitor_entries' : self.DEF_PER_PAGE
@@ -440,6 +446,14 @@ class ExternalAdminPageProvider(Component):
 
         if HttpBLFilterStrategy:
             data['blacklists'] = 1
+            data['dnscache'] = DNSResolver(self.env).get_cache_stats()
+        breakers = FilterSystem(self.env).get_breaker_states()
+        for breaker in breakers:
+            if breaker['until']:
+                breaker['remaining'] = max(0, int(breaker['until'] -
+                                                  time.time()))
+        data['breakers'] = breakers
+        data['reputationcache'] = ReputationCache(self.env).get_cache_stats()
         if DefensioFilterStrategy:
             data['defensio'] = 1
             data['defensio_api_key'] = defensio_api_key
@@ -503,7 +517,7 @@ class BayesAdminPageProvider(Component):
             else:
                 if 'reset' in req.args:
                     self.log.info('Resetting SpamBayes training database')
-                    self.env.db_transaction("DELETE FROM spamfilter_bayes")
+                    bayes.reset()
 
                 try:
                     min_training = int(req.args['min_training'])
@@ -539,6 +553,9 @@ class StatisticsAdminPageProvider(Component):
 
     implements(IAdminPanelProvider)
 
+    pattern_strategies = (RegexFilterStrategy, IPRegexFilterStrategy)
+    max_patterns = 20
+
     # IAdminPanelProvider methods
 
     def get_admin_panels(self, req):
@@ -548,25 +565,42 @@ class StatisticsAdminPageProvider(Component):
     def render_admin_panel(self, req, cat, page, path_info):
         req.perm.assert_permission('SPAM_CONFIG')
 
+        filtersys = FilterSystem(self.env)
         stats = Statistics(self.env)
 
         if req.method == 'POST':
+            filtersys.flush_statistics()
             if 'clean' in req.args:
                 stats.clean(req.args['strategy'])
             elif 'cleanall' in req.args:
                 stats.cleanall()
+            elif 'resetpatterns' in req.args:
+                for strategy in self._get_pattern_strategies():
+                    strategy.reset_pattern_stats()
             req.redirect(req.href.admin(cat, page))
 
-        strategies,overall = stats.getstats()
+        strategies,overall = stats.getstats(filtersys.get_pending_statistics())
 
         data = {}
         data['_'] = _
         data['strategies'] = strategies
         data['overall'] = overall
+        data['verdictcache'] = filtersys.get_verdict_cache_stats()
+        data['patternstats'] = patternstats = []
+        for strategy in self._get_pattern_strategies():
+            patterns = [p for i, p in enumerate(strategy.get_pattern_stats())
+                        if p['quarantined'] or
+                        i < self.max_patterns and p['searches']]
+            if patterns:
+                patternstats.append((strategy.__class__.__name__, patterns))
 
         add_stylesheet(req, 'spamfilter/admin.css')
         return 'admin_statistics.html', data
 
+    def _get_pattern_strategies(self):
+        return [cls(self.env) for cls in self.pattern_strategies
+                if self.env.is_component_enabled(cls)]
+
 class CaptchaAdminPageProvider(Component):
     """Web administration panel for configuring the Captcha handling."""
 
@@ -24,11 +24,15 @@ _, tag_, N_, add_domain, gettext, ngettext = domain_functions(
     'tracspamfilter', 
     ('_', 'tag_', 'N_', 'add_domain', 'gettext', 'ngettext'))
 
-__all__ = ['RejectContent', 'IFilterStrategy']
+__all__ = ['RejectContent', 'IFilterStrategy', 'ServiceUnavailable']
 
 class RejectContent(TracError):
     """Exception raised when content is rejected by a filter."""
 
+class ServiceUnavailable(Exception):
+    """Exception raised by an external filter when the service could not
+    be asked, e.g. because of a timeout or a refused connection."""
+
 class IFilterStrategy(Interface):
     """Mainfilter class, mainly consisting of test() and train() function
 
@@ -36,6 +40,10 @@ class IFilterStrategy(Interface):
 
        Any variable ending in "karma_points" is presented in the karma admin
        interface.
+
+       Filters may additionally provide start_batch() and finish_batch()
+       methods, which are called around training several log entries at
+       once, so the training data can be written in one go.
     """
 
     def is_external(self):
@@ -52,7 +60,9 @@ class IFilterStrategy(Interface):
         description of why the score is being affected.
         
         If the filter strategy does not want (or is not able) to effectively
-        test the submission, it should return `None`.
+        test the submission, it should return `None`. External filters
+        raise `ServiceUnavailable` if the service failed, so it is skipped
+        for a while after repeated failures.
         """
 
     def train(req, author, content, ip, spam=True):
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import threading
+import time
+
+__all__ = ['CircuitBreaker']
+
+
+class CircuitBreaker(object):
+    """Skip calls to a service after it failed repeatedly.
+
+    After `threshold` consecutive failures the breaker is `open` and
+    `allow()` returns `False` for `cooldown` seconds. Then it is
+    `half-open`: a single probe call is allowed, which closes the breaker
+    again if it succeeds and opens it for another cool-down if it fails.
+    A probe which does not report back within `cooldown` seconds is
+    replaced by a new one.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, log, threshold=5, cooldown=60):
+        self.name = name
+        self.log = log
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._probe = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return whether the service should be called now."""
+        if self.state == self.CLOSED or self.threshold <= 0:
+            return True
+        now = time.time()
+        with self._lock:
+            if self.state == self.OPEN:
+                if now < self.opened + self.cooldown:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            elif self.state == self.HALF_OPEN and self._probe is not None \
+                    and now < self._probe + self.cooldown:
+                return False
+            self._probe = now
+            return True
+
+    def success(self):
+        """Report a successful call."""
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self._lock:
+            self.failures = 0
+            self._probe = None
+            self._set_state(self.CLOSED)
+
+    def failure(self):
+        """Report a failed or timed out call."""
+        with self._lock:
+            self.failures += 1
+            self._probe = None
+            if self.state == self.HALF_OPEN or \
+                    0 < self.threshold <= self.failures:
+                self.opened = time.time()
+                self._set_state(self.OPEN)
+
+    def get_state(self):
+        """Return a dictionary describing the current state."""
+        until = None
+        if self.state == self.OPEN:
+            until = self.opened + self.cooldown
+        return {'name': self.name, 'state': self.state,
+                'failures': self.failures, 'until': until}
+
+    # Internal methods
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        if state == self.OPEN:
+            self.log.warning('%s failed %d times, skipping it for %d '
+                             'seconds', self.name, self.failures,
+                             self.cooldown)
+        else:
+            self.log.info('%s is %s now', self.name, state)
+        self.state = state
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+from collections import OrderedDict
+import threading
+import time
+
+__all__ = ['LRUCache']
+
+
+class LRUCache(object):
+    """Thread-safe mapping with a maximum size and a time to live.
+
+    When the cache is full, the least recently used entry is dropped.
+    Entries stored with a `ttl` of `None` do not expire.
+    Lookups are counted in `hits` and `misses`.
+
+    Callers computing an expensive value can use `claim()` and `release()`
+    so concurrent callers for the same key wait for the first one instead
+    of computing the value again.
+    """
+
+    def __init__(self, size=1000, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Return the value for `key` or `default` if it is not cached or
+        has expired."""
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.time():
+                self.misses += 1
+                return default
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            while self._data and len(self._data) >= self.size:
+                self._data.popitem(last=False)
+            if self.size > 0:
+                expires = time.time() + ttl if ttl is not None else None
+                self._data[key] = (expires, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def claim(self, key):
+        """Announce that the caller is going to compute the value of `key`.
+
+        Returns `None` if no other thread is doing so already, the caller
+        has to call `release()` afterwards. Otherwise an `Event` is returned
+        which is set when the other thread is done.
+        """
+        with self._lock:
+            event = self._inflight.get(key)
+            if event is None:
+                self._inflight[key] = threading.Event()
+            return event
+
+    def release(self, key):
+        with self._lock:
+            event = self._inflight.pop(key, None)
+        if event is not None:
+            event.set()
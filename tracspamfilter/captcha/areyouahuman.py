@@ -23,6 +23,7 @@ from trac.core import *
 from trac.config import *
 from trac.util.html import html
 from tracspamfilter.captcha import ICaptchaMethod
+from tracspamfilter.httpclient import HTTPClient
 
 class AreYouAHumanCaptcha(Component):
     """AreYouAHuman implementation"""
@@ -65,21 +66,23 @@ class AreYouAHumanCaptcha(Component):
         try:
             secret = req.args.get('session_secret')
             self.log.debug('AreYouAHuman check result: %s', secret)
-            response = urllib2.urlopen("https://%s/ws/scoreGame" % self.host, \
-            urllib.urlencode({ 'scoring_key': self.scoring_key, 'session_secret': secret }))
-            self.log.debug('AreYouAHuman server check response: %s', response.code)
-            if response.code == 200:
-                resp = response.readline()
+            client = HTTPClient(self.env)
+            response = client.request("POST", "https://%s/ws/scoreGame" % self.host, \
+            urllib.urlencode({ 'scoring_key': self.scoring_key, 'session_secret': secret }),
+            {'Content-Type': 'application/x-www-form-urlencoded'})
+            self.log.debug('AreYouAHuman server check response: %s', response.status)
+            if response.status == 200:
+                resp = response.body.split('\n', 1)[0]
                 self.log.debug('AreYouAHuman server check result: %s', resp)
                 if '{"status_code":1}' in resp:
                     res = True
                 else:
                     self.log.warning('AreYouAHuman returned invalid check result: %s', resp)
             else:
-                self.log.warning('AreYouAHuman returned invalid check result: %s (%s)', response.code, response.read())
-            response = urllib2.urlopen("https://%s//ws/recordConversion/%s" % (self.host, secret))
-            if response.code != 200:
-                self.log.warning('AreYouAHuman returned invalid conversion result: %s (%s)', response.code, response.read())
+                self.log.warning('AreYouAHuman returned invalid check result: %s (%s)', response.status, response.body)
+            response = client.request("GET", "https://%s//ws/recordConversion/%s" % (self.host, secret))
+            if response.status != 200:
+                self.log.warning('AreYouAHuman returned invalid conversion result: %s (%s)', response.status, response.body)
         except Exception, e:
             self.log.warning('Exception in AreYouAHuman handling (%s)', e)
         return res
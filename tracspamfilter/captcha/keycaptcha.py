@@ -13,7 +13,6 @@
 # history and logs, available at http://projects.edgewall.com/trac/.
 
 import os
-import urllib2
 from pkg_resources import get_distribution
 
 from genshi.builder import Element, Fragment, tag
@@ -22,6 +21,7 @@ from trac.core import *
 from trac.config import *
 from trac.util.html import html
 from tracspamfilter.captcha import ICaptchaMethod
+from tracspamfilter.httpclient import HTTPClient
 from random import randint
 import hashlib
 
@@ -85,16 +85,9 @@ class KeycaptchaCaptcha(Component):
             s = hashlib.md5("accept"+val[1]+self.private_key+val[2]).hexdigest()
             self.log.debug('KeyCaptcha response: %s .. %s .. %s', response_field, s, session)
             if s == val[0] and session == val[3]:
-                request = urllib2.Request (
-                    url = val[2],
-                    headers = {
+                return_values = HTTPClient(self.env).fetch(val[2], None, {
                         "User-agent": self.user_agent
-                        }
-                    )
-    
-                httpresp = urllib2.urlopen(request)
-                return_values = httpresp.read();
-                httpresp.close();
+                        })
                 self.log.debug('KeyCaptcha check result: %s', return_values)
                 if return_values == "1":
                     return True
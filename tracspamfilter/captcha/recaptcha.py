@@ -14,8 +14,9 @@
 
 from __future__ import absolute_import
 
+import json
 import os
-import urllib2, urllib
+import urllib
 from pkg_resources import get_distribution
 
 from genshi.builder import Element, Fragment, tag
@@ -26,6 +27,7 @@ from trac.config import *
 from trac.util.html import html
 from tracspamfilter.api import _
 from tracspamfilter.captcha import ICaptchaMethod
+from tracspamfilter.httpclient import HTTPClient
 
 from recaptcha.client import captcha
 
@@ -67,12 +69,19 @@ class RecaptchaCaptcha(Component):
     def verify_captcha(self, req):
         try:
             remoteip = req.remote_addr
-            result = captcha.submit(req.args.get('g-recaptcha-response'), self.private_key, remoteip)
-
-            if result.is_valid:
+            params = {'secret': self.encode_if_necessary(self.private_key),
+                      'response': self.encode_if_necessary(
+                          req.args.get('g-recaptcha-response', '')),
+                      'remoteip': remoteip}
+            result = json.loads(HTTPClient(self.env).fetch(
+                'https://www.google.com/recaptcha/api/siteverify',
+                urllib.urlencode(params), {'User-Agent': self.user_agent}))
+
+            if result.get('success'):
                 return True
             else:
-                self.log.warning('reCAPTCHA returned error: %s', result.return_values)
+                self.log.warning('reCAPTCHA returned error: %s',
+                                 result.get('error-codes'))
         except Exception, e:
             self.log.warning('Exception in reCAPTCHA handling (%s)', e)
             return False
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+from difflib import SequenceMatcher
+
+__all__ = ['get_added_lines']
+
+
+def get_added_lines(old_content, new_content, max_lines=1000):
+    """Return the lines of `new_content` which are not in `old_content`.
+
+    Lines at the start and end which did not change are skipped first. If
+    the remaining window of changed lines has at most `max_lines` lines,
+    it is compared with `SequenceMatcher`. Larger windows are compared as
+    multisets of lines, so lines which were only moved are not returned.
+    """
+    old_lines = old_content.splitlines()
+    new_lines = new_content.splitlines()
+
+    start = 0
+    end = min(len(old_lines), len(new_lines))
+    while start < end and old_lines[start] == new_lines[start]:
+        start += 1
+    old_end = len(old_lines)
+    new_end = len(new_lines)
+    while old_end > start and new_end > start and \
+            old_lines[old_end - 1] == new_lines[new_end - 1]:
+        old_end -= 1
+        new_end -= 1
+    old_lines = old_lines[start:old_end]
+    new_lines = new_lines[start:new_end]
+
+    if not old_lines:
+        return '\n'.join(new_lines)
+
+    if len(old_lines) + len(new_lines) <= max_lines:
+        buf = []
+        matcher = SequenceMatcher(None, old_lines, new_lines)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag in ('insert', 'replace'):
+                buf.append('\n'.join(new_lines[j1:j2]))
+        return '\n'.join(buf)
+
+    counts = {}
+    for line in old_lines:
+        counts[line] = counts.get(line, 0) + 1
+    buf = []
+    for line in new_lines:
+        count = counts.get(line)
+        if count:
+            counts[line] = count - 1
+        else:
+            buf.append(line)
+    return '\n'.join(buf)
@@ -25,7 +25,8 @@ from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
 from trac.mimeview.api import is_binary
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, N_, ServiceUnavailable
+from tracspamfilter.httpclient import HTTPClient
 
 
 class AkismetFilterStrategy(Component):
@@ -75,7 +76,7 @@ class AkismetFilterStrategy(Component):
                 return -abs(self.karma_points), N_('Akismet says content is spam')
 
         except urllib2.URLError, e:
-            self.log.warn('Akismet request failed (%s)', e)
+            raise ServiceUnavailable('Akismet request failed (%s)' % e)
 
     def train(self, req, author, content, ip, spam=True):
         if not self._check_preconditions(req, author, content):
@@ -122,10 +123,9 @@ class AkismetFilterStrategy(Component):
         if api_key != self.verified_key:
             self.log.debug('Verifying Akismet API key')
             params = {'blog': req.base_url, 'key': api_key}
-            req = urllib2.Request('http://%sverify-key' % api_url,
-                                  urlencode(params),
-                                  {'User-Agent' : self.user_agent})
-            resp = urllib2.urlopen(req).read()
+            resp = HTTPClient(self.env).fetch('http://%sverify-key' % api_url,
+                                              urlencode(params),
+                                              {'User-Agent' : self.user_agent})
             if resp.strip().lower() == 'valid':
                 self.log.debug('Akismet API key is valid')
                 self.verified = True
@@ -154,9 +154,6 @@ class AkismetFilterStrategy(Component):
         for k, v in req.environ.items():
             if k.startswith('HTTP_') and not k in self.noheaders:
                 params[k] = v.encode('utf-8')
-        urlreq = urllib2.Request(url, urlencode(params),
-                              {'User-Agent' : self.user_agent})
-
         #self.log.warn('AkismetPOST2 %s URL %s', urlencode(params), url)
-        resp = urllib2.urlopen(urlreq)
-        return resp.read()
+        return HTTPClient(self.env).fetch(url, urlencode(params),
+                                          {'User-Agent' : self.user_agent})
@@ -16,7 +16,10 @@
 # Author: Matthew Good <trac@matt-good.net>
 
 from math import ceil
+import random
 import re
+import threading
+from types import InstanceType
 from pkg_resources import parse_version
 
 from trac import __version__ as VERSION
@@ -26,9 +29,12 @@ from trac.db import DatabaseManager
 from trac.wiki.api import IWikiChangeListener
 from trac.wiki.model import WikiPage
 from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.cache import LRUCache
 
 from spambayes.hammie import Hammie
+from spambayes.Options import options
 from spambayes.storage import SQLClassifier
+from spambayes.tokenizer import tokenize
 
 
 class BayesianFilterStrategy(Component):
@@ -45,6 +51,17 @@ class BayesianFilterStrategy(Component):
         for the filter to start impacting the karma of submissions.""",
         doc_domain = "tracspamfilter")
 
+    cache_size = IntOption('spam-filter', 'bayes_cache_size', '100000',
+        """The maximum number of words of the training database kept in
+        memory. Use 0 to disable the cache.""", doc_domain = "tracspamfilter")
+
+    def __init__(self):
+        self._cache = TokenCache()
+        self._known = KnownWords()
+        self._batch = threading.local()
+        self._hammie = None
+        self._lock = threading.RLock()
+
     # IFilterStrategy implementation
 
     def is_external(self):
@@ -52,8 +69,12 @@ class BayesianFilterStrategy(Component):
 
     def test(self, req, author, content, ip):
         hammie = self._get_hammie()
-        nspam = hammie.bayes.nspam
-        nham = hammie.bayes.nham
+        # score with a private copy, so the words are looked up without
+        # holding the lock
+        with self._lock:
+            bayes = hammie.bayes.fork(readonly=True)
+        nspam = bayes.nspam
+        nham = bayes.nham
         if author != None:
             testcontent = author+"\n"+content
         else:
@@ -71,7 +92,11 @@ class BayesianFilterStrategy(Component):
                           'spam submissions in the training database is large, '
                           'results may be bad.')
 
-        score = hammie.score(testcontent.encode('utf-8'))
+        # look up all words of the submission at once instead of letting
+        # SpamBayes query them one by one
+        tokens = list(tokenize(testcontent.encode('utf-8')))
+        bayes.prefetch(tokens)
+        score = bayes.spamprob(tokens)
         self.log.debug('SpamBayes reported spam probability of %s', score)
         points = -int(round(self.karma_points * (score * 2 - 1)))
         if points != 0:
@@ -86,39 +111,404 @@ class BayesianFilterStrategy(Component):
         self.log.info('Training SpamBayes, marking content as %s',
                       spam and 'spam' or 'ham')
 
+        batch = getattr(self._batch, 'hammie', None)
+        if batch is not None:
+            batch.train(testcontent.encode('utf-8','ignore'), spam)
+            return 1
         hammie = self._get_hammie()
-        hammie.train(testcontent.encode('utf-8','ignore'), spam)
-        hammie.store()
+        with self._lock:
+            hammie.train(testcontent.encode('utf-8','ignore'), spam)
+            hammie.store()
         return 1
 
+    def start_batch(self):
+        """Collect the training of following `train()` calls by this
+        thread and write it at once in `finish_batch()`.
+
+        The training is counted by a classifier of its own, the shared one
+        is only updated when the batch is written.
+        """
+        hammie = self._get_hammie()
+        with self._lock:
+            self._batch.hammie = self._make_hammie(hammie.bayes.fork())
+
+    def finish_batch(self):
+        batch = getattr(self._batch, 'hammie', None)
+        if batch is not None:
+            self._batch.hammie = None
+            batch.store()
+
+    def reset(self):
+        """Remove all training data."""
+        with self._lock:
+            self._get_hammie().bayes.reset()
+
     # Internal methods
 
     def _get_hammie(self):
+        """Return the classifier of this environment, reloaded if the
+        training database was modified by another process."""
+        hammie = self._hammie
+        generation = False
+        if hammie is not None:
+            # query the database before taking the lock
+            generation = hammie.bayes.get_generation()
+        with self._lock:
+            cache = None
+            if self.cache_size > 0:
+                cache = self._cache
+                cache.size = self.cache_size
+            hammie = self._hammie
+            if hammie is None or hammie.bayes.cache is not cache:
+                bayes = TracDbClassifier(self.env, self.log, cache,
+                                         self._known)
+                hammie = self._hammie = self._make_hammie(bayes)
+            else:
+                hammie.bayes.refresh(generation)
+            generation = hammie.bayes.generation
+            if generation is not None and not self._known.valid(generation):
+                self._known.build_async(self.env, generation, self.log)
+            return hammie
+
+    def _make_hammie(self, bayes):
         try: # 1.0
-            return Hammie(TracDbClassifier(self.env, self.log))
+            return Hammie(bayes)
         except TypeError, e: # 1.1
-            return Hammie(TracDbClassifier(self.env, self.log), 'c')
+            return Hammie(bayes, 'c')
 
     def _get_numbers(self):
         hammie = self._get_hammie()
-        return hammie.nspam, hammie.nham
+        return hammie.bayes.nspam, hammie.bayes.nham
+
+
+class TokenCache(object):
+    """In-memory copy of the rows of the `spamfilter_bayes` table.
+
+    Words are loaded lazily and absent words are remembered as `None`. When
+    the cache is full, the least recently used words are dropped. The
+    cache is only valid for the `generation` of the training database it
+    was filled from, see `TracDbClassifier.generationkey`.
+    """
+
+    _missing = object()
+
+    def __init__(self, size=100000):
+        self.generation = None
+        self.rows = LRUCache(size, ttl=None)
+        self.lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self.rows.size
+
+    @size.setter
+    def size(self, size):
+        self.rows.size = size
+
+    def get(self, word):
+        """Return `(nspam, nham)` or `None` for a known word, raise a
+        `KeyError` if the word is not cached."""
+        row = self.rows.get(word, self._missing)
+        if row is self._missing:
+            raise KeyError(word)
+        return row
+
+    def set(self, word, row):
+        self.rows.set(word, row)
+
+    def clear(self):
+        self.rows.clear()
+
+    def validate(self, generation):
+        """Drop the cached rows if they belong to another generation."""
+        with self.lock:
+            if generation != self.generation:
+                self.rows.clear()
+                self.generation = generation
+
+
+class KnownWords(object):
+    """Bloom filter of the words in the `spamfilter_bayes` table.
+
+    Lets lookups of never trained words skip the database. The filter may
+    report words which do not exist, but must not miss any, so it is only
+    used while it was built for the current `generation` of the training
+    database.
+    """
+
+    bits_per_word = 10
+    hashes = 7
+
+    # Whether `build_async()` builds in the calling thread, e.g. in tests
+    synchronous = False
+
+    def __init__(self):
+        self.generation = None
+        self.table = (0, None)
+        self.capacity = 0
+        self.count = 0
+        self.building = False
+        self.lock = threading.Lock()
+
+    def __contains__(self, word):
+        nbits, bits = self.table
+        for pos in self._positions(word, nbits):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def valid(self, generation):
+        return generation is not None and generation == self.generation
+
+    def add(self, word):
+        with self.lock:
+            if self.generation is None:
+                return
+            self._add(word)
+            self.count += 1
+            if self.count > 2 * self.capacity:
+                # too full to be useful anymore, rebuild it
+                self.generation = None
+
+    def invalidate(self):
+        with self.lock:
+            self.generation = None
+
+    def update(self, generation, new_generation):
+        """Follow a modification of the database by this process."""
+        with self.lock:
+            if self.generation is not None and \
+                    generation == self.generation:
+                self.generation = new_generation
+            else:
+                self.generation = None
+
+    def build(self, env_db, generation, log=None):
+        """Fill the filter with the words of the given `generation`."""
+        try:
+            for count, in env_db.db_query(
+                "SELECT COUNT(*) FROM spamfilter_bayes"):
+                break
+            nbits = max(count * self.bits_per_word, 1024)
+            bits = bytearray((nbits >> 3) + 1)
+            for word, in env_db.db_query(
+                "SELECT word FROM spamfilter_bayes"):
+                for pos in self._positions(word, nbits):
+                    bits[pos >> 3] |= 1 << (pos & 7)
+            for current, in env_db.db_query(
+                "SELECT nspam FROM spamfilter_bayes WHERE word=%s",
+                (TracDbClassifier.generationkey,)):
+                break
+            else:
+                current = None
+            with self.lock:
+                # discard the result if the table was modified meanwhile
+                if current == generation:
+                    self.table = (nbits, bits)
+                    self.capacity = nbits // self.bits_per_word
+                    self.count = count
+                    self.generation = generation
+        except Exception, e:
+            if log:
+                log.warn('Failed to build list of known Bayes words: %s', e)
+        finally:
+            self.building = False
+
+    def build_async(self, env_db, generation, log=None):
+        with self.lock:
+            if self.building:
+                return
+            self.building = True
+        if self.synchronous:
+            self.build(env_db, generation, log)
+            return
+        thread = threading.Thread(target=self.build,
+                                  args=(env_db, generation, log),
+                                  name='SpamFilter-KnownWords')
+        thread.setDaemon(True)
+        thread.start()
+
+    # Internal methods
+
+    def _add(self, word):
+        nbits, bits = self.table
+        for pos in self._positions(word, nbits):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def _positions(self, word, nbits):
+        h1 = hash(word)
+        h2 = hash(word + u'\0') | 1
+        return [(h1 + i * h2) % nbits for i in xrange(self.hashes)]
 
 
 class TracDbClassifier(SQLClassifier):
-    # FIXME: This thing is incredibly slow
 
-    def __init__(self, env_db, log):
+    # Row next to the state key counting the modifications of the table,
+    # so other processes can detect that their cached words are stale.
+    generationkey = 'saved state generation'
+
+    # Maximum number of words looked up by a single query
+    chunk_size = 400
+
+    # Whether the classifier only scores and must not store anything
+    readonly = False
+
+    def __init__(self, env_db, log, cache=None, known=None):
         self.env_db = env_db
         self.log = log
+        self.cache = cache
+        self.known = known
+        self.generation = None
+        self._prefetched = {}
+        self._deltas = {}
         SQLClassifier.__init__(self, 'Trac')
 
     def load(self):
+        self.generation = self.get_generation()
+        self._prefetched = {}
+        self._deltas = {}
+        if self.cache is not None:
+            self.cache.validate(self.generation)
         if self._has_key(self.statekey):
             row = self._get_row(self.statekey)
             self.nspam = row['nspam']
             self.nham = row['nham']
         else: # new database
             self.nspam = self.nham = 0
+        self._stored = (self.nspam, self.nham)
+
+    def refresh(self, generation=False):
+        """Reload the state if the training database was modified by
+        another process, optionally using the already queried
+        `generation`."""
+        if generation is False:
+            generation = self.get_generation()
+        if generation != self.generation:
+            self.load()
+
+    def fork(self, readonly=False):
+        """Return a copy with its own looked up words and pending
+        training, sharing the caches of this classifier."""
+        # SpamBayes classifiers are old-style classes pickling their words
+        bayes = InstanceType(self.__class__, dict(self.__dict__))
+        bayes.readonly = readonly
+        bayes.probcache = {}
+        bayes._prefetched = {}
+        bayes._deltas = {}
+        bayes._stored = (bayes.nspam, bayes.nham)
+        return bayes
+
+    def store(self):
+        with self.env_db.db_transaction as db:
+            updated = self._write_counts(db)
+            generation = self.get_generation(db)
+            if generation is None:
+                new_generation = random.randint(1, 1 << 30)
+                db("INSERT INTO spamfilter_bayes (word,nspam,nham) "
+                   "VALUES (%s,%s,0)", (self.generationkey, new_generation))
+            else:
+                new_generation = generation + 1
+                db("UPDATE spamfilter_bayes SET nspam=%s WHERE word=%s",
+                   (new_generation, self.generationkey))
+        # this includes the training done by other processes meanwhile
+        self.nspam, self.nham = self._stored = updated[self.statekey]
+        self._deltas = {}
+        self._prefetched = {}
+        if self.cache is not None:
+            with self.cache.lock:
+                if generation == self.cache.generation:
+                    self.cache.generation = new_generation
+                    for word, row in updated.iteritems():
+                        self.cache.set(word, row)
+                else:
+                    # modified concurrently, reload from the database
+                    self.cache.clear()
+                    self.cache.generation = None
+        if self.known is not None:
+            for word in updated:
+                self.known.add(word)
+            self.known.update(generation, new_generation)
+        self.generation = new_generation
+
+    def reset(self):
+        """Remove all training data."""
+        # start with a random value, so other processes do not mistake
+        # the new generation for the one they cached
+        generation = random.randint(1, 1 << 30)
+        with self.env_db.db_transaction as db:
+            db("DELETE FROM spamfilter_bayes")
+            db("INSERT INTO spamfilter_bayes (word,nspam,nham) "
+               "VALUES (%s,%s,0)", (self.generationkey, generation))
+        self.generation = generation
+        if self.cache is not None:
+            self.cache.validate(generation)
+        if self.known is not None:
+            self.known.invalidate()
+        self._prefetched = {}
+        self._deltas = {}
+        self.nspam = self.nham = 0
+        self._stored = (0, 0)
+
+    def _add_msg(self, wordstream, is_spam):
+        # Only count the words here, the counts are added to the database
+        # by `store()` without reading the rows first.
+        self.probcache = {}
+        if is_spam:
+            self.nspam += 1
+        else:
+            self.nham += 1
+        deltas = self._deltas
+        for word in set(wordstream):
+            word = self._sanitize(word)
+            delta = deltas.get(word)
+            if delta is None:
+                delta = deltas[word] = [0, 0]
+            delta[0 if is_spam else 1] += 1
+
+    def _write_counts(self, db):
+        """Add the counted words and messages to the database and return
+        the resulting rows."""
+        deltas = dict(self._deltas)
+        deltas[self.statekey] = [self.nspam - self._stored[0],
+                                 self.nham - self._stored[1]]
+        words = deltas.keys()
+        rows = {}
+        for i in xrange(0, len(words), self.chunk_size):
+            chunk = words[i:i + self.chunk_size]
+            for word, nspam, nham in db(
+                    "SELECT word,nspam,nham FROM spamfilter_bayes "
+                    "WHERE word IN (%s)" % ','.join(['%s'] * len(chunk)),
+                    chunk):
+                rows[word] = (nspam, nham)
+        updates = []
+        inserts = []
+        updated = {}
+        for word, (nspam, nham) in deltas.iteritems():
+            if word in rows:
+                if nspam or nham:
+                    updates.append((nspam, nham, word))
+                old = rows[word]
+                updated[word] = (old[0] + nspam, old[1] + nham)
+            else:
+                inserts.append((word, nspam, nham))
+                updated[word] = (nspam, nham)
+        cursor = db.cursor()
+        if updates:
+            cursor.executemany("UPDATE spamfilter_bayes "
+                               "SET nspam=nspam+%s,nham=nham+%s "
+                               "WHERE word=%s", updates)
+        if inserts:
+            cursor.executemany("INSERT INTO spamfilter_bayes "
+                               "(word,nspam,nham) VALUES (%s,%s,%s)",
+                               inserts)
+        return updated
+
+    def get_generation(self, db=None):
+        """Return the generation of the training database."""
+        for generation, in (db or self.env_db.db_query)(
+            "SELECT nspam FROM spamfilter_bayes WHERE word=%s",
+            (self.generationkey,)):
+            return generation
 
     def _sanitize(self, text):
         if isinstance(text, unicode):
@@ -126,17 +516,81 @@ class TracDbClassifier(SQLClassifier):
         """Remove invalid byte sequences from utf-8 encoded text"""
         return text.decode('utf-8', 'ignore')
 
-    def _get_row(self, word):
-        word = self._sanitize(word)
+    def prefetch(self, wordstream):
+        """Look up all words needed to score `wordstream` with a few
+        queries, so scoring does not hit the database for each word."""
+        if options["Classifier", "use_bigrams"]:
+            wordstream = self._enhance_wordstream(wordstream)
+        self._prefetched = {}
+        missing = set()
+        for word in wordstream:
+            word = self._sanitize(word)
+            if word in self._prefetched or word in missing:
+                continue
+            row = self._lookup(word)
+            if row is not False:
+                self._prefetched[word] = row
+            else:
+                missing.add(word)
+        missing = list(missing)
+        for i in xrange(0, len(missing), self.chunk_size):
+            chunk = missing[i:i + self.chunk_size]
+            rows = dict((word, (nspam, nham))
+                        for word, nspam, nham in self.env_db.db_query(
+                            "SELECT word,nspam,nham FROM spamfilter_bayes "
+                            "WHERE word IN (%s)" % ','.join(['%s'] * len(chunk)),
+                            chunk))
+            for word in chunk:
+                row = rows.get(word)
+                self._prefetched[word] = row
+                if self.cache is not None:
+                    self.cache.set(word, row)
+
+    def _lookup(self, word):
+        """Return the row of `word` without querying the database or
+        `False` if that is not possible."""
+        if self.cache is not None:
+            try:
+                return self.cache.get(word)
+            except KeyError:
+                pass
+        known = self.known
+        if known is not None and known.valid(self.generation) and \
+                word not in known:
+            return None
+        return False
+
+    def _fetch_row(self, word):
+        try:
+            return self._prefetched[word]
+        except KeyError:
+            pass
+        row = self._lookup(word)
+        if row is not False:
+            return row
         for row in self.env_db.db_query(
             "SELECT nspam,nham FROM spamfilter_bayes WHERE word=%s",
             (word,)):
+            row = tuple(row)
             break
         else:
+            row = None
+        if self.cache is not None:
+            self.cache.set(word, row)
+        return row
+
+    def _get_row(self, word):
+        word = self._sanitize(word)
+        row = self._fetch_row(word)
+        if row is None:
             return {}
+        if self.readonly and word != self.statekey:
+            # trained meanwhile, score with the newer counts
+            self.nspam = max(self.nspam, row[0])
+            self.nham = max(self.nham, row[1])
         # prevent assertion - happens when there are failures in training and
         # the count is not updated due to an exception
-        if word != self.statekey:
+        elif word != self.statekey:
             if row[0] > self.nspam:
                 self.log.warn('Reset SPAM count from %d to %d due to keyword \'%s\'.',
                               self.nspam, row[0], word)
@@ -158,14 +612,24 @@ class TracDbClassifier(SQLClassifier):
             else:
                 db("INSERT INTO spamfilter_bayes (word,nspam,nham) "
                    "VALUES (%s,%s,%s)", (word, nspam, nham))
+        self._prefetched.pop(word, None)
+        if self.cache is not None:
+            self.cache.set(word, (nspam, nham))
+        if self.known is not None:
+            self.known.add(word)
 
     def _delete_row(self, word):
         word = self._sanitize(word)
         self.env_db.db_transaction(
             "DELETE FROM spamfilter_bayes WHERE word=%s", (word,))
+        self._prefetched.pop(word, None)
+        if self.cache is not None:
+            self.cache.set(word, None)
 
     def _has_key(self, key):
         key = self._sanitize(key)
+        if self.cache is not None:
+            return self._fetch_row(key) is not None
         for count, in self.env_db.db_query(
             "SELECT COUNT(*) FROM spamfilter_bayes WHERE word=%s",
             (key,)):
@@ -20,8 +20,8 @@ from pkg_resources import get_distribution
 from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option, ListOption
 from trac.core import *
-from tracspamfilter.api import IFilterStrategy, N_
-from tracspamfilter.timeoutserverproxy import TimeoutServerProxy
+from tracspamfilter.api import IFilterStrategy, N_, ServiceUnavailable
+from tracspamfilter.timeoutserverproxy import get_server_proxy
 from trac.mimeview.api import is_binary
 
 class BlogSpamFilterStrategy(Component):
@@ -53,14 +53,12 @@ class BlogSpamFilterStrategy(Component):
             return
 
         try:
-            server = TimeoutServerProxy("http://"+self.api_url)
+            server = get_server_proxy("http://"+self.api_url)
             res = server.testComment(self._getparams(req, author, content, ip))
             if res.startswith("SPAM:"):
                 return -abs(self.karma_points), N_('BlogSpam says content is spam (%s)'), res[5:]
         except Exception, v:
-            self.log.warning('Checking with BlogSpam failed: %s', v)
-        except IOError, v:
-            self.log.warning("Checking with BlogSpam failed: %s", v)
+            raise ServiceUnavailable('Checking with BlogSpam failed: %s' % v)
 
     def train(self, req, author, content, ip, spam=True):
         if not self._check_preconditions(req, author, content):
@@ -72,7 +70,7 @@ class BlogSpamFilterStrategy(Component):
                 params['train'] = "spam"
             else:
                 params['train'] = "ham"
-            server = TimeoutServerProxy("http://"+self.api_url)
+            server = get_server_proxy("http://"+self.api_url)
             res = server.classifyComment(params)
             self.log.debug('Classifying with BlogSpam succeeded: %s', res)
             return 1
@@ -84,7 +82,7 @@ class BlogSpamFilterStrategy(Component):
 
     def getmethods(self):
         try:
-            server=TimeoutServerProxy("http://"+self.api_url)
+            server=get_server_proxy("http://"+self.api_url)
             return server.getPlugins();
         except Exception:
             return ""
@@ -11,7 +11,6 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://projects.edgewall.com/trac/.
 
-from email.Utils import parseaddr
 from urllib import urlencode
 import urllib2
 import re
@@ -21,7 +20,10 @@ from pkg_resources import get_distribution
 from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, N_, ServiceUnavailable, \
+                               get_strategy_name
+from tracspamfilter.httpclient import HTTPClient
+from tracspamfilter.reputation import ReputationCache, get_identifiers
 
 class BotScoutFilterStrategy(Component):
     """Spam filter using the BotScount (http://botscout.com/).
@@ -47,20 +49,30 @@ class BotScoutFilterStrategy(Component):
     def test(self, req, author, content, ip):
         if not self._check_preconditions(False):
             return
+        identifiers = get_identifiers(author, ip)
+        cache = ReputationCache(self.env)
         try:
-            resp = self._send(req, author, ip)
-            if resp.startswith("Y"):
-                count = 0
+            answers = cache.get(get_strategy_name(self), identifiers)
+            if answers is None:
+                resp = self._send(identifiers, ip)
+                # the number of reports of the IP, email and name
                 res = string.split(resp, '|')
-                if res[3] != "0":
-                  count += 1
-                if res[5] != "0":
-                  count += 1
-                if res[7] != "0":
-                  count += 1
+                if len(res) < 8:
+                    raise ServiceUnavailable('BotScout request failed (%s)'
+                                             % resp)
+                counts = {'ip': res[3], 'email': res[5], 'username': res[7]}
+                answers = [counts[entry] for entry, value in identifiers]
+                cache.set(get_strategy_name(self), identifiers, answers)
+            counts = dict((entry, answer) for (entry, value), answer
+                          in zip(identifiers, answers))
+            res = [counts.get(entry, '0') for entry in ('ip', 'email',
+                                                        'username')]
+            count = len([c for c in res if c != "0"])
+            if count:
+                resp = 'Y|MULTI|IP|%s|MAIL|%s|NAME|%s' % tuple(res)
                 return -abs(self.karma_points)*count, N_('BotScout says this is spam (%s)'), resp
         except urllib2.URLError, e:
-            self.log.warn('BotScout request failed (%s)', e)
+            raise ServiceUnavailable('BotScout request failed (%s)' % e)
 
     def train(self, req, author, content, ip, spam=True):
         return 0
@@ -76,17 +88,10 @@ class BotScoutFilterStrategy(Component):
 
         return True
 
-    def _send(self, req, author, ip):
-        # Split up author into name and email, if possible
-        author = author.encode('utf-8')
-        author_name, author_email = parseaddr(author)
-        if not author_name and not author_email:
-            author_name = author
-        elif not author_name and author_email.find("@") < 1:
-            author_name = author
-            author_email = None
-        if author_name == "anonymous":
-            author_name = None
+    def _send(self, identifiers, ip):
+        identifiers = dict(identifiers)
+        author_name = identifiers.get('username')
+        author_email = identifiers.get('email')
 
         params = {'ip': ip , 'key': self.api_key}
         if author_name:
@@ -95,7 +100,5 @@ class BotScoutFilterStrategy(Component):
             params['mail'] = author_email
 
         url = 'http://botscout.com/test/?multi&' + urlencode(params)
-        urlreq = urllib2.Request(url, None, {'User-Agent' : self.user_agent})
-
-        resp = urllib2.urlopen(urlreq)
-        return resp.read()
+        return HTTPClient(self.env).fetch(url, None,
+                                          {'User-Agent' : self.user_agent})
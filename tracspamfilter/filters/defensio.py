@@ -31,8 +31,8 @@ from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
 from trac.mimeview.api import is_binary
-from tracspamfilter.api import IFilterStrategy, N_
-from tracspamfilter.timeoutserverproxy import TimeoutHTTPConnection
+from tracspamfilter.api import IFilterStrategy, N_, ServiceUnavailable
+from tracspamfilter.httpclient import HTTPClient
 
 class DefensioFilterStrategy(Component):
     """Spam filter using the Defensio service (http://defensio.com/).
@@ -91,7 +91,8 @@ class DefensioFilterStrategy(Component):
                     self._getresult(resp, 'classification', 'unknown'), \
                     str(val), message
         except Exception, e:
-            self.log.warn('Defensio testing request failed (%s)', e)
+            raise ServiceUnavailable('Defensio testing request failed (%s)'
+                                     % e)
 
     def train(self, req, author, content, ip, spam=True):
         if not self._check_preconditions(req, author, content):
@@ -180,26 +181,23 @@ class DefensioFilterStrategy(Component):
 
     def _call(self, method, url, data=None):
         """ Do the actual HTTP request """
-        offs = url.find('/')
-        api_host = url[:offs]
-        path = url[offs:]
-        conn = TimeoutHTTPConnection(api_host)
         headers = {'User-Agent' : self.user_agent}
 
         if data:
             headers.update( {'Content-type': 'application/x-www-form-urlencoded'} )
-            conn.request(method, path, self._urlencode(data), headers)
+            response = HTTPClient(self.env).request(method, 'http://' + url,
+                                                    self._urlencode(data),
+                                                    headers)
         else:
-            conn.request(method, path, None, headers)
+            response = HTTPClient(self.env).request(method, 'http://' + url,
+                                                    None, headers)
 
-        response = conn.getresponse()
-        body = response.read()
+        body = response.body
         if is_python3():
             body = json.loads(body.decode('UTF-8'))
         else:
             body = json.loads(body)
         result   =  [response.status, body]
-        conn.close()
         return result
 
     def _parse_body(self, body):
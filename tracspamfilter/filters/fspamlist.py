@@ -11,7 +11,6 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://projects.edgewall.com/trac/.
 
-from email.Utils import parseaddr
 from urllib import quote
 import urllib2
 import re
@@ -22,7 +21,10 @@ import string
 from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, N_, ServiceUnavailable, \
+                               get_strategy_name
+from tracspamfilter.httpclient import HTTPClient
+from tracspamfilter.reputation import ReputationCache, get_identifiers
 
 class FSpamListFilterStrategy(Component):
     """Spam filter using the FSpamList (http://www.fspamlist.com/).
@@ -48,25 +50,35 @@ class FSpamListFilterStrategy(Component):
     def test(self, req, author, content, ip):
         if not self._check_preconditions(False):
             return
+        identifiers = get_identifiers(author, ip)
+        cache = ReputationCache(self.env)
         try:
-            resp = self._send(req, author, ip)
-            reason = []
-            tree = ElementTree.fromstring(resp)
-            for el in list(tree):
-                if el.findtext('isspammer', 'false') == 'true':
-                    r = "%s [%s" % (el.findtext('spammer','-'), \
-                        el.findtext('threat','-'))
-                    n = string.split(el.findtext('notes', '-'), \
-                        "Time taken")[0].rstrip(" ")
-                    if n != "":
-                      r += ", " + n
-                    r += "]"
-                    reason.append(r)
+            answers = cache.get(get_strategy_name(self), identifiers)
+            if answers is None:
+                resp = self._send(identifiers, ip)
+                # the reason if listed, an empty string otherwise
+                reasons = {}
+                tree = ElementTree.fromstring(resp)
+                for el in list(tree):
+                    if el.findtext('isspammer', 'false') == 'true':
+                        r = "%s [%s" % (el.findtext('spammer','-'), \
+                            el.findtext('threat','-'))
+                        n = string.split(el.findtext('notes', '-'), \
+                            "Time taken")[0].rstrip(" ")
+                        if n != "":
+                          r += ", " + n
+                        r += "]"
+                        spammer = el.findtext('spammer', '').encode('utf-8')
+                        reasons[spammer.lower()] = r
+                answers = [reasons.get(value.lower(), '')
+                           for entry, value in identifiers]
+                cache.set(get_strategy_name(self), identifiers, answers)
+            reason = [r for r in answers if r]
             if len(reason):
                 return -abs(self.karma_points)*len(reason), \
                     N_('FSpamList says this is spam (%s)'), ("; ".join(reason))
         except urllib2.URLError, e:
-            self.log.warn('FSpamList request failed (%s)', e)
+            raise ServiceUnavailable('FSpamList request failed (%s)' % e)
 
     def train(self, req, author, content, ip, spam=True):
         return 0
@@ -82,17 +94,10 @@ class FSpamListFilterStrategy(Component):
 
         return True
 
-    def _send(self, req, author, ip):
-        # Split up author into name and email, if possible
-        author = author.encode('utf-8')
-        author_name, author_email = parseaddr(author)
-        if not author_name and not author_email:
-            author_name = author
-        elif not author_name and author_email.find("@") < 1:
-            author_name = author
-            author_email = None
-        if author_name == "anonymous":
-            author_name = None
+    def _send(self, identifiers, ip):
+        identifiers = dict(identifiers)
+        author_name = identifiers.get('username')
+        author_email = identifiers.get('email')
 
         request = quote(ip)
         if author_name:
@@ -101,8 +106,6 @@ class FSpamListFilterStrategy(Component):
             request += "," + quote(author_email)
 
         url = 'http://www.fspamlist.com/api.php?spammer=' + request + "&key=" + self.api_key
-        urlreq = urllib2.Request(url, None, {'User-Agent' : self.user_agent})
-
-        resp = urllib2.urlopen(urlreq)
-        return resp.read()
+        return HTTPClient(self.env).fetch(url, None,
+                                          {'User-Agent' : self.user_agent})
 
@@ -16,12 +16,14 @@
 # Author: Vaclav Slavik <vslavik@fastmail.fm>,
 #         Matthew Good <trac@matt-good.net>
 
-from dns.resolver import query, Timeout, NXDOMAIN, NoAnswer, NoNameservers
+from dns.exception import DNSException
+from dns.resolver import NXDOMAIN
 
 from trac.config import Option, IntOption
 from trac.core import *
 from trac.util import reversed
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, N_, ServiceUnavailable
+from tracspamfilter.resolver import DNSResolver
 
 class HttpBLFilterStrategy(Component):
     """Spam filter based on Project Honey Pot's Http:BL blacklist.
@@ -52,7 +54,7 @@ class HttpBLFilterStrategy(Component):
         self.log.debug('Querying Http:BL: %s' % addr)
 
         try:
-            dns_answer = query(addr)
+            dns_answer = DNSResolver(self.env).query(addr)
             answer = [int(i) for i in str(dns_answer[0]).split('.')]
             if answer[0] != 127:
                 self.log.warning('Invalid Http:BL reply for IP "%s": %s' %
@@ -78,9 +80,9 @@ class HttpBLFilterStrategy(Component):
         except NXDOMAIN:
             # not blacklisted on this server
             return
-        except (Timeout, NoAnswer, NoNameservers), e:
-            self.log.warning('Error checking Http:BL for IP "%s": %s' %
-                             (ip, e))
+        except DNSException, e:
+            raise ServiceUnavailable('Error checking Http:BL for IP "%s": %s'
+                                     % (ip, e))
 
     def train(self, req, author, content, ip, spam=True):
         return 0
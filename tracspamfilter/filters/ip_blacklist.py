@@ -14,13 +14,17 @@
 #
 # Author: Matthew Good <trac@matt-good.net>
 
+from dns.exception import DNSException
 from dns.name import from_text
-from dns.resolver import query, Timeout, NXDOMAIN, NoAnswer, NoNameservers
+from dns.resolver import NXDOMAIN
 
 from trac.config import ListOption, IntOption
 from trac.core import *
 from trac.util import reversed
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, N_, ServiceUnavailable
+from tracspamfilter.ipset import RBLZone
+from tracspamfilter.patternfile import PatternFile
+from tracspamfilter.resolver import DNSResolver
 
 class IPBlacklistFilterStrategy(Component):
     """Spam filter based on IP blacklistings.
@@ -37,6 +41,22 @@ class IPBlacklistFilterStrategy(Component):
                          'list.blogspambl.com, all.s5h.net, dnsbl.tornevall.org', doc=
         """Servers used for IP blacklisting.""", doc_domain="tracspamfilter")
 
+    zones = ListOption('spam-filter', 'ip_blacklist_zones', '', doc=
+        """Local copies of IP blacklists as `name=path` pairs, where `path`
+        is a zone file in the `ip4set` or `ip4trie` format of rbldnsd.
+        These lists are looked up in memory instead of via DNS, also when
+        `name` is one of `ip_blacklist_servers`.""",
+        doc_domain="tracspamfilter")
+
+    zone_interval = IntOption('spam-filter', 'ip_blacklist_zone_interval',
+                              '60',
+        """Seconds between checks whether the files of
+        `ip_blacklist_zones` changed and need to be reloaded.""",
+        doc_domain="tracspamfilter")
+
+    def __init__(self):
+        self._zones = {}
+
     # IFilterStrategy implementation
 
     def is_external(self):
@@ -46,7 +66,7 @@ class IPBlacklistFilterStrategy(Component):
         if not self._check_preconditions(req, author, content, ip):
             return
 
-        if not self.servers:
+        if not self.servers and not self.zones:
             self.log.warning('No IP blacklist servers configured')
             return
 
@@ -54,28 +74,49 @@ class IPBlacklistFilterStrategy(Component):
 
         points = 0
         servers = []
-
-        prefix = '.'.join(reversed(ip.split('.'))) + '.'
-        for server in self.servers:
-            self.log.debug("Checking blacklist %s for %s" % (server, ip))
-            try:
-                res = query(from_text(prefix + server.encode('utf-8')))[0].to_text()
-                points -= abs(self.karma_points)
-                if res == "127.0.0.1":
-                    servers.append(server)
-                else:
-                    # strip the common part of responses
-                    if res.startswith("127.0.0."):
-                      res = res[8:]
-                    elif res.startswith("127."):
-                      res = res[4:]
-                    servers.append("%s [%s]" %(server, res))
-            except NXDOMAIN: # not blacklisted on this server
-                continue
-            except (Timeout, NoAnswer, NoNameservers), e:
-                self.log.warning('Error checking IP blacklist server "%s" for '
-                                 'IP "%s": %s' % (server, ip, e))
-
+        failed = 0
+
+        zones = self._get_zones()
+        remote = [server for server in self.servers if server not in zones]
+        lists = self.servers + [name for name in zones
+                                if name not in self.servers]
+        answers = {}
+        if remote:
+            prefix = '.'.join(reversed(ip.split('.'))) + '.'
+            names = [from_text(prefix + server.encode('utf-8'))
+                     for server in remote]
+            answers = dict(zip(remote,
+                               DNSResolver(self.env).query_all(names)))
+        for server in lists:
+            self.log.debug("Checked blacklist %s for %s" % (server, ip))
+            if server in zones:
+                res = zones[server].matcher.lookup(ip)
+                if res is None: # not blacklisted on this list
+                    continue
+            else:
+                answer = answers[server]
+                if isinstance(answer, NXDOMAIN): # not listed on this server
+                    continue
+                elif isinstance(answer, DNSException):
+                    self.log.warning('Error checking IP blacklist server "%s" '
+                                     'for IP "%s": %s' % (server, ip, answer))
+                    failed += 1
+                    continue
+                res = answer[0].to_text()
+            points -= abs(self.karma_points)
+            if res == "127.0.0.1":
+                servers.append(server)
+            else:
+                # strip the common part of responses
+                if res.startswith("127.0.0."):
+                  res = res[8:]
+                elif res.startswith("127."):
+                  res = res[4:]
+                servers.append("%s [%s]" %(server, res))
+
+        if remote and failed == len(lists):
+            raise ServiceUnavailable('No IP blacklist server answered for '
+                                     'IP "%s"' % ip)
         if points != 0:
             return points, N_('IP %s blacklisted by %s'), ip, ', '.join(servers)
 
@@ -84,6 +125,30 @@ class IPBlacklistFilterStrategy(Component):
 
     # Internal methods
 
+    def _get_zones(self):
+        """Return the loaded zone files of `ip_blacklist_zones` by name."""
+        zones = {}
+        loaded = {}
+        for item in self.zones:
+            name, sep, path = item.partition('=')
+            name, path = name.strip(), path.strip()
+            if not sep or not name or not path:
+                self.log.warning('Invalid IP blacklist zone "%s"' % item)
+                continue
+            zone = self._zones.get((name, path))
+            if zone is None:
+                zone = PatternFile(path, self.log,
+                                   lambda lines, previous: RBLZone(lines),
+                                   name=name)
+                zone.load()
+            loaded[(name, path)] = zone
+            zone.interval = self.zone_interval
+            zone.check()
+            zones[name] = zone
+        # forget the zones which are no longer configured
+        self._zones = loaded
+        return zones
+
     def _check_preconditions(self, req, author, content,ip):
         if self.karma_points == 0:
             return False
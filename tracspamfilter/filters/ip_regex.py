@@ -17,13 +17,35 @@
 # Author: Dirk Stöcker <trac@dstoecker.de>,
 #         Matthew Good <trac@matt-good.net>
 
-import re
-
+from trac.cache import cached
 from trac.config import IntOption, Option, BoolOption
 from trac.core import *
 from trac.wiki.api import IWikiChangeListener
 from trac.wiki.model import WikiPage
 from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.filtersystem import FilterSystem
+from tracspamfilter.ipset import IPSet
+from tracspamfilter.patternfile import PatternFile
+from tracspamfilter.regexmatcher import PatternMatcher, PatternStats, \
+                                        compile_patterns
+
+
+class IPMatcher(object):
+    """Match IP addresses against networks and regular expressions."""
+
+    def __init__(self, networks, patterns):
+        self.networks = networks
+        self.regexes = PatternMatcher(patterns)
+        self.patterns = self.regexes.patterns
+
+    def __len__(self):
+        return len(self.networks) + len(self.patterns)
+
+    def search(self, ip, stats=None):
+        """Return the matching entries, networks first."""
+        return self.networks.lookup(ip) + \
+               [pattern.pattern for pattern in self.regexes.search(ip, stats)]
+
 
 class IPRegexFilterStrategy(Component):
     """Spam filter for submitter's IP based on regular expressions
@@ -37,23 +59,38 @@ class IPRegexFilterStrategy(Component):
     badcontent_file = Option('spam-filter', 'ipbadcontent_file', '',
         """Local file to be loaded to get BadIP. Can be used in
         addition to BadIP wiki page.""", doc_domain="tracspamfilter")
+    file_interval = IntOption('spam-filter', 'ipbadcontent_file_interval', '60',
+        """Seconds between checks whether the BadIP file changed.
+        A changed file is reloaded in the background.""",
+        doc_domain="tracspamfilter")
     show_blacklisted = BoolOption('spam-filter', 'show_blacklisted_ip', 'true',
         """Show the matched bad IP patterns in rejection message.""", doc_domain="tracspamfilter")
+    max_time = IntOption('spam-filter', 'ipregex_max_time', '500',
+        """Time in milliseconds a pattern of the BadIP page may take to
+        search an IP address. Slower patterns are quarantined, i.e. skipped
+        until the pattern statistics are reset. Use 0 to disable.""",
+        doc_domain="tracspamfilter")
+    cidr = BoolOption('spam-filter', 'ipregex_cidr', 'false',
+        """Treat lines of the BadIP page and file which are IP addresses,
+        networks like `192.0.2.0/24` or ranges like `192.0.2.5-192.0.2.9`
+        as such instead of as regular expressions. Works for IPv4 and
+        IPv6.""", doc_domain="tracspamfilter")
 
     def __init__(self):
-        self.patterns = []
-        page = WikiPage(self.env, 'BadIP')
-        if page.exists:
-            self._load_patterns(page)
+        self._stats = PatternStats(self.log)
+        self._file = None
         if self.badcontent_file != '':
-            file = open(self.badcontent_file,"r")
-            if file == None:
-                self.log.warning('BadIP file cannot be opened')
-            else:
-                lines = file.read().splitlines()
-                pat = [re.compile(p.strip()) for p in lines if p.strip()]
-                self.log.debug('Loaded %s patterns from BadIP file', len(pat))
-                self.patterns += pat
+            self._file = PatternFile(self.badcontent_file, self.log,
+                                     self._build, name='BadIP')
+            self._file.load()
+
+    @property
+    def patterns(self):
+        """The compiled regular expressions, in their original order."""
+        patterns = self._matcher.patterns
+        if self._file:
+            patterns += self._file.matcher.patterns
+        return patterns
 
     # IFilterStrategy implementation
 
@@ -63,13 +100,16 @@ class IPRegexFilterStrategy(Component):
     def test(self, req, author, content, ip):
         gotcha = []
         points = 0
-        for pattern in self.patterns:
-            match = pattern.search(ip)
-            if match:
-                gotcha.append("'%s'" % pattern.pattern)
-                self.log.debug('Pattern %s found in submission',
-                               pattern.pattern)
-                points -= abs(self.karma_points)
+        self._stats.max_time = self.max_time / 1000.0
+        matches = self._matcher.search(ip, self._stats)
+        if self._file:
+            self._file.interval = self.file_interval
+            self._file.check()
+            matches += self._file.matcher.search(ip, self._stats)
+        for entry in matches:
+            gotcha.append("'%s'" % entry)
+            self.log.debug('Pattern %s found in submission', entry)
+            points -= abs(self.karma_points)
         if points != 0:
             if self.show_blacklisted:
                 matches = ", ".join(gotcha)
@@ -84,22 +124,60 @@ class IPRegexFilterStrategy(Component):
 
     def wiki_page_changed(self, page, *args):
         if page.name == 'BadIP':
-            self._load_patterns(page)
+            del self._matcher
+            FilterSystem(self.env).invalidate_verdicts()
     wiki_page_added = wiki_page_changed
+    wiki_page_deleted = wiki_page_changed
     wiki_page_version_deleted = wiki_page_changed
 
-    def wiki_page_deleted(self, page):
-        if page.name == 'BadIP':
-            self.patterns = []
+    def wiki_page_renamed(self, page, old_name):
+        if 'BadIP' in (page.name, old_name):
+            del self._matcher
+            FilterSystem(self.env).invalidate_verdicts()
+
+    def get_pattern_stats(self):
+        """Return search statistics and quarantine state per pattern."""
+        return self._stats.get_stats(self.patterns)
+
+    def reset_pattern_stats(self):
+        """Clear the statistics and lift the quarantine of slow patterns."""
+        self._stats.reset()
+        self._stats.check(self.patterns)
 
     # Internal methods
 
+    @cached
+    def _matcher(self):
+        """Matcher for the entries of the BadIP page.
+
+        Deleting the attribute invalidates it in all processes, which then
+        build a new matcher on their next request.
+        """
+        matcher = self._build([])
+        page = WikiPage(self.env, 'BadIP')
+        if page.exists:
+            matcher = self._load_patterns(page)
+        return matcher
+
     def _load_patterns(self, page):
         if '{{{' in page.text and '}}}' in page.text:
             lines = page.text.split('{{{', 1)[1].split('}}}', 1)[0].splitlines()
-            self.patterns = [re.compile(p.strip()) for p in lines if p.strip()]
+            matcher = self._build(lines)
             self.log.debug('Loaded %s patterns from BadIP',
-                           len(self.patterns))
+                           len(matcher))
+            return matcher
         else:
             self.log.warning('BadIP page does not contain any patterns')
-            self.patterns = []
+            return self._build([])
+
+    def _build(self, lines, previous=None):
+        networks = IPSet()
+        if self.cidr:
+            lines = (line for line in lines if not networks.add(line))
+        patterns = compile_patterns(lines, self.log, 'BadIP',
+                                    previous and previous.patterns or ())
+        self._stats.check(patterns)
+        if previous is not None:
+            # every process reloads the file by itself
+            FilterSystem(self.env).invalidate_verdicts(local=True)
+        return IPMatcher(networks, patterns)
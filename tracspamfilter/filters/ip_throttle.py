@@ -11,12 +11,15 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://projects.edgewall.com/trac/.
 
-from datetime import datetime, timedelta
+import threading
+import time
 
-from trac.config import IntOption
+from trac.config import BoolOption, IntOption, ListOption
 from trac.core import *
 from tracspamfilter.api import IFilterStrategy, N_
-from tracspamfilter.model import LogEntry
+from tracspamfilter.ipset import format_network, parse_address
+from tracspamfilter.model import Throttle
+from tracspamfilter.ratelimit import SlidingWindow
 
 class IPThrottleFilterStrategy(Component):
     """Spam filter strategy that throttles multiple subsequent submissions from
@@ -33,23 +36,107 @@ class IPThrottleFilterStrategy(Component):
         address. If this limit is exceeded, subsequent submissions get negative
         karma.""", doc_domain="tracspamfilter")
 
+    shared = BoolOption('spam-filter', 'ip_throttle_shared', 'false',
+        """Whether the submissions per IP address are counted in the
+        database, so all processes serving the environment share the counts.
+        Otherwise every process counts in memory, starting with the
+        submissions in the log of the last hour.""",
+        doc_domain="tracspamfilter")
+
+    networks = ListOption('spam-filter', 'ip_throttle_networks', '', doc=
+        """Limits for the submissions per hour from whole networks, as
+        `version/length:max_posts:karma` entries. E.g. `ipv4/24:30:3,
+        ipv6/64:30:3` gives negative karma when more than 30 submissions
+        come from the same /24 IPv4 or /64 IPv6 network. The karma defaults
+        to `ip_throttle_karma`.""", doc_domain="tracspamfilter")
+
+    size = IntOption('spam-filter', 'ip_throttle_size', '100000',
+        """Maximum number of IP addresses and networks counted in memory,
+        the least recently seen ones are forgotten first.""",
+        doc_domain="tracspamfilter")
+
+    def __init__(self):
+        self._window = SlidingWindow(3600, 60, self.size)
+        self._seeded = False
+        self._purged = None
+        self._lock = threading.Lock()
+
     # IFilterStrategy implementation
 
     def is_external(self):
         return False
 
     def test(self, req, author, content, ip):
-        threshold = datetime.now() - timedelta(hours=1)
-        num_posts = 0
-
-        for entry in LogEntry.select(self.env, ipnr=ip):
-            if datetime.fromtimestamp(entry.time) < threshold:
-                break
-            num_posts += 1
+        points = 0
+        reason = None
+        for name, max_posts, karma in self._get_limits(ip):
+            # the current submission is counted, too
+            num_posts = self._add(name) - 1
+            if max_posts > 0 and num_posts > max_posts:
+                points += -abs(karma) * num_posts / max_posts
+                if reason is None:
+                    if name == ip:
+                        reason = (N_('Maximum number of posts per hour for '
+                                     'this IP exceeded'),)
+                    else:
+                        reason = (N_('Maximum number of posts per hour for '
+                                     'network %s exceeded'), name)
 
-        if num_posts > self.max_posts:
-            return -abs(self.karma_points) * num_posts / self.max_posts, \
-                   N_('Maximum number of posts per hour for this IP exceeded')
+        if points:
+            return (points,) + reason
 
     def train(self, req, author, content, ip, spam=True):
         return 0
+
+    # Internal methods
+
+    def _get_limits(self, ip):
+        """Return the `(name, max_posts, karma)` limits for the address and
+        the configured networks of `ip`."""
+        limits = [(ip, self.max_posts, self.karma_points)]
+        parsed = parse_address(ip)
+        if not parsed:
+            return limits
+        for entry in self.networks:
+            parts = entry.split(':')
+            try:
+                version, length = parts[0].strip().lower().split('/')
+                length = int(length)
+                max_posts = int(parts[1])
+                karma = int(parts[2]) if len(parts) > 2 else self.karma_points
+            except (ValueError, IndexError):
+                self.log.warning('Invalid IP throttle network "%s"', entry)
+                continue
+            if version == 'ipv%d' % parsed[0]:
+                name = format_network(ip, length)
+                if name is not None:
+                    limits.append((name, max_posts, karma))
+        return limits
+
+    def _add(self, name):
+        """Count a submission of `name` and return the number of its
+        submissions in the last hour."""
+        window = self._window
+        if self.shared:
+            slot = window.slot()
+            since = slot - window.buckets
+            if self._purged != since:
+                self._purged = since
+                Throttle(self.env).purge(since)
+            return Throttle(self.env).add(name, slot, since)
+        self._seed()
+        window.size = self.size
+        return window.add(name)
+
+    def _seed(self):
+        """Count the submissions of the last hour found in the log."""
+        with self._lock:
+            if self._seeded:
+                return
+            self._seeded = True
+            since = int(time.time() - self._window.window)
+            for ipnr, when in self.env.db_query("""
+                    SELECT ipnr,time FROM spamfilter_log WHERE time>%s
+                    """, (since,)):
+                for name, max_posts, karma in self._get_limits(ipnr):
+                    self._window.add(name, when)
@@ -11,15 +11,16 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://projects.edgewall.com/trac/.
 
-import urllib2
+import httplib
 from urllib import urlencode
+import xmlrpclib
 from pkg_resources import get_distribution
 
 from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
-from tracspamfilter.api import IFilterStrategy, N_
-from tracspamfilter.timeoutserverproxy import TimeoutServerProxy
+from tracspamfilter.api import IFilterStrategy, N_, ServiceUnavailable
+from tracspamfilter.timeoutserverproxy import get_server_proxy
 
 class LinkSleeveFilterStrategy(Component):
     """Spam filter using the LinkSleeve service (http://linksleeve.org/).
@@ -43,10 +44,10 @@ class LinkSleeveFilterStrategy(Component):
         if not self._check_preconditions(False):
             return
         try:
-            if TimeoutServerProxy('http://www.linksleeve.org/slv.php').slv(content) != 1:
+            if get_server_proxy('http://www.linksleeve.org/slv.php').slv(content) != 1:
                 return -abs(self.karma_points), N_('LinkSleeve says this is spam')
-        except urllib2.URLError, e:
-            self.log.warn('LinkSleeve request failed (%s)', e)
+        except (IOError, httplib.HTTPException, xmlrpclib.Error), e:
+            raise ServiceUnavailable('LinkSleeve request failed (%s)' % e)
 
     def train(self, req, author, content, ip, spam=True):
         return 0
@@ -13,7 +13,6 @@
 
 from email.Utils import parseaddr
 from urllib import urlencode
-import httplib2
 import urllib2
 import oauth2
 from pkg_resources import get_distribution
@@ -23,7 +22,8 @@ from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
 from trac.mimeview.api import is_binary
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, N_, ServiceUnavailable
+from tracspamfilter.httpclient import HTTPClient
 
 
 class MollomFilterStrategy(Component):
@@ -104,7 +104,7 @@ class MollomFilterStrategy(Component):
                 return int(karma+0.5), N_('Mollom says content is ham')
 
         except urllib2.URLError, e:
-            self.log.warn('Mollom request failed (%s)', e)
+            raise ServiceUnavailable('Mollom request failed (%s)' % e)
 
     def train(self, req, author, content, ip, spam=True):
         return 0
@@ -129,7 +129,8 @@ class MollomFilterStrategy(Component):
         req = oauth2.Request.from_consumer_and_token(consumer, http_method="POST", http_url=url, body=body)
         req.sign_request(oauth2.SignatureMethod_HMAC_SHA1(), consumer, None)
         headers.update(req.to_header())
-        return httplib2.Http().request(url, method="POST", body=body, headers=headers)
+        response = HTTPClient(self.env).request("POST", url, body, headers)
+        return response, response.body
 
     def _check_preconditions(self, req, author, content):
         if self.karma_points == 0:
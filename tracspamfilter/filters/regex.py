@@ -15,13 +15,16 @@
 #
 # Author: Matthew Good <trac@matt-good.net>
 
-import re
-
+from trac.cache import cached
 from trac.config import IntOption, Option, BoolOption
 from trac.core import *
 from trac.wiki.api import IWikiChangeListener
 from trac.wiki.model import WikiPage
 from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.filtersystem import FilterSystem
+from tracspamfilter.patternfile import PatternFile
+from tracspamfilter.regexmatcher import PatternMatcher, PatternStats, \
+                                        compile_patterns
 
 class RegexFilterStrategy(Component):
     """Spam filter based on regular expressions defined in BadContent page.
@@ -34,23 +37,33 @@ class RegexFilterStrategy(Component):
     badcontent_file = Option('spam-filter', 'badcontent_file', '',
         """Local file to be loaded to get BadContent. Can be used in
         addition to BadContent wiki page.""", doc_domain="tracspamfilter")
+    file_interval = IntOption('spam-filter', 'badcontent_file_interval', '60',
+        """Seconds between checks whether the BadContent file changed.
+        A changed file is reloaded in the background.""",
+        doc_domain="tracspamfilter")
     show_blacklisted = BoolOption('spam-filter', 'show_blacklisted', 'true',
         """Show the matched bad content patterns in rejection message.""", doc_domain="tracspamfilter")
+    max_time = IntOption('spam-filter', 'regex_max_time', '500',
+        """Time in milliseconds a pattern of the BadContent page may take to
+        search a submission. Slower patterns are quarantined, i.e. skipped
+        until the pattern statistics are reset. Use 0 to disable.""",
+        doc_domain="tracspamfilter")
 
     def __init__(self):
-        self.patterns = []
-        page = WikiPage(self.env, 'BadContent')
-        if page.exists:
-            self._load_patterns(page)
+        self._stats = PatternStats(self.log)
+        self._file = None
         if self.badcontent_file != '':
-            file = open(self.badcontent_file,"r")
-            if file == None:
-                self.log.warning('BadContent file cannot be opened')
-            else:
-                lines = file.read().splitlines()
-                pat = [re.compile(p.strip()) for p in lines if p.strip()]
-                self.log.debug('Loaded %s patterns from BadContent file', len(pat))
-                self.patterns += pat
+            self._file = PatternFile(self.badcontent_file, self.log,
+                                     self._build_file, name='BadContent')
+            self._file.load()
+
+    @property
+    def patterns(self):
+        """The compiled patterns, in their original order."""
+        patterns = self._matcher.patterns
+        if self._file:
+            patterns += self._file.matcher.patterns
+        return patterns
 
     # IFilterStrategy implementation
 
@@ -64,13 +77,16 @@ class RegexFilterStrategy(Component):
             testcontent = author+"\n"+content
         else:
             testcontent = content
-        for pattern in self.patterns:
-            match = pattern.search(testcontent)
-            if match:
-                gotcha.append("'%s'" % pattern.pattern)
-                self.log.debug('Pattern %s found in submission',
-                               pattern.pattern)
-                points -= abs(self.karma_points)
+        self._stats.max_time = self.max_time / 1000.0
+        matches = self._matcher.search(testcontent, self._stats)
+        if self._file:
+            self._file.interval = self.file_interval
+            self._file.check()
+            matches += self._file.matcher.search(testcontent, self._stats)
+        for pattern in matches:
+            gotcha.append("'%s'" % pattern.pattern)
+            self.log.debug('Pattern %s found in submission', pattern.pattern)
+            points -= abs(self.karma_points)
         if points != 0:
             if self.show_blacklisted:
                 matches = ", ".join(gotcha)
@@ -85,22 +101,58 @@ class RegexFilterStrategy(Component):
 
     def wiki_page_changed(self, page, *args):
         if page.name == 'BadContent':
-            self._load_patterns(page)
+            del self._matcher
+            FilterSystem(self.env).invalidate_verdicts()
     wiki_page_added = wiki_page_changed
+    wiki_page_deleted = wiki_page_changed
     wiki_page_version_deleted = wiki_page_changed
 
-    def wiki_page_deleted(self, page):
-        if page.name == 'BadContent':
-            self.patterns = []
+    def wiki_page_renamed(self, page, old_name):
+        if 'BadContent' in (page.name, old_name):
+            del self._matcher
+            FilterSystem(self.env).invalidate_verdicts()
+
+    def get_pattern_stats(self):
+        """Return search statistics and quarantine state per pattern."""
+        return self._stats.get_stats(self.patterns)
+
+    def reset_pattern_stats(self):
+        """Clear the statistics and lift the quarantine of slow patterns."""
+        self._stats.reset()
+        self._stats.check(self.patterns)
 
     # Internal methods
 
+    @cached
+    def _matcher(self):
+        """Matcher for the patterns of the BadContent page.
+
+        Deleting the attribute invalidates it in all processes, which then
+        build a new matcher on their next request.
+        """
+        patterns = []
+        page = WikiPage(self.env, 'BadContent')
+        if page.exists:
+            patterns = self._load_patterns(page)
+        self._stats.check(patterns)
+        return PatternMatcher(patterns)
+
     def _load_patterns(self, page):
         if '{{{' in page.text and '}}}' in page.text:
             lines = page.text.split('{{{', 1)[1].split('}}}', 1)[0].splitlines()
-            self.patterns = [re.compile(p.strip()) for p in lines if p.strip()]
+            patterns = compile_patterns(lines, self.log, 'BadContent')
             self.log.debug('Loaded %s patterns from BadContent',
-                           len(self.patterns))
+                           len(patterns))
+            return patterns
         else:
             self.log.warning('BadContent page does not contain any patterns')
-            self.patterns = []
+            return []
+
+    def _build_file(self, lines, previous):
+        patterns = compile_patterns(lines, self.log, 'BadContent',
+                                    previous and previous.patterns or ())
+        self._stats.check(patterns)
+        if previous is not None:
+            # every process reloads the file by itself
+            FilterSystem(self.env).invalidate_verdicts(local=True)
+        return PatternMatcher(patterns)
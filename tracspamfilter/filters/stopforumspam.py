@@ -11,7 +11,6 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://projects.edgewall.com/trac/.
 
-from email.Utils import parseaddr
 from urllib import urlencode
 import urllib2
 import re
@@ -21,7 +20,10 @@ from xml.etree import ElementTree
 from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
-from tracspamfilter.api import IFilterStrategy, _, N_
+from tracspamfilter.api import IFilterStrategy, _, N_, ServiceUnavailable, \
+                               get_strategy_name
+from tracspamfilter.httpclient import HTTPClient
+from tracspamfilter.reputation import ReputationCache, get_identifiers
 
 class StopForumSpamFilterStrategy(Component):
     """Spam filter using the StopForumSpam service (http://stopforumspam.com/).
@@ -47,22 +49,36 @@ class StopForumSpamFilterStrategy(Component):
     def test(self, req, author, content, ip):
         if not self._check_preconditions(False):
             return
+        identifiers = get_identifiers(author, ip)
+        cache = ReputationCache(self.env)
         try:
-            resp = self._send(req, author, content, ip, False)
-            tree = ElementTree.fromstring(resp)
+            answers = cache.get(get_strategy_name(self), identifiers)
+            if answers is None:
+                resp = self._send(identifiers, content, ip, False)
+                tree = ElementTree.fromstring(resp)
+                answers = []
+                for entry, value in identifiers:
+                    # the confidence if listed, an empty string otherwise
+                    e = tree.find('./%s/appears' % entry)
+                    if e != None and e.text == "1":
+                        answers.append(tree.find('./%s/confidence' % entry).text)
+                    else:
+                        answers.append('')
+                cache.set(get_strategy_name(self), identifiers, answers)
+            answers = dict((entry, answer) for (entry, value), answer
+                           in zip(identifiers, answers))
             karma = 0
             reason = []
             for entry in ('username', 'ip', 'email'):
-                e = tree.find('./%s/appears' % entry)
-                if e != None and e.text == "1":
-                    confidence = tree.find('./%s/confidence' % entry).text
+                confidence = answers.get(entry)
+                if confidence:
                     karma += abs(self.karma_points)*float(confidence)/100.0;
                     reason.append("%s [%s]" % (entry, confidence))
             reason = ",".join(reason);
             if karma:
                 return -int(karma+0.5), N_('StopForumSpam says this is spam (%s)'), reason
         except IOError, e:
-            self.log.warn('StopForumSpam request failed (%s)', e)
+            raise ServiceUnavailable('StopForumSpam request failed (%s)' % e)
 
     def train(self, req, author, content, ip, spam=True):
         if not spam:
@@ -70,8 +86,12 @@ class StopForumSpamFilterStrategy(Component):
         elif not self._check_preconditions(True):
             return -2
 
+        identifiers = get_identifiers(author, ip)
         try:
-            self._send(req, author, content, ip, True)
+            self._send(identifiers, content, ip, True)
+            # the service will answer differently for the reported author
+            ReputationCache(self.env).invalidate(identifiers,
+                                                 get_strategy_name(self))
             return 1
         except urllib2.URLError, e:
             self.log.warn('StopForumSpam request failed (%s)', e)
@@ -88,17 +108,10 @@ class StopForumSpamFilterStrategy(Component):
 
         return True
 
-    def _send(self, req, author, content, ip, train):
-        # Split up author into name and email, if possible
-        author = author.encode('utf-8')
-        author_name, author_email = parseaddr(author)
-        if not author_name and not author_email:
-            author_name = author
-        elif not author_name and author_email.find("@") < 1:
-            author_name = author
-            author_email = None
-        if author_name == "anonymous":
-            author_name = None
+    def _send(self, identifiers, content, ip, train):
+        identifiers = dict(identifiers)
+        author_name = identifiers.get('username')
+        author_email = identifiers.get('email')
 
         params = {'ip': ip}
         if author_name:
@@ -113,12 +126,12 @@ class StopForumSpamFilterStrategy(Component):
             params['ip_addr'] = ip
             params['evidence'] = "Spam training using Trac SpamFilter (%s)\n%s" % (self.user_agent, content.encode('utf-8'))
             url = 'http://www.stopforumspam.com/add.php'
-            urlreq = urllib2.Request(url, urlencode(params), {'User-Agent' : self.user_agent})
+            data = urlencode(params)
         else:
             params['ip'] = ip
             url = 'http://www.stopforumspam.com/api?confidence&f=xmldom&' + urlencode(params)
-            urlreq = urllib2.Request(url, None, {'User-Agent' : self.user_agent})
+            data = None
 
-        resp = urllib2.urlopen(urlreq)
-        return resp.read()
+        return HTTPClient(self.env).fetch(url, data,
+                                          {'User-Agent' : self.user_agent})
 
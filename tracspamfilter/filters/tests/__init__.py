@@ -13,14 +13,16 @@
 
 import unittest
 
-from tracspamfilter.filters.tests import akismet, bayes, extlinks, regex, \
-                                         session
+from tracspamfilter.filters.tests import akismet, bayes, extlinks, \
+                                         ip_regex, ip_throttle, regex, session
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(akismet.suite())
     suite.addTest(bayes.suite())
     suite.addTest(extlinks.suite())
+    suite.addTest(ip_regex.suite())
+    suite.addTest(ip_throttle.suite())
     suite.addTest(regex.suite())
     suite.addTest(session.suite())
     return suite
@@ -11,12 +11,11 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://projects.edgewall.com/trac/.
 
-from StringIO import StringIO
 import unittest
 
 from trac.test import EnvironmentStub, Mock
-from tracspamfilter.filters import akismet
 from tracspamfilter.filters.akismet import AkismetFilterStrategy
+from tracspamfilter.httpclient import HTTPClient
 
 
 class DummyRequest(object):
@@ -26,8 +25,6 @@ class DummyRequest(object):
         self.params = params
         self.headers = headers
 
-akismet.urllib2.Request = DummyRequest
-
 
 class DummyURLOpener(object):
 
@@ -35,9 +32,9 @@ class DummyURLOpener(object):
         self.responses = []
         self.requests = []
 
-    def __call__(self, request):
-        self.requests.append(request)
-        return StringIO(self.responses.pop(0))
+    def __call__(self, url, data=None, headers=None, method=None):
+        self.requests.append(DummyRequest(url, data, headers))
+        return self.responses.pop(0)
 
 
 class AkismetFilterStrategyTestCase(unittest.TestCase):
@@ -45,7 +42,7 @@ class AkismetFilterStrategyTestCase(unittest.TestCase):
     def setUp(self):
         self.env = EnvironmentStub(enable=[AkismetFilterStrategy])
         self.strategy = AkismetFilterStrategy(self.env)
-        self.urlopen = akismet.urllib2.urlopen = DummyURLOpener()
+        self.urlopen = HTTPClient(self.env).fetch = DummyURLOpener()
 
     def test_no_api_key(self):
         req = Mock()
@@ -12,6 +12,7 @@
 # history and logs, available at http://projects.edgewall.com/trac/.
 
 from StringIO import StringIO
+import threading
 import unittest
 
 from trac.db.sqlite_backend import _to_sql
@@ -31,6 +32,8 @@ class BayesianFilterStrategyTestCase(unittest.TestCase):
                     cursor.execute(stmt)
 
         self.strategy = BayesianFilterStrategy(self.env)
+        # no background thread using the test database
+        self.strategy._known.synchronous = True
 
     def test_karma_calculation_unsure(self):
         bayes.Hammie = lambda x: Mock(score=lambda x: .5,
@@ -76,16 +79,177 @@ class BayesianFilterStrategyTestCase(unittest.TestCase):
         assert points < 0, 'Expected negative karma'
 
 
+class TracDbClassifierTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            for table in schema:
+                cursor.execute("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    cursor.execute(stmt)
+        # no background thread using the test database
+        BayesianFilterStrategy(self.env)._known.synchronous = True
+
+    def _classifier(self, cache):
+        return TracDbClassifier(self.env, self.env.log, cache)
+
+    def test_cached_reads(self):
+        cache = TokenCache()
+        classifier = self._classifier(cache)
+        classifier.learn(['spam', 'eggs'], True)
+        classifier.store()
+        self.assertEqual((1, 0), cache.get(u'spam'))
+        self.env.db_transaction("UPDATE spamfilter_bayes SET nspam=5 "
+                                "WHERE word='spam'")
+        classifier = self._classifier(cache)
+        self.assertEqual(1, classifier._wordinfoget('spam').spamcount)
+        self.assertEqual(None, classifier._wordinfoget('ham'))
+        self.assertEqual(None, cache.get(u'ham'))
+
+    def test_least_recently_used_dropped(self):
+        cache = TokenCache(size=2)
+        cache.set(u'spam', (1, 0))
+        cache.set(u'eggs', None)
+        cache.get(u'spam')
+        cache.set(u'ham', (0, 1))
+        self.assertEqual((1, 0), cache.get(u'spam'))
+        self.assertEqual((0, 1), cache.get(u'ham'))
+        self.assertRaises(KeyError, cache.get, u'eggs')
+
+    def test_other_process_detected(self):
+        cache = TokenCache()
+        classifier = self._classifier(cache)
+        classifier.learn(['spam'], True)
+        classifier.store()
+        other = self._classifier(TokenCache())
+        other.learn(['spam'], True)
+        other.store()
+        classifier = self._classifier(cache)
+        self.assertEqual(2, classifier.nspam)
+        self.assertEqual(2, classifier._wordinfoget('spam').spamcount)
+
+    def test_reset(self):
+        cache = TokenCache()
+        classifier = self._classifier(cache)
+        classifier.learn(['spam'], True)
+        classifier.store()
+        self._classifier(None).reset()
+        classifier = self._classifier(cache)
+        self.assertEqual(0, classifier.nspam)
+        self.assertEqual(None, classifier._wordinfoget('spam'))
+
+    def test_store_counts(self):
+        classifier = self._classifier(None)
+        classifier.learn(['spam', 'eggs'], True)
+        classifier.learn(['spam'], True)
+        classifier.learn(['spam'], False)
+        other = self._classifier(None)
+        classifier.store()
+        # counts are added, the training of others is not overwritten
+        other.learn(['spam'], True)
+        other.store()
+        self.assertEqual((3, 1), (other.nspam, other.nham))
+        classifier = self._classifier(None)
+        self.assertEqual((3, 1), (classifier.nspam, classifier.nham))
+        self.assertEqual(3, classifier._wordinfoget('spam').spamcount)
+        self.assertEqual(1, classifier._wordinfoget('spam').hamcount)
+        self.assertEqual(1, classifier._wordinfoget('eggs').spamcount)
+
+    def test_shared_classifier(self):
+        strategy = BayesianFilterStrategy(self.env)
+        hammie = strategy._get_hammie()
+        other = self._classifier(None)
+        other.learn(['spam'], True)
+        other.store()
+        self.assertTrue(strategy._get_hammie() is hammie)
+        self.assertEqual(1, hammie.bayes.nspam)
+        self.assertEqual(1, hammie.bayes._wordinfoget('spam').spamcount)
+        strategy.reset()
+        self.assertEqual(0, strategy._get_hammie().bayes.nspam)
+        self.assertEqual(None, hammie.bayes._wordinfoget('spam'))
+
+    def test_batch(self):
+        strategy = BayesianFilterStrategy(self.env)
+        strategy.start_batch()
+        strategy.train(None, None, u'spam', '127.0.0.1', spam=True)
+        # the batch is neither visible to nor written by other threads
+        self.assertEqual(0, strategy._get_hammie().bayes.nspam)
+        thread = threading.Thread(target=strategy.train,
+                                  args=(None, None, u'ham', '127.0.0.1',
+                                        False))
+        thread.start()
+        thread.join()
+        classifier = self._classifier(None)
+        self.assertEqual((0, 1), (classifier.nspam, classifier.nham))
+        strategy.finish_batch()
+        bayes = strategy._get_hammie().bayes
+        self.assertEqual((1, 1), (bayes.nspam, bayes.nham))
+        self.assertEqual(1, bayes._wordinfoget('spam').spamcount)
+
+    def test_prefetch(self):
+        classifier = self._classifier(None)
+        classifier.learn(['spam', 'eggs'], True)
+        classifier.store()
+        classifier = self._classifier(None)
+        classifier.prefetch(['spam', 'ham'] + ['w%d' % i for i in range(1000)])
+        self.env.db_transaction("DELETE FROM spamfilter_bayes "
+                                "WHERE word='spam'")
+        self.assertEqual(1, classifier._wordinfoget('spam').spamcount)
+        self.assertEqual(None, classifier._wordinfoget('ham'))
+        self.assertEqual(1, classifier._wordinfoget('eggs').spamcount)
+
+    def test_readonly_fork(self):
+        classifier = self._classifier(None)
+        classifier.learn(['spam'], True)
+        classifier.store()
+        fork = classifier.fork(readonly=True)
+        fork.prefetch(['spam'])
+        self.assertEqual({}, classifier._prefetched)
+        other = self._classifier(None)
+        other.learn(['eggs'], True)
+        other.learn(['eggs'], True)
+        other.store()
+        # newer rows are scored with their counts, but nothing is stored
+        self.assertEqual(2, fork._wordinfoget('eggs').spamcount)
+        self.assertEqual(2, fork.nspam)
+        self.assertEqual(3, self._classifier(None).nspam)
+
+    def test_known_words(self):
+        known = KnownWords()
+        classifier = TracDbClassifier(self.env, self.env.log, None, known)
+        classifier.learn(['spam'], True)
+        classifier.store()
+        known.build(self.env, classifier.generation)
+        self.assertTrue(known.valid(classifier.generation))
+        self.assertTrue(u'spam' in known)
+        # words missing in the filter are not looked up
+        self.env.db_transaction("INSERT INTO spamfilter_bayes "
+                                "(word,nspam,nham) VALUES ('ham',0,1)")
+        classifier = TracDbClassifier(self.env, self.env.log, None, known)
+        self.assertEqual(None, classifier._wordinfoget('ham'))
+        # training by this process keeps the filter valid
+        classifier.learn(['eggs'], True)
+        classifier.store()
+        self.assertTrue(known.valid(classifier.generation))
+        self.assertTrue(u'eggs' in known)
+
+
 try:
     from tracspamfilter.filters import bayes
-    from tracspamfilter.filters.bayes import BayesianFilterStrategy
+    from tracspamfilter.filters.bayes import BayesianFilterStrategy, \
+                                             KnownWords, TokenCache, \
+                                             TracDbClassifier
 except ImportError:
     # Skip tests if SpamBayes isn't installed
     class BayesianFilterStrategyTestCase(object): pass
+    class TracDbClassifierTestCase(object): pass
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(BayesianFilterStrategyTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(TracDbClassifierTestCase, 'test'))
     return suite
 
 if __name__ == '__main__':
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import unittest
+
+from trac.test import EnvironmentStub, Mock
+from tracspamfilter.filters import ip_regex
+from tracspamfilter.filters.ip_regex import IPRegexFilterStrategy
+from tracspamfilter.filters.tests.regex import DummyWikiPage
+
+
+class IPRegexFilterStrategyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[IPRegexFilterStrategy])
+        self.page = ip_regex.WikiPage = DummyWikiPage('BadIP')
+        self.page.text = r"""{{{
+10.0.0.0/8
+192.0.2.5-192.0.2.9
+2001:db8::/32
+^172\.16\.
+}}}"""
+        self.strategy = IPRegexFilterStrategy(self.env)
+
+    def test_cidr(self):
+        self.env.config.set('spam-filter', 'ipregex_cidr', True)
+        self.strategy.wiki_page_changed(self.page)
+        retval = self.strategy.test(Mock(), 'anonymous', '', '10.1.2.3')
+        self.assertEqual((-20, 'IP catched by these blacklisted patterns: %s', "'10.0.0.0/8'"), retval)
+        retval = self.strategy.test(Mock(), 'anonymous', '', '192.0.2.7')
+        self.assertEqual((-20, 'IP catched by these blacklisted patterns: %s', "'192.0.2.5-192.0.2.9'"), retval)
+        retval = self.strategy.test(Mock(), 'anonymous', '', '2001:db8::5')
+        self.assertEqual((-20, 'IP catched by these blacklisted patterns: %s', "'2001:db8::/32'"), retval)
+        retval = self.strategy.test(Mock(), 'anonymous', '', '172.16.0.1')
+        self.assertEqual((-20, 'IP catched by these blacklisted patterns: %s', "'^172\\.16\\.'"), retval)
+        retval = self.strategy.test(Mock(), 'anonymous', '', '192.0.2.10')
+        self.assertEqual(None, retval)
+
+    def test_regex_only(self):
+        self.strategy.wiki_page_changed(self.page)
+        retval = self.strategy.test(Mock(), 'anonymous', '', '10.1.2.3')
+        self.assertEqual(None, retval)
+        retval = self.strategy.test(Mock(), 'anonymous', '', '172.16.0.1')
+        self.assertEqual((-20, 'IP catched by these blacklisted patterns: %s', "'^172\\.16\\.'"), retval)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(IPRegexFilterStrategyTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import time
+import unittest
+
+from trac.db.sqlite_backend import _to_sql
+from trac.test import EnvironmentStub, Mock
+from tracspamfilter.filters.ip_throttle import IPThrottleFilterStrategy
+from tracspamfilter.model import LogEntry, Throttle, schema
+
+
+class IPThrottleFilterStrategyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[IPThrottleFilterStrategy])
+        self.env.config.set('spam-filter', 'max_posts_by_ip', '2')
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            for table in schema:
+                cursor.execute("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    cursor.execute(stmt)
+        self.strategy = IPThrottleFilterStrategy(self.env)
+
+    def _test(self, ip='10.0.0.1'):
+        return self.strategy.test(Mock(), 'anonymous', '', ip)
+
+    def test_seeded_from_log(self):
+        now = time.time()
+        for when in (now - 7200, now - 600, now - 60):
+            LogEntry(self.env, when, '/foo', 'anonymous', False, '10.0.0.1',
+                     '', 'Test', False, 0, [], None).insert()
+        self.assertEqual(None, self._test())
+        self.assertEqual((-5, 'Maximum number of posts per hour for this IP '
+                              'exceeded'), self._test())
+        self.assertEqual(None, self._test('10.0.0.2'))
+
+    def test_networks(self):
+        self.env.config.set('spam-filter', 'ip_throttle_networks',
+                            'ipv4/24:3:2, ipv6/64:3, ipv4/x:3')
+        for i in range(4):
+            self.assertEqual(None, self._test('10.0.0.%d' % i))
+        self.assertEqual((-3, 'Maximum number of posts per hour for network '
+                              '%s exceeded', '10.0.0.0/24'),
+                         self._test('10.0.0.9'))
+        self.assertEqual(None, self._test('10.0.1.1'))
+        for i in range(4):
+            self._test('2001:db8::%d' % i)
+        self.assertEqual((-4, 'Maximum number of posts per hour for network '
+                              '%s exceeded', '2001:db8::/64'),
+                         self._test('2001:db8::1:1'))
+
+    def test_shared(self):
+        self.env.config.set('spam-filter', 'ip_throttle_shared', True)
+        for i in range(3):
+            self.assertEqual(None, self._test())
+        self.assertEqual((-5, 'Maximum number of posts per hour for this IP '
+                              'exceeded'), self._test())
+        self.assertEqual(0, len(self.strategy._window))
+        rows = self.env.db_query("SELECT name,count FROM spamfilter_throttle")
+        self.assertEqual([('10.0.0.1', 4)], rows)
+
+    def test_shared_concurrent_insert(self):
+        throttle = Throttle(self.env)
+        self.assertEqual(1, throttle.add('10.0.0.1', 10, 0))
+        increment = throttle._increment
+        missed = []
+        def increment_late(name, slot):
+            if not missed:
+                # the row is inserted by another process meanwhile
+                missed.append(slot)
+                return False
+            return increment(name, slot)
+        throttle._increment = increment_late
+        self.assertEqual(2, throttle.add('10.0.0.1', 10, 0))
+        self.assertEqual(3, throttle.add('10.0.0.1', 11, 0))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(IPThrottleFilterStrategyTestCase,
+                                     'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -12,8 +12,13 @@
 # history and logs, available at http://projects.edgewall.com/trac/.
 
 from StringIO import StringIO
+import os
+import shutil
+import tempfile
+import time
 import unittest
 
+from trac.cache import CacheManager
 from trac.test import EnvironmentStub, Mock
 from tracspamfilter.filters import regex
 from tracspamfilter.filters.regex import RegexFilterStrategy
@@ -21,7 +26,8 @@ from tracspamfilter.filters.regex import RegexFilterStrategy
 
 class DummyWikiPage(object):
 
-    def __init__(self):
+    def __init__(self, name='BadContent'):
+        self.name = name
         self.text = ''
 
     def __call__(self, env, name):
@@ -61,6 +67,59 @@ bar$
         self.assertEqual((-10, 'Content contained these blacklisted patterns: %s', '\'foobar\', \'bar$\''),
                          retval)
 
+    def test_unsafe_pattern_quarantined(self):
+        self.page.text = """{{{
+(a+)+b
+foobar
+}}}"""
+        self.strategy.wiki_page_changed(self.page)
+        retval = self.strategy.test(Mock(), 'anonymous', 'aab foobar', '127.0.0.1')
+        self.assertEqual((-5, 'Content contained these blacklisted patterns: %s', '\'foobar\''), retval)
+        stats = self.strategy.get_pattern_stats()
+        self.assertEqual(['(a+)+b', 'foobar'], [p['pattern'] for p in stats])
+        self.assertEqual('nested quantifier', stats[0]['quarantined'])
+        self.assertEqual((1, 1), (stats[1]['searches'], stats[1]['matches']))
+
+    def test_changed_in_other_process(self):
+        self.page.text = """{{{
+foobar
+}}}"""
+        self.strategy.wiki_page_changed(self.page)
+        self.assertEqual(['foobar'], [p.pattern for p in self.strategy.patterns])
+
+        # another process saves the page and bumps the cache generation
+        self.page.text = """{{{
+spam
+}}}"""
+        self.env.db_transaction("UPDATE cache SET generation=generation+1")
+        self.assertEqual(['foobar'], [p.pattern for p in self.strategy.patterns])
+        CacheManager(self.env).reset_metadata()
+        self.assertEqual(['spam'], [p.pattern for p in self.strategy.patterns])
+
+    def test_file_reloaded(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'badcontent.txt')
+            with open(path, 'w') as f:
+                f.write('foobar\n')
+            env = EnvironmentStub(enable=[RegexFilterStrategy])
+            env.config.set('spam-filter', 'badcontent_file', path)
+            env.config.set('spam-filter', 'badcontent_file_interval', 0)
+            strategy = RegexFilterStrategy(env)
+            self.assertEqual(['foobar'], [p.pattern for p in strategy.patterns])
+
+            with open(path, 'w') as f:
+                f.write('foobar\nspam\n')
+            for i in range(100):
+                strategy.test(Mock(), 'anonymous', 'spam', '127.0.0.1')
+                if len(strategy.patterns) == 2:
+                    break
+                time.sleep(0.01)
+            retval = strategy.test(Mock(), 'anonymous', 'spam', '127.0.0.1')
+            self.assertEqual((-5, 'Content contained these blacklisted patterns: %s', '\'spam\''), retval)
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 def suite():
     suite = unittest.TestSuite()
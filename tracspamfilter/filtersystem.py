@@ -16,15 +16,21 @@
 # Author: Matthew Good <trac@matt-good.net>
 #         Christopher Lenz <cmlenz@gmx.de>
 
-from difflib import SequenceMatcher
+import atexit
+import hashlib
 import inspect
 from StringIO import StringIO
 import textwrap
+import threading
 import time
+from Queue import Queue, Empty
+from weakref import WeakSet
 
 from pkg_resources import resource_filename
 
-from trac.config import BoolOption, ExtensionOption, IntOption, Option, ConfigSection
+from trac.cache import cached
+from trac.config import BoolOption, ExtensionOption, IntOption, ListOption, \
+                        Option, ConfigSection
 from trac.core import *
 from trac.db import DatabaseManager
 from trac.env import IEnvironmentSetupParticipant
@@ -32,15 +38,31 @@ from trac.perm import IPermissionRequestor
 from trac.util.text import shorten_line, to_unicode
 from trac.web import Request
 from tracspamfilter.api import (
-    IFilterStrategy, IRejectHandler, RejectContent, 
+    IFilterStrategy, IRejectHandler, RejectContent, ServiceUnavailable,
     add_domain, _, N_, gettext, tag_, get_strategy_name
 )
-from tracspamfilter.model import LogEntry, schema, schema_version, Statistics
+from tracspamfilter.breaker import CircuitBreaker
+from tracspamfilter.cache import LRUCache
+from tracspamfilter.diff import get_added_lines
+from tracspamfilter.logwriter import LogWriter
+from tracspamfilter.model import LogEntry, schema, schema_version, \
+                                 Statistics, StatisticsAggregator
+from tracspamfilter.ranking import PerformanceRanking
 from tracspamfilter.filters.trapfield import TrapFieldFilterStrategy
+from tracspamfilter.threadpool import ThreadPool
 from genshi.builder import tag
 
 __all__ = ['FilterSystem']
 
+# Instances whose collected statistics are written when the process exits
+_instances = WeakSet()
+
+def _flush_statistics():
+    for filtersystem in list(_instances):
+        filtersystem.flush_statistics()
+
+atexit.register(_flush_statistics)
+
 class FilterSystem(Component):
     """The central component for spam filtering. Must be enabled always to allow
     filtering of spam.
@@ -63,10 +85,33 @@ class FilterSystem(Component):
         """Whether all content submissions and spam filtering activity should
         be logged to the database.""", doc_domain='tracspamfilter')
 
+    logging_async = BoolOption('spam-filter', 'logging_async', 'false',
+        """Whether log entries are written to the database by a background
+        thread, so saving content does not wait for it. If more than
+        `logging_queue_size` entries are waiting, ham entries are dropped
+        first.""", doc_domain='tracspamfilter')
+
+    logging_queue_size = IntOption('spam-filter', 'logging_queue_size', '1000',
+        """The maximum number of log entries waiting to be written when
+        `logging_async` is enabled.""", doc_domain='tracspamfilter')
+
     purge_age = IntOption('spam-filter', 'purge_age', '7',
         """The number of days after which log entries should be purged.""",
         doc_domain='tracspamfilter')
 
+    purge_max_entries = IntOption('spam-filter', 'purge_max_entries', '0',
+        """The maximum number of log entries to keep, older entries are
+        purged. Use 0 for no limit.""", doc_domain='tracspamfilter')
+
+    purge_interval = IntOption('spam-filter', 'purge_interval', '60',
+        """The number of minutes between purges of the log.""",
+        doc_domain='tracspamfilter')
+
+    statistics_interval = IntOption('spam-filter', 'statistics_interval', '30',
+        """The number of seconds statistics are collected in memory before
+        they are written to the database. Use 0 to write them immediately.""",
+        doc_domain='tracspamfilter')
+
     use_external = BoolOption('spam-filter', 'use_external', 'true',
         """Allow usage of external services.""", doc_domain='tracspamfilter')
 
@@ -86,6 +131,63 @@ class FilterSystem(Component):
         """Stop external calls when this positive karma is reached.""",
         doc_domain='tracspamfilter')
 
+    external_threads = IntOption('spam-filter', 'external_threads', '0',
+        """Number of threads used to call external services concurrently.
+        With 0 the external services are called one after another.""",
+        doc_domain='tracspamfilter')
+
+    external_deadline = IntOption('spam-filter', 'external_deadline', '5',
+        """Maximum number of seconds to wait for concurrently called external
+        services. Services which did not answer in time are ignored for the
+        submission.""", doc_domain='tracspamfilter')
+
+    breaker_failures = IntOption('spam-filter', 'external_breaker_failures',
+                                 '5',
+        """Number of consecutive failed or slow calls of an external service
+        after which it is skipped for `external_breaker_cooldown` seconds.
+        Then a single call checks whether the service works again. Use 0
+        to never skip services.""", doc_domain='tracspamfilter')
+
+    breaker_cooldown = IntOption('spam-filter', 'external_breaker_cooldown',
+                                 '60',
+        """Number of seconds a failing external service is skipped.""",
+        doc_domain='tracspamfilter')
+
+    breaker_timeout = IntOption('spam-filter', 'external_breaker_timeout', '5',
+        """Number of seconds after which a call of an external service counts
+        as failed, even if it returned a result.""",
+        doc_domain='tracspamfilter')
+
+    ranking_interval = IntOption('spam-filter', 'external_ranking_interval',
+                                 '300',
+        """Number of seconds between reads of the statistics for ordering
+        the external services. In between, the order follows the delay and
+        failures of the latest calls.""", doc_domain='tracspamfilter')
+
+    verdict_cache_size = IntOption('spam-filter', 'verdict_cache_size', '1000',
+        """Number of recently tested contents for which the results of the
+        strategies in `verdict_cache_strategies` are kept, so identical
+        submissions do not need to be tested again. Use 0 to disable.""",
+        doc_domain='tracspamfilter')
+
+    verdict_cache_ttl = IntOption('spam-filter', 'verdict_cache_ttl', '300',
+        """Number of seconds the results for a tested content are kept.""",
+        doc_domain='tracspamfilter')
+
+    verdict_cache_author = BoolOption('spam-filter', 'verdict_cache_author',
+                                      'true',
+        """Whether results are only reused for submissions of the same
+        author.""", doc_domain='tracspamfilter')
+
+    verdict_cache_strategies = ListOption('spam-filter',
+        'verdict_cache_strategies',
+        'Bayesian, Regex, ExternalLinks',
+        doc="""Strategies whose results only depend on the submitted content
+        and can be reused for identical submissions. Do not add strategies
+        which also check the IP or the request headers, like Akismet,
+        Defensio or Mollom.""",
+        doc_domain='tracspamfilter')
+
     train_external = BoolOption('spam-filter', 'train_external', 'true',
         """Allow training of external services.""", doc_domain='tracspamfilter')
 
@@ -102,6 +204,12 @@ class FilterSystem(Component):
                                      IRejectHandler, 'FilterSystem',
         """The handler used to reject content.""", doc_domain='tracspamfilter')
 
+    diff_max_lines = IntOption('spam-filter', 'diff_max_lines', '1000',
+        """The maximum number of changed lines of a field for which the
+        exact difference to the previous version is computed. For larger
+        changes, every changed line which did not exist before is tested.""",
+        doc_domain='tracspamfilter')
+
     isforwarded = BoolOption('spam-filter', 'is_forwarded', 'false',
         """Interpret X-Forwarded-For header for IP checks.""",
         doc_domain='tracspamfilter')
@@ -114,6 +222,18 @@ class FilterSystem(Component):
         """Set up translation domain"""
         locale_dir = resource_filename(__name__, 'locale')
         add_domain(self.env.path, locale_dir)
+        self._pool = None
+        self._verdicts = LRUCache()
+        self._verdicts_generation = None
+        self._breakers = {}
+        self._ranking = PerformanceRanking(self.env)
+        self._log_writer = None
+        self._lock = threading.Lock()
+        self._stats = StatisticsAggregator()
+        self._flush_timer = None
+        self._purge_next = 0
+        self._purging = False
+        _instances.add(self)
 
     # IRejectHandler methods
 
@@ -175,81 +295,15 @@ class FilterSystem(Component):
         content = self._combine_changes(changes)
         abbrev = shorten_line(content)
         self.log.debug('Testing content %r submitted by "%s"', abbrev, author)
-        externals = []
-
-        for strategy in self.strategies:
-            tim = time.time()
-            try:
-                if not strategy.is_external():
-                    retval = strategy.test(req, author, content, ip)
-                    tim = time.time()-tim
-                    if tim > 3:
-                        self.log.warn('Test %s took %d seconds to complete.' % (strategy, tim))
-                    if retval:
-                        points = retval[0]
-                        if len(retval) > 2:
-                            reason = retval[1] % retval[2:]
-                        else:
-                            reason = retval[1]
-                        if points < 0:
-                            if len(retval) > 2:
-                                outreasons.append(gettext(retval[1]) % retval[2:])
-                            else:
-                                outreasons.append(gettext(retval[1]))
-                                                                                                                
-                        self.log.debug('Filter strategy %r gave submission %d '
-                                       'karma points (reason: %r)', strategy,
-                                       points, reason)
-                        score += points
-                        if reason:
-                            name = get_strategy_name(strategy)
-                            reasons.append((name, str(points)) + retval[1:])
-                            results.append((strategy, points, tim))
-                    else:
-                        self._record_action('test','empty', '', strategy, tim)
-                elif self.use_external:
-                    externals.append(strategy)
-            except Exception, e:
-                self._record_action('test', 'error', '', strategy, time.time()-tim)
-                self.log.exception('Filter strategy %s raised exception: %s', strategy, e)
-
-        extint = "testint"
-        if score > -self.skip_external and score < self.skip_externalham:
-            externals = Statistics(self.env).sortbyperformance(externals)
-            for strategy in externals:
-                tim = time.time()
-                try:
-                    if score > -self.stop_external and score < self.stop_externalham:
-                        extint = "testext"
-                        retval = strategy.test(req, author, content, ip)
-                        tim = time.time()-tim
-                        if tim > 3:
-                            self.log.warn('Test %s took %d seconds to complete.' % (strategy, tim))
-                        if retval:
-                            points = retval[0]
-                            if len(retval) > 2:
-                                reason = retval[1] % retval[2:]
-                            else:
-                                reason = retval[1]
-                            if points < 0:
-                                if len(retval) > 2:
-                                    outreasons.append(gettext(retval[1]) % retval[2:])
-                                else:
-                                    outreasons.append(gettext(retval[1]))
-                                                                                                                
-                            self.log.debug('Filter strategy %r gave submission %d '
-                                           'karma points (reason: %r)', strategy,
-                                           points, reason)
-                            score += points
-                            if reason:
-                                name = get_strategy_name(strategy)
-                                reasons.append((name,str(points)) + retval[1:])
-                                results.append((strategy, points, tim))
-                        else:
-                            self._record_action('test','empty', '', strategy, tim)
-                except Exception, e:
-                    self._record_action('test','error', '', strategy, time.time()-tim)
-                    self.log.exception('Filter strategy %s raised exception: %s', strategy, e)
+        key = self._verdict_key(author, content)
+        verdicts, claimed = self._get_verdicts(key)
+        computed = {} if key else None
+        try:
+            score, extint = self._test_strategies(req, author, content, ip,
+                                                  score, reasons, outreasons,
+                                                  results, verdicts, computed)
+        finally:
+            self._store_verdicts(key, verdicts, computed, claimed)
 
         reasons = sorted(reasons, key=lambda r: r[0])
 
@@ -270,11 +324,15 @@ class FilterSystem(Component):
             headers = '\n'.join(['%s: %s' % (k[5:].replace('_', '-').title(), v)
                                  for k, v in req.environ.items()
                                  if k.startswith('HTTP_')])
-            LogEntry(self.env, time.time(), req.path_info, author,
-                     req.authname and req.authname != 'anonymous',
-                     ip, headers, content, score < self.min_karma,
-                     score, reasons, [req.path_info, req.args]).insert()
-            LogEntry.purge(self.env, self.purge_age)
+            entry = LogEntry(self.env, time.time(), req.path_info, author,
+                             req.authname and req.authname != 'anonymous',
+                             ip, headers, content, score < self.min_karma,
+                             score, reasons, [req.path_info, dict(req.args)])
+            if self.logging_async:
+                self._get_log_writer().put(entry)
+            else:
+                entry.insert()
+                self._purge_if_due()
 
         if score < self.min_karma:
             self.log.debug('Rejecting submission %r by "%s" (%r) because it '
@@ -300,58 +358,88 @@ class FilterSystem(Component):
 
         if not isinstance(ids, list):
             ids = [ids]
-        for log_id in ids:
-            start = time.time()
-            entry = LogEntry.fetch(self.env, log_id)
-            if entry:
-                extint = "trainint"
-                self.log.debug('Marking as %s: %r submitted by "%s"',
-                               spam and 'spam' or 'ham',
-                               shorten_line(entry.content),
-                               entry.author)
-                fakeenv = environ.copy()
-                for header in entry.headers.splitlines():
-                    name, value = header.split(':', 1)
-                    if name == 'Cookie': # breaks SimpleCookie somehow
-                        continue
-                    cgi_name = 'HTTP_%s' % name.strip().replace('-', '_').upper()
-                    fakeenv[cgi_name] = value.strip()
-                fakeenv['REQUEST_METHOD'] = 'POST'
-                fakeenv['PATH_INFO'] = entry.path
-                fakeenv['wsgi.input'] = StringIO('')
-                fakeenv['REMOTE_ADDR'] = entry.ipnr
-                if entry.authenticated:
-                    fakeenv['REMOTE_USER'] = entry.author
-
-                type = "spam" if spam else "ham"
-                for strategy in self.strategies:
-                    status = "trainskip"
-                    if (self.use_external and self.train_external) or not strategy.is_external():
-                        tim = time.time()
-                        extint = "trainext"
+        # results of earlier tests may change with the training
+        self.invalidate_verdicts()
+        # strategies able to write the training of all entries at once
+        batched = [strategy for strategy in self.strategies
+                   if hasattr(strategy, 'start_batch')]
+        for strategy in batched:
+            strategy.start_batch()
+        try:
+            for log_id in ids:
+                self._train_entry(req, environ, log_id, spam, delete)
+        finally:
+            for strategy in batched:
+                try:
+                    strategy.finish_batch()
+                except Exception, e:
+                    self.log.exception('Training %s failed: %s',
+                                       strategy, e)
+
+    def _train_entry(self, req, environ, log_id, spam, delete):
+        start = time.time()
+        entry = LogEntry.fetch(self.env, log_id)
+        if entry:
+            extint = "trainint"
+            self.log.debug('Marking as %s: %r submitted by "%s"',
+                           spam and 'spam' or 'ham',
+                           shorten_line(entry.content),
+                           entry.author)
+            fakeenv = environ.copy()
+            for header in entry.headers.splitlines():
+                name, value = header.split(':', 1)
+                if name == 'Cookie': # breaks SimpleCookie somehow
+                    continue
+                cgi_name = 'HTTP_%s' % name.strip().replace('-', '_').upper()
+                fakeenv[cgi_name] = value.strip()
+            fakeenv['REQUEST_METHOD'] = 'POST'
+            fakeenv['PATH_INFO'] = entry.path
+            fakeenv['wsgi.input'] = StringIO('')
+            fakeenv['REMOTE_ADDR'] = entry.ipnr
+            if entry.authenticated:
+                fakeenv['REMOTE_USER'] = entry.author
+
+            type = "spam" if spam else "ham"
+            for strategy in self.strategies:
+                status = "trainskip"
+                tim = 0
+                breaker = None
+                if strategy.is_external():
+                    breaker = self._get_breaker(strategy)
+                if ((self.use_external and self.train_external) or not breaker) \
+                        and (not breaker or breaker.allow()):
+                    tim = time.time()
+                    extint = "trainext"
+                    try:
                         res = strategy.train(Request(fakeenv, None),
                                    entry.author or 'anonymous',
                                    entry.content, entry.ipnr, spam=spam)
-                        tim = time.time()-tim
-                        if tim > 3:
-                            self.log.warn('Training %s took %d seconds to complete.' % (strategy, tim))
-                        if res == -1:
-                            status = "trainerror"
-                        elif res == -2:
-                            status = "traincond"
-                        elif res > 0:
-                            status = "train"
-                    count = entry.findreasonvalue(get_strategy_name(strategy))
-                    if count:
-                        spamstatus = count < 0
-                        self._record_action(status, type, ("ok" if spamstatus == spam else "error"), strategy, tim)
-                    else:
-                        self._record_action(status, type, '', strategy, tim)
-                
-                self._record_action(extint, type, ("ok" if entry.rejected == spam else "error"), '', time.time()-start)
-                entry.update(rejected=spam)
-                if delete:
-                    self.delete(req, log_id, True)
+                    except Exception:
+                        if breaker:
+                            breaker.failure()
+                        raise
+                    tim = time.time()-tim
+                    if breaker:
+                        self._report_call(breaker, res != -1, tim)
+                    if tim > 3:
+                        self.log.warn('Training %s took %d seconds to complete.' % (strategy, tim))
+                    if res == -1:
+                        status = "trainerror"
+                    elif res == -2:
+                        status = "traincond"
+                    elif res > 0:
+                        status = "train"
+                count = entry.findreasonvalue(get_strategy_name(strategy))
+                if count:
+                    spamstatus = count < 0
+                    self._record_action(status, type, ("ok" if spamstatus == spam else "error"), strategy, tim)
+                else:
+                    self._record_action(status, type, '', strategy, tim)
+            
+            self._record_action(extint, type, ("ok" if entry.rejected == spam else "error"), '', time.time()-start)
+            entry.update(rejected=spam)
+            if delete:
+                self.delete(req, log_id, True)
 
     def delete(self, req, ids, stats):
         if not isinstance(ids, list):
@@ -379,6 +467,78 @@ class FilterSystem(Component):
         if ids:
             self.delete(req, ids, True)
 
+    def purge_log(self):
+        """Remove old log entries, unless that was done recently by another
+        process, and return the number of removed entries."""
+        interval = self.purge_interval * 60
+        last_time, last_removed = self.get_purge_status()
+        if last_time and time.time() - last_time < interval:
+            self._purge_next = last_time + interval
+            return 0
+        removed = LogEntry.purge(self.env, self.purge_age,
+                                 self.purge_max_entries,
+                                 self.purge_chunk_size)
+        with self.env.db_transaction as db:
+            db("DELETE FROM system WHERE name IN "
+               "('spamfilter_purge_time','spamfilter_purge_removed')")
+            db("INSERT INTO system (name,value) VALUES "
+               "('spamfilter_purge_time',%s)", (str(int(time.time())),))
+            db("INSERT INTO system (name,value) VALUES "
+               "('spamfilter_purge_removed',%s)", (str(removed),))
+        self.log.debug('Purged %d log entries', removed)
+        return removed
+
+    def get_purge_status(self):
+        """Return the time of the last purge of the log and the number of
+        entries removed by it."""
+        status = {}
+        for name, value in self.env.db_query(
+                "SELECT name,value FROM system WHERE name IN "
+                "('spamfilter_purge_time','spamfilter_purge_removed')"):
+            status[name] = int(value)
+        return (status.get('spamfilter_purge_time'),
+                status.get('spamfilter_purge_removed'))
+
+    def flush_statistics(self):
+        """Write the statistics collected in memory to the database."""
+        timer = self._flush_timer
+        if timer is not None:
+            timer.cancel()
+            self._flush_timer = None
+        rows = self._stats.take()
+        if rows:
+            try:
+                Statistics(self.env).merge(rows)
+            except Exception, e:
+                # keep them for the next attempt
+                self._stats.restore(rows)
+                self.log.error('Failed to write %d statistics rows: %s',
+                               len(rows), e, exc_info=True)
+
+    def get_pending_statistics(self):
+        """Return the statistics not written to the database yet."""
+        return self._stats.pending()
+
+    def get_breaker_states(self):
+        """Return the states of the circuit breakers of the external
+        strategies called by this process."""
+        return [breaker.get_state() for name, breaker
+                in sorted(self._breakers.items())]
+
+    def invalidate_verdicts(self, local=False):
+        """Forget the results of earlier tests, in all processes unless
+        `local` is true. Called when a strategy in `verdict_cache_strategies`
+        would now answer differently, e.g. because its patterns changed."""
+        self._verdicts.clear()
+        if not local:
+            del self._verdict_generation
+
+    def get_verdict_cache_stats(self):
+        """Return the usage of the cache of test results of this process."""
+        cache = self._verdicts
+        return {'enabled': self.verdict_cache_size > 0, 'size': len(cache),
+                'hits': cache.hits, 'misses': cache.misses}
+
     # IEnvironmentSetupParticipant
 
     def environment_created(self):
@@ -429,6 +589,288 @@ class FilterSystem(Component):
 
     # Internal methods
 
+    def _apply_result(self, strategy, retval, tim, reasons, outreasons,
+                      results, cached=False):
+        """Record the result `retval` of a strategy test and return the
+        karma points it contributes.
+
+        A `cached` result of an earlier test is not counted in the
+        statistics, as the strategy was not called.
+        """
+        if tim > 3:
+            self.log.warn('Test %s took %d seconds to complete.' % (strategy, tim))
+        if not retval:
+            if not cached:
+                self._record_action('test','empty', '', strategy, tim)
+            return 0
+        points = retval[0]
+        if len(retval) > 2:
+            reason = retval[1] % retval[2:]
+        else:
+            reason = retval[1]
+        if points < 0:
+            if len(retval) > 2:
+                outreasons.append(gettext(retval[1]) % retval[2:])
+            else:
+                outreasons.append(gettext(retval[1]))
+
+        self.log.debug('Filter strategy %r gave submission %d '
+                       'karma points (reason: %r)', strategy,
+                       points, reason)
+        if reason:
+            name = get_strategy_name(strategy)
+            reasons.append((name, str(points)) + retval[1:])
+            if not cached:
+                results.append((strategy, points, tim))
+        return points
+
+    def _test_strategies(self, req, author, content, ip, score, reasons,
+                         outreasons, results, verdicts, computed):
+        """Run the filter strategies and return the score and whether the
+        external strategies were used."""
+        externals = []
+
+        for strategy in self.strategies:
+            tim = time.time()
+            try:
+                if not strategy.is_external():
+                    retval = self._call_test(strategy, req, author, content,
+                                             ip, verdicts, computed)
+                    tim = time.time()-tim
+                    score += self._apply_result(strategy, retval, tim,
+                                                reasons, outreasons, results,
+                                                self._is_cached(strategy,
+                                                                verdicts))
+                elif self.use_external:
+                    externals.append(strategy)
+            except Exception, e:
+                self._test_failed(strategy, e, time.time()-tim)
+
+        extint = "testint"
+        if score > -self.skip_external and score < self.skip_externalham:
+            self._ranking.interval = self.ranking_interval
+            externals = self._ranking.sort(externals)
+            externals = [strategy for strategy in externals
+                         if self._get_breaker(strategy).allow()]
+            if self.external_threads > 0 and externals:
+                extint = "testext"
+                score = self._test_concurrent(externals, req, author, content,
+                                              ip, score, reasons, outreasons,
+                                              results, verdicts, computed)
+            else:
+                for strategy in externals:
+                    if score <= -self.stop_external or \
+                       score >= self.stop_externalham:
+                        break
+                    extint = "testext"
+                    tim = time.time()
+                    try:
+                        retval = self._call_test(strategy, req, author,
+                                                 content, ip, verdicts,
+                                                 computed)
+                        tim = time.time()-tim
+                        score += self._apply_result(strategy, retval, tim,
+                                                    reasons, outreasons,
+                                                    results,
+                                                    self._is_cached(strategy,
+                                                                    verdicts))
+                    except Exception, e:
+                        self._test_failed(strategy, e, time.time()-tim)
+        return score, extint
+
+    def _test_failed(self, strategy, e, tim):
+        self._record_action('test', 'error', '', strategy, tim)
+        if isinstance(e, ServiceUnavailable):
+            self.log.warning('Filter strategy %s failed: %s', strategy, e)
+        else:
+            self.log.exception('Filter strategy %s raised exception: %s',
+                               strategy, e)
+
+    def _call_test(self, strategy, req, author, content, ip, verdicts,
+                   computed):
+        """Test the submission with `strategy`, or reuse the result of an
+        earlier test of the same content."""
+        name = get_strategy_name(strategy)
+        if name in verdicts:
+            return verdicts[name]
+        if not strategy.is_external():
+            retval = strategy.test(req, author, content, ip)
+        else:
+            breaker = self._get_breaker(strategy)
+            start = time.time()
+            try:
+                retval = strategy.test(req, author, content, ip)
+            except Exception:
+                breaker.failure()
+                self._ranking.record(name, time.time() - start, failed=True)
+                raise
+            tim = time.time() - start
+            self._report_call(breaker, True, tim)
+            self._ranking.record(name, tim, empty=not retval)
+        if computed is not None and name in self.verdict_cache_strategies:
+            computed[name] = retval
+        return retval
+
+    def _is_cached(self, strategy, verdicts):
+        return get_strategy_name(strategy) in verdicts
+
+    def _get_breaker(self, strategy):
+        name = get_strategy_name(strategy)
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(name,
+                    CircuitBreaker(name, self.log))
+        breaker.threshold = self.breaker_failures
+        breaker.cooldown = self.breaker_cooldown
+        return breaker
+
+    def _report_call(self, breaker, success, tim):
+        if success and tim <= self.breaker_timeout:
+            breaker.success()
+        else:
+            breaker.failure()
+
+    @cached
+    def _verdict_generation(self):
+        """Token replaced in all processes by `invalidate_verdicts()`."""
+        return object()
+
+    def _verdict_key(self, author, content):
+        if self.verdict_cache_size <= 0:
+            return None
+        self._verdicts.size = self.verdict_cache_size
+        generation = self._verdict_generation
+        if generation is not self._verdicts_generation:
+            # invalidated by another process
+            self._verdicts.clear()
+            self._verdicts_generation = generation
+        text = content
+        if self.verdict_cache_author:
+            text = author + '\n' + content
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _get_verdicts(self, key):
+        """Return the known results for the content with the given `key`
+        and whether the caller has to release the key afterwards.
+
+        If the same content is tested by another thread right now, wait for
+        its results.
+        """
+        if key is None:
+            return {}, False
+        event = self._verdicts.claim(key)
+        if event is not None:
+            event.wait(max(self.external_deadline, 1) * 2)
+            return self._verdicts.get(key, {}), False
+        verdicts = self._verdicts.get(key)
+        if verdicts is not None:
+            self._verdicts.release(key)
+            return verdicts, False
+        return {}, True
+
+    def _store_verdicts(self, key, verdicts, computed, claimed):
+        if computed:
+            merged = dict(verdicts)
+            merged.update(computed)
+            self._verdicts.set(key, merged, self.verdict_cache_ttl)
+        if claimed:
+            self._verdicts.release(key)
+
+    # Maximum number of log entries removed per transaction when purging
+    purge_chunk_size = 500
+
+    def _purge_if_due(self):
+        """Purge the log in a background thread if `purge_interval` has
+        passed."""
+        now = time.time()
+        if self._purging or now < self._purge_next:
+            return
+        with self._lock:
+            if self._purging:
+                return
+            self._purging = True
+            self._purge_next = now + self.purge_interval * 60
+        thread = threading.Thread(target=self._run_purge,
+                                  name='SpamFilter-purge')
+        thread.setDaemon(True)
+        thread.start()
+
+    def _run_purge(self):
+        try:
+            self.purge_log()
+        except Exception, e:
+            self.log.error('Failed to purge the spam filter log: %s', e,
+                           exc_info=True)
+        finally:
+            self._purging = False
+
+    def _get_log_writer(self):
+        with self._lock:
+            if self._log_writer is None:
+                self._log_writer = LogWriter(self.env,
+                                             purge=self._purge_if_due)
+            self._log_writer.size = self.logging_queue_size
+            return self._log_writer
+
+    def _get_pool(self):
+        with self._lock:
+            pool = self._pool
+            if pool is None or pool.size != max(1, self.external_threads):
+                if pool is not None:
+                    pool.shutdown()
+                pool = self._pool = ThreadPool(self.external_threads,
+                                               'SpamFilter-external')
+            return pool
+
+    def _test_concurrent(self, externals, req, author, content, ip, score,
+                         reasons, outreasons, results, verdicts, computed):
+        """Call the external strategies concurrently and return the updated
+        score.
+
+        Results are evaluated in the order they arrive. Strategies which did
+        not answer when the deadline is reached, or when the score reached
+        one of the stop limits, are abandoned.
+        """
+        pool = self._get_pool()
+        done = Queue()
+        pending = {}
+        for strategy in externals:
+            job = pool.submit(self._call_test, strategy, req, author,
+                              content, ip, verdicts, computed, notify=done)
+            pending[job] = strategy
+        start = time.time()
+        deadline = start + self.external_deadline
+        while pending:
+            if score <= -self.stop_external or \
+               score >= self.stop_externalham:
+                break
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                job = done.get(True, remaining)
+            except Empty:
+                break
+            strategy = pending.pop(job)
+            tim = job.finished - job.started
+            try:
+                score += self._apply_result(strategy, job.get(), tim,
+                                            reasons, outreasons, results,
+                                            self._is_cached(strategy,
+                                                            verdicts))
+            except Exception, e:
+                self._test_failed(strategy, e, tim)
+
+        for job, strategy in pending.iteritems():
+            job.cancel()
+            if job.started and not job.done():
+                self._record_action('test', 'error', '', strategy,
+                                    time.time() - job.started)
+                self.log.info('Filter strategy %s abandoned after %d seconds',
+                              strategy, time.time() - job.started)
+        return score
+
     def _combine_changes(self, changes, sep='\n\n'):
         fields = []
         for old_content, new_content in changes:
@@ -440,21 +882,44 @@ class FilterSystem(Component):
         return sep.join(fields)
 
     def _get_added_lines(self, old_content, new_content):
-        buf = []
-        old_lines = old_content.splitlines()
-        new_lines = new_content.splitlines()
-        matcher = SequenceMatcher(None, old_lines, new_lines)
-        for group in matcher.get_grouped_opcodes(0):
-            for tag, i1, i2, j1, j2 in group:
-                if tag in ('insert', 'replace'):
-                    buf.append('\n'.join(new_lines[j1:j2]))
+        return get_added_lines(old_content, new_content, self.diff_max_lines)
 
-        return '\n'.join(buf)
+    # Number of records after which collected statistics are written
+    # regardless of `statistics_interval`
+    statistics_batch = 1000
 
     def _record_action(self, action, data, status, strategy, delay):
-        stats = Statistics(self.env)
         if strategy:
             name = get_strategy_name(strategy)
-            stats.insert_or_update(name, action, data, status, delay, 1 if strategy.is_external() else 0)
+            external = 1 if strategy.is_external() else 0
+        else:
+            name = ''
+            external = None
+        if self.statistics_interval <= 0:
+            Statistics(self.env).insert_or_update(name, action, data, status,
+                                                  delay, external)
+            return
+        self._stats.add(name, action, data, status, delay, external)
+        self.log.debug("SPAMLOG: %s %s %s %s %.3f %s" % (action, data,
+            status, name, delay, "external" if external else "local"))
+        if self._stats.records >= self.statistics_batch:
+            self.flush_statistics()
         else:
-            stats.insert_or_update('', action, data, status, delay, None)
+            self._flush_later()
+
+    def _flush_later(self):
+        """Write the collected statistics after `statistics_interval`
+        seconds, even if nothing is recorded meanwhile."""
+        if self._flush_timer is not None:
+            return
+        with self._lock:
+            if self._flush_timer is not None:
+                return
+            self._flush_timer = threading.Timer(self.statistics_interval,
+                                                self._run_flush)
+            self._flush_timer.setDaemon(True)
+            self._flush_timer.start()
+
+    def _run_flush(self):
+        self._flush_timer = None
+        self.flush_statistics()
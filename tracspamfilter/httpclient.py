@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import errno
+import httplib
+import socket
+import threading
+import time
+import urllib
+import urllib2
+from urlparse import urlsplit
+
+from trac.config import FloatOption, IntOption
+from trac.core import *
+
+__all__ = ['HTTPClient', 'HTTPClientError', 'HTTPResponse',
+           'IHTTPRequestListener']
+
+
+class HTTPClientError(urllib2.URLError):
+    """A request failed or was answered with an error status.
+
+    `status` is the HTTP status of the answer, or `None` if there was none.
+    """
+
+    def __init__(self, reason, status=None):
+        urllib2.URLError.__init__(self, reason)
+        self.status = status
+
+
+class IHTTPRequestListener(Interface):
+    """Extension point interface for components that want to know about
+    the requests done by `HTTPClient`, e.g. to record their timing."""
+
+    def request_finished(method, url, status, elapsed):
+        """Called after a request, with the HTTP `status` of the response or
+        `None` if the request failed, and the `elapsed` seconds."""
+
+
+class HTTPResponse(object):
+    """Response of a request, read completely."""
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+def is_stale_connection(e, sent):
+    """Return whether the error `e` shows that the server closed a kept-alive
+    connection before it got the request, so the request can be repeated on
+    a new connection. `sent` tells whether the request was sent completely.
+    """
+    if isinstance(e, httplib.BadStatusLine):
+        # closed without sending anything
+        return e.line in ('', "''")
+    return not sent and \
+           getattr(e, 'errno', None) in (errno.ECONNRESET, errno.EPIPE)
+
+
+class ConnectionPool(object):
+    """Idle keep-alive connections to one host."""
+
+    def __init__(self, factory, size):
+        self.factory = factory
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return an idle connection and whether it was used before."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self.factory(), False
+
+    def put(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class HTTPClient(Component):
+    """HTTP client shared by the external services.
+
+    Connections are kept open and reused for later requests to the same
+    host. Requests use the timeouts and retries configured here, and
+    honour the proxies set in the environment like `urllib2`.
+    """
+
+    listeners = ExtensionPoint(IHTTPRequestListener)
+
+    connect_timeout = FloatOption('spam-filter', 'http_connect_timeout', '5',
+        """Seconds to wait for a connection to an external service.""",
+        doc_domain='tracspamfilter')
+
+    read_timeout = FloatOption('spam-filter', 'http_read_timeout', '10',
+        """Seconds to wait for data from an external service.""",
+        doc_domain='tracspamfilter')
+
+    retries = IntOption('spam-filter', 'http_retries', '0',
+        """Number of times a failed request to an external service is
+        repeated. Requests which timed out are not repeated, and requests
+        other than GET only if they did not reach the service. A request on
+        a kept-alive connection which the service closed meanwhile is
+        always repeated on a new connection.""",
+        doc_domain='tracspamfilter')
+
+    pool_size = IntOption('spam-filter', 'http_pool_size', '4',
+        """Number of idle connections kept open per host.""",
+        doc_domain='tracspamfilter')
+
+    # Methods which can be repeated without changing anything twice
+    idempotent = ('GET', 'HEAD')
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, url, data=None, headers=None, method=None):
+        """Return the body of the response to a request of `url`.
+
+        The request is a POST of the form data `data` if that is given and
+        a GET otherwise. Raises `HTTPClientError` if the request failed or
+        the response has an error status.
+        """
+        headers = dict(headers or {})
+        if data is not None:
+            headers.setdefault('Content-Type',
+                               'application/x-www-form-urlencoded')
+        response = self.request(method or (data is None and 'GET' or 'POST'),
+                                url, data, headers)
+        if response.status >= 400:
+            raise HTTPClientError('HTTP Error %s: %s' % (response.status,
+                                                         response.reason),
+                                  response.status)
+        return response.body
+
+    def request(self, method, url, body=None, headers=None):
+        """Do a request and return the `HTTPResponse`, whatever its status.
+
+        Raises `HTTPClientError` if no response was received.
+        """
+        pool, path = self._get_pool(url)
+        start = time.time()
+        status = None
+        attempts = max(0, self.retries) + 1
+        try:
+            while True:
+                conn, reused = pool.get()
+                sent = False
+                try:
+                    self._send(conn, method, path, body, headers or {})
+                    sent = True
+                    response = self._receive(conn)
+                except socket.timeout, e:
+                    # the service may still be working on the request
+                    conn.close()
+                    raise HTTPClientError(e)
+                except (socket.error, httplib.HTTPException), e:
+                    conn.close()
+                    if reused and is_stale_connection(e, sent):
+                        self.log.debug('Repeating %s request to %s on a new '
+                                       'connection (%s)', method, url, e)
+                        continue
+                    attempts -= 1
+                    if attempts <= 0 or \
+                            sent and method not in self.idempotent:
+                        raise HTTPClientError(e)
+                    self.log.debug('Repeating %s request to %s (%s)',
+                                   method, url, e)
+                    continue
+                if response.will_close:
+                    conn.close()
+                else:
+                    pool.put(conn)
+                status = response.status
+                return HTTPResponse(response.status, response.reason,
+                                    dict(response.getheaders()),
+                                    response.body)
+        finally:
+            elapsed = time.time() - start
+            self.log.debug('%s request to %s took %.3f seconds (%s)',
+                           method, url, elapsed, status)
+            for listener in self.listeners:
+                listener.request_finished(method, url, status, elapsed)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            pools, self._pools = self._pools.values(), {}
+        for pool in pools:
+            pool.clear()
+
+    # Internal methods
+
+    def _send(self, conn, method, path, body, headers):
+        if conn.sock is None:
+            conn.timeout = self.connect_timeout
+            conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        conn.request(method, path, body, headers)
+
+    def _receive(self, conn):
+        response = conn.getresponse()
+        response.body = response.read()
+        return response
+
+    def _get_pool(self, url):
+        """Return the connection pool for `url` and the path to request."""
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        if scheme not in ('http', 'https') or not netloc:
+            raise HTTPClientError('Unsupported URL %s' % url)
+        host = netloc.rsplit('@', 1)[-1]
+        path = (path or '/') + (query and '?' + query or '')
+        proxy = None
+        if not urllib.proxy_bypass(host.split(':')[0]):
+            proxy = urllib.getproxies().get(scheme)
+        if proxy:
+            proxy = urlsplit(proxy).netloc or proxy
+            if scheme == 'http':
+                # plain requests go to the proxy with the complete URL
+                path = '%s://%s%s' % (scheme, host, path)
+        key = (scheme, host, proxy)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(
+                    lambda: self._connect(scheme, host, proxy),
+                    self.pool_size)
+                self._pools[key] = pool
+            pool.size = self.pool_size
+        return pool, path
+
+    def _connect(self, scheme, host, proxy):
+        cls = scheme == 'https' and httplib.HTTPSConnection or \
+              httplib.HTTPConnection
+        if not proxy:
+            return cls(host, timeout=self.connect_timeout)
+        conn = cls(proxy, timeout=self.connect_timeout)
+        if scheme == 'https':
+            conn.set_tunnel(host)
+        return conn
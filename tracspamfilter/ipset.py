@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+__all__ = ['IPSet', 'RBLZone', 'format_network', 'parse_address',
+           'parse_networks']
+
+_BITS = {4: 32, 6: 128}
+
+
+class IPSet(object):
+    """Set of IPv4 and IPv6 networks for longest prefix lookups.
+
+    Networks are kept in one table per prefix length, which is a radix tree
+    flattened by level: a lookup probes each prefix length in use once, so
+    it takes at most as many steps as the address has bits, independent of
+    the number of networks.
+
+    Every network is stored with the entry it was given by, so lookups can
+    report the matching entries.
+    """
+
+    def __init__(self):
+        self._tables = {4: {}, 6: {}}
+        self._lengths = {4: [], 6: []}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, entry, value=None):
+        """Add the networks of `entry`, which can be an address, a network
+        in CIDR notation or a range of addresses like `10.0.0.5-10.0.0.9`.
+
+        `value` is returned by lookups matching the entry and defaults to
+        the entry itself. Returns `False` if `entry` is not in any of these
+        forms.
+        """
+        networks = parse_networks(entry)
+        if not networks:
+            return False
+        if value is None:
+            value = entry.strip()
+        for version, network, length in networks:
+            tables = self._tables[version]
+            if length not in tables:
+                tables[length] = {}
+                self._lengths[version] = sorted(tables, reverse=True)
+            tables[length].setdefault(network >> (_BITS[version] - length),
+                                      value)
+        self._count += 1
+        return True
+
+    def lookup(self, address):
+        """Return the values of all entries containing `address`, the most
+        specific first."""
+        parsed = parse_address(address)
+        if parsed is None:
+            return []
+        version, value = parsed
+        bits = _BITS[version]
+        tables = self._tables[version]
+        found = []
+        for length in self._lengths[version]:
+            entry = tables[length].get(value >> (bits - length))
+            if entry is not None and entry not in found:
+                found.append(entry)
+        return found
+
+    def __contains__(self, address):
+        return bool(self.lookup(address))
+
+
+class RBLZone(object):
+    """IPv4 blacklist read from a zone file in the `ip4set` or `ip4trie`
+    format of rbldnsd.
+
+    Entries are addresses, networks in CIDR notation, ranges, or prefixes
+    of up to three octets like `10.2` for `10.2.0.0/16`. They can be followed
+    by a `:value:text` part giving the A record returned for them, otherwise
+    the default set by a line `:value:text` is used. Entries starting with
+    `!` are excluded from the list.
+    """
+
+    default = '127.0.0.2'
+    excluded = '!'
+
+    def __init__(self, lines=()):
+        self._set = IPSet()
+        for line in lines:
+            self._parse_line(line)
+
+    def __len__(self):
+        return len(self._set)
+
+    def lookup(self, address):
+        """Return the A record of the most specific entry containing
+        `address`, or `None` if the address is not listed."""
+        values = self._set.lookup(address)
+        if values and values[0] != self.excluded:
+            return values[0]
+
+    # Internal methods
+
+    def _parse_line(self, line):
+        line = line.strip()
+        if not line or line[0] in '#;$':
+            return
+        if line[0] == ':':
+            self.default = self._parse_value(line) or self.default
+            return
+        entry = line.split(None, 1)[0].split(':', 1)[0]
+        value = self.default
+        if entry.startswith('!'):
+            entry = entry[1:]
+            value = self.excluded
+        elif line[len(entry):].strip().startswith(':'):
+            value = self._parse_value(line[len(entry):].strip()) or value
+        self._set.add(self._expand(entry), value)
+
+    def _parse_value(self, text):
+        value = text[1:].split(':', 1)[0].strip()
+        if value.isdigit():
+            # short form of rbldnsd, `:2:` means 127.0.0.2
+            value = '127.0.0.' + value
+        if parse_address(value):
+            return value
+
+    def _expand(self, entry):
+        """Write the short forms of rbldnsd as full addresses."""
+        if '/' in entry:
+            address, length = entry.split('/', 1)
+            return '%s/%s' % (self._pad(address, '0'), length)
+        if '-' in entry:
+            start, end = entry.split('-', 1)
+            start = start.split('.')
+            end = end.split('.')
+            end = start[:max(0, len(start) - len(end))] + end
+            return '%s-%s' % (self._pad('.'.join(start), '0'),
+                              self._pad('.'.join(end), '255'))
+        octets = entry.count('.') + 1
+        if octets < 4:
+            return '%s/%d' % (self._pad(entry, '0'), octets * 8)
+        return entry
+
+    def _pad(self, address, octet):
+        parts = address.split('.')
+        return '.'.join(parts + [octet] * (4 - len(parts)))
+
+
+def format_network(address, length):
+    """Return the network of the given prefix `length` containing `address`
+    in CIDR notation, or `None` if `address` is invalid or shorter than
+    `length`."""
+    parsed = parse_address(address)
+    if parsed is None or length > _BITS[parsed[0]]:
+        return None
+    version, value = parsed
+    bits = _BITS[version]
+    value &= ~((1 << (bits - length)) - 1)
+    if version == 4:
+        text = '.'.join(str(value >> shift & 0xff)
+                        for shift in (24, 16, 8, 0))
+    else:
+        groups = ['%x' % (value >> shift & 0xffff)
+                  for shift in range(112, -1, -16)]
+        # compress the longest run of zero groups
+        best, size = 0, 0
+        for idx in range(8):
+            run = 0
+            while idx + run < 8 and groups[idx + run] == '0':
+                run += 1
+            if run > size:
+                best, size = idx, run
+        if size > 1:
+            text = '%s::%s' % (':'.join(groups[:best]),
+                               ':'.join(groups[best + size:]))
+        else:
+            text = ':'.join(groups)
+    return '%s/%d' % (text, length)
+
+
+def parse_address(text):
+    """Return `(version, integer)` for an IPv4 or IPv6 address, or `None`.
+
+    IPv4 addresses mapped into IPv6 are returned as IPv4 addresses.
+    """
+    text = text.strip()
+    if ':' not in text:
+        value = _parse_ipv4(text)
+        return value is not None and (4, value) or None
+    value = _parse_ipv6(text)
+    if value is None:
+        return None
+    if value >> 32 == 0xffff:
+        return 4, value & 0xffffffff
+    return 6, value
+
+
+def parse_networks(text):
+    """Return the networks of an address, CIDR network or address range as
+    a list of `(version, network, prefix length)` tuples, or `None`."""
+    text = text.strip()
+    if '-' in text:
+        start, end = [parse_address(part) for part in text.split('-', 1)]
+        if start is None or end is None or start[0] != end[0] or \
+                start[1] > end[1]:
+            return None
+        return _summarize(start[0], start[1], end[1])
+    if '/' in text:
+        address, length = text.split('/', 1)
+        parsed = parse_address(address)
+        if parsed is None or not length.strip().isdigit():
+            return None
+        version, value = parsed
+        length = int(length)
+        if version == 4 and ':' in address:
+            length -= 96
+        bits = _BITS[version]
+        if not 0 <= length <= bits:
+            return None
+        return [(version, value & ~((1 << (bits - length)) - 1), length)]
+    parsed = parse_address(text)
+    if parsed is None:
+        return None
+    return [(parsed[0], parsed[1], _BITS[parsed[0]])]
+
+
+def _summarize(version, start, end):
+    """Split the range from `start` to `end` into CIDR networks."""
+    bits = _BITS[version]
+    networks = []
+    while start <= end:
+        size = bits
+        while size > 0 and start & ((1 << (bits - size + 1)) - 1) == 0 and \
+                start + (1 << (bits - size + 1)) - 1 <= end:
+            size -= 1
+        networks.append((version, start, size))
+        start += 1 << (bits - size)
+    return networks
+
+
+def _parse_ipv4(text):
+    parts = text.split('.')
+    if len(parts) != 4:
+        return None
+    value = 0
+    for part in parts:
+        if not part.isdigit() or len(part) > 3 or int(part) > 255:
+            return None
+        value = value << 8 | int(part)
+    return value
+
+
+def _parse_ipv6(text):
+    if text.count('::') > 1:
+        return None
+    tail = []
+    if '.' in text:
+        # an IPv4 address in the last 32 bits
+        text, sep, ipv4 = text.rpartition(':')
+        ipv4 = _parse_ipv4(ipv4)
+        if not sep or ipv4 is None:
+            return None
+        tail = [ipv4 >> 16, ipv4 & 0xffff]
+        if text.endswith(':'):
+            text += ':'
+    head, sep, rest = text.partition('::')
+    groups = []
+    split = 0
+    for idx, part in enumerate((head, rest)):
+        if part:
+            for group in part.split(':'):
+                if not 1 <= len(group) <= 4:
+                    return None
+                try:
+                    groups.append(int(group, 16))
+                except ValueError:
+                    return None
+        if idx == 0:
+            split = len(groups)
+    groups += tail
+    if sep:
+        if len(groups) > 7:
+            return None
+        groups[split:split] = [0] * (8 - len(groups))
+    elif len(groups) != 8:
+        return None
+    value = 0
+    for group in groups:
+        value = value << 16 | group
+    return value
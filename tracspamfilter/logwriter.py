@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import atexit
+from collections import deque
+import threading
+from weakref import WeakSet
+
+from tracspamfilter.model import LogEntry
+
+__all__ = ['LogWriter']
+
+# Writers whose queued entries are written when the process exits
+_writers = WeakSet()
+
+def _flush_writers():
+    for writer in list(_writers):
+        writer.flush()
+
+atexit.register(_flush_writers)
+
+
+class LogWriter(object):
+    """Write `LogEntry` objects to the database in a background thread.
+
+    Entries are queued in memory and inserted in batches. When the queue is
+    full, the oldest ham entry is dropped to make room. If the queue only
+    contains spam, a new ham entry is dropped instead, and a new spam entry
+    replaces the oldest spam entry. Remaining entries are written when the
+    process exits.
+    """
+
+    batch_size = 100
+
+    def __init__(self, env, size=1000, purge=None):
+        self.env = env
+        self.log = env.log
+        self.size = size
+        self.purge = purge
+        self.dropped = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        _writers.add(self)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, entry):
+        """Queue `entry` for insertion."""
+        with self._cond:
+            if len(self._queue) >= self.size and not self._make_room(entry):
+                self.dropped += 1
+                return
+            self._queue.append(entry)
+            self._cond.notify()
+        self._start()
+
+    def flush(self):
+        """Write all queued entries now."""
+        while self._write_batch():
+            pass
+
+    # Internal methods
+
+    def _make_room(self, entry):
+        """Drop an entry according to the overflow policy and return whether
+        `entry` can be queued."""
+        for queued in self._queue:
+            if not queued.rejected:
+                self._queue.remove(queued)
+                break
+        else:
+            if not entry.rejected:
+                return False
+            self._queue.popleft()
+        self.dropped += 1
+        if self.dropped % 100 == 1:
+            self.log.warn('Spam filter log queue is full, %d entries dropped',
+                          self.dropped)
+        return True
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='SpamFilter-log')
+                self._thread.setDaemon(True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+            self.flush()
+
+    def _write_batch(self):
+        """Write up to `batch_size` queued entries and return whether there
+        were any."""
+        with self._write_lock:
+            with self._cond:
+                batch = []
+                while self._queue and len(batch) < self.batch_size:
+                    batch.append(self._queue.popleft())
+            if not batch:
+                return False
+            try:
+                LogEntry.insert_many(self.env, batch)
+                if self.purge:
+                    self.purge()
+            except Exception, e:
+                self.log.error('Failed to write %d spam filter log entries: '
+                               '%s', len(batch), e, exc_info=True)
+            return True
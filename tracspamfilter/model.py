@@ -12,6 +12,7 @@
 # history and logs, available at http://projects.edgewall.com/trac/.
 
 import binascii
+import threading
 
 from datetime import datetime, timedelta
 from time import mktime,time
@@ -40,7 +41,8 @@ class LogEntry(object):
         Column('rejected', type='int'),
         Column('karma', type='int'),
         Column('reasons'),
-        Column('request')
+        Column('request'),
+        Index(['time'])
     ]
 
     def __init__(self, env, time, path, author, authenticated, ipnr, headers,
@@ -106,25 +108,34 @@ class LogEntry(object):
             """, (self.id,)):
             return self.__class__._from_db(self.env, row)
 
+    _insert_sql = """
+        INSERT INTO spamfilter_log
+            (time,path,author,authenticated,ipnr,headers,content,rejected,
+             karma,reasons,request)
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+        """
+
     def insert(self):
         """Insert a new log entry into the database."""
         assert not self.exists, 'Cannot insert existing log entry'
 
-        content = self._encode_content(self.content)
         with self.env.db_transaction as db:
             cursor = db.cursor()
-            cursor.execute("""
-                INSERT INTO spamfilter_log 
-                    (time,path,author,authenticated,ipnr,headers,content,rejected,
-                     karma,reasons,request)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                """, (int(self.time), self.path, self.author,
-                      int(bool(self.authenticated)), self.ipnr, self.headers,
-                      content, int(bool(self.rejected)), int(self.karma),
-                      self._reasons_to_xml(self.reasons),
-                      self._request_to_xml(self.request)))
+            cursor.execute(self._insert_sql, self._insert_values())
             self.id = db.get_last_id(cursor, 'spamfilter_log')
 
+    def insert_many(cls, env, entries):
+        """Insert several new log entries in one transaction.
+
+        The `id` of the entries is not set.
+        """
+        values = [entry._insert_values() for entry in entries]
+        with env.db_transaction as db:
+            cursor = db.cursor()
+            cursor.executemany(cls._insert_sql, values)
+
+    insert_many = classmethod(insert_many)
+
     def update(self, **kwargs):
         """Update the log entry in the database."""
         assert self.exists, 'Cannot update a non-existing log entry'
@@ -193,15 +204,51 @@ class LogEntry(object):
 
     count = classmethod(count)
 
-    def purge(cls, env, days):
-        """Delete log entries older than the specified number of days."""
+    def purge(cls, env, days, max_entries=None, chunk_size=None):
+        """Delete log entries older than the specified number of days and
+        the oldest entries exceeding `max_entries`.
+
+        With `chunk_size`, at most that many entries are deleted per
+        transaction. Returns the number of deleted entries.
+        """
         threshold = datetime.now() - timedelta(days=days)
-        env.db_transaction(
-            "DELETE FROM spamfilter_log WHERE time < %s",
-            (mktime(threshold.timetuple()),))
+        removed = cls._purge_where(env, "time < %s",
+                                   (mktime(threshold.timetuple()),),
+                                   chunk_size)
+        if max_entries:
+            for oldest, in env.db_query("""
+                SELECT time FROM spamfilter_log
+                ORDER BY time DESC LIMIT 1 OFFSET %s
+                """, (max_entries - 1,)):
+                removed += cls._purge_where(env, "time < %s", (oldest,),
+                                            chunk_size)
+        return removed
 
     purge = classmethod(purge)
 
+    def _purge_where(cls, env, where, args, chunk_size):
+        if not chunk_size:
+            with env.db_transaction as db:
+                cursor = db.cursor()
+                cursor.execute("DELETE FROM spamfilter_log WHERE " + where,
+                               args)
+                return max(cursor.rowcount, 0)
+        removed = 0
+        while True:
+            with env.db_transaction as db:
+                ids = [id for id, in db("""
+                    SELECT id FROM spamfilter_log WHERE %s
+                    ORDER BY id LIMIT %d
+                    """ % (where, chunk_size), args)]
+                if ids:
+                    db("DELETE FROM spamfilter_log WHERE id IN (%s)"
+                       % ",".join(["%s"] * len(ids)), ids)
+            removed += len(ids)
+            if len(ids) < chunk_size:
+                return removed
+
+    _purge_where = classmethod(_purge_where)
+
     def select(cls, env, ipnr=None, limit=None, offset=0):
         """Retrieve existing log entries from the database that match the
         specified criteria.
@@ -282,6 +329,13 @@ class LogEntry(object):
 
     _from_db = classmethod(_from_db)
 
+    def _insert_values(self):
+        return (int(self.time), self.path, self.author,
+                int(bool(self.authenticated)), self.ipnr, self.headers,
+                self._encode_content(self.content), int(bool(self.rejected)),
+                int(self.karma), self._reasons_to_xml(self.reasons),
+                self._request_to_xml(self.request))
+
     def _reasons_to_xml(self, reasons):
         root = ElementTree.Element("entries")
         for r in reasons:
@@ -371,32 +425,32 @@ class Statistics(object):
        self.env = env
 
     def insert_or_update(self, strategy, action, data, status, delay, external):
-        with self.env.db_transaction as db:
-            row = db("SELECT delay,delay_max,delay_min,count FROM "
-                "spamfilter_statistics WHERE action=%s "
-                "AND data=%s AND status=%s AND strategy=%s",
-                (action, data, status, strategy))
-            if row:
-                count = float(row[0][3])
-                delay_val = float(row[0][0])*(count/(count+1.0))+delay/(count+1.0)
-                delay_max = float(row[0][1])
-                if delay > delay_max:
-                    delay_max = delay
-                delay_min = float(row[0][2])
-                if delay < delay_min:
-                    delay_min = delay
-                count = int(row[0][3])+1
-                db("UPDATE spamfilter_statistics SET delay=%s,delay_max=%s,"
-                    "delay_min=%s,count=%s WHERE action=%s AND data=%s AND "
-                    "status=%s AND strategy=%s", (delay_val, delay_max,
-                    delay_min, count, action, data, status, strategy))
-            else:
-                db("INSERT INTO spamfilter_statistics VALUES (%s, %s, %s, %s, "
-                    "%s, %s, %s, 1, %s, %s)", (strategy, action, data, status, delay,
-                    delay, delay, external, int(time())))
+        self.merge({(strategy, action, data, status):
+                    (delay, delay, delay, 1, external, int(time()))})
         self.env.log.debug("SPAMLOG: %s %s %s %s %.3f %s" % (action, data,
             status, strategy, delay, "external" if external else "local"))
 
+    def merge(self, rows):
+        """Add statistics collected by a `StatisticsAggregator` to the
+        database in one transaction."""
+        with self.env.db_transaction as db:
+            for key, values in rows.iteritems():
+                strategy, action, data, status = key
+                row = db("SELECT delay,delay_max,delay_min,count FROM "
+                    "spamfilter_statistics WHERE action=%s "
+                    "AND data=%s AND status=%s AND strategy=%s",
+                    (action, data, status, strategy))
+                if row:
+                    delay, delay_max, delay_min, count = \
+                        merge_statistics(row[0], values)[:4]
+                    db("UPDATE spamfilter_statistics SET delay=%s,delay_max=%s,"
+                        "delay_min=%s,count=%s WHERE action=%s AND data=%s AND "
+                        "status=%s AND strategy=%s", (delay, delay_max,
+                        delay_min, count, action, data, status, strategy))
+                else:
+                    db("INSERT INTO spamfilter_statistics VALUES (%s, %s, %s, %s, "
+                        "%s, %s, %s, %s, %s, %s)", key + tuple(values))
+
     def clean(self, strategy):
         self.env.db_transaction(
             "DELETE FROM spamfilter_statistics WHERE strategy=%s", (strategy,))
@@ -404,7 +458,9 @@ class Statistics(object):
     def cleanall(self):
         self.env.db_transaction("DELETE FROM spamfilter_statistics")
 
-    def getstats(self):
+    def getstats(self, pending=None):
+        """Return the statistics per strategy and overall, including the
+        `pending` rows of a `StatisticsAggregator`."""
         strategies = {}
         overall = {}
         overall['test'] = 0
@@ -416,7 +472,7 @@ class Statistics(object):
         overall['testinttime'] = 0 
         overall['testexttime'] = 0 
         for strategy,action,data,status,delay,delay_max,delay_min,count,external,time in \
-                self.env.db_query("SELECT * FROM spamfilter_statistics"):
+                self._get_rows(pending):
            if strategy:
                str = strategies.get(strategy, {})
                str['type'] = "external" if external else "internal"
@@ -458,7 +514,29 @@ class Statistics(object):
                        overall['testham'] += count
         return strategies,overall
 
+    def _get_rows(self, pending):
+        rows = {}
+        for row in self.env.db_query("SELECT * FROM spamfilter_statistics"):
+            rows[tuple(row[:4])] = tuple(row[4:])
+        for key, values in (pending or {}).iteritems():
+            if key in rows:
+                rows[key] = merge_statistics(rows[key], values)
+            else:
+                rows[key] = tuple(values)
+        return [key + values for key, values in rows.iteritems()]
+
     def sortbyperformance(self, entries):
+        strategies = {}
+        for strategy, values in self.getperformance().iteritems():
+            strategies[strategy] = performance_score(values)
+        def mysort(val):
+            return strategies.get(get_strategy_name(val), 0)
+        entries = sorted(entries, key=mysort, reverse=True)
+        return entries
+
+    def getperformance(self):
+        """Return the figures `performance_score()` is computed from for
+        every external strategy."""
         strategies = {}
         for strategy,action,data,status,delay,count in self.env.db_query("""
             SELECT strategy,action,data,status,delay,count 
@@ -481,29 +559,81 @@ class Statistics(object):
                     str['ham'] =  True
                 str['testcount'] += count
             strategies[strategy] = str
-        for strategy,str in strategies.iteritems():
-            # 10% if ham is reported
-            c = 10 if str['ham'] else 0
-            # 40% if fast
-            s = 40-int(str['delay']*20)
-            c += s if s > 0 else 0
-            # 25% if low error rate
-            if str['count']:
-                e = 25-int(1000.0*str['err']/str['count'])
-            else:
-                e = 15
-            c += e if e > 0 else 0
-            # 25% if high answer rate
-            if str['testcount']:
-                a = 25-int(25.0*str['empty']/str['testcount'])
-            else:
-                a = 15
-            c += a if a > 0 else 0
-            strategies[strategy] = c
-        def mysort(val):
-            return strategies.get(get_strategy_name(val), 0)
-        entries = sorted(entries, key=mysort, reverse=True)
-        return entries
+        return strategies
+
+def performance_score(str):
+    """Rate an external strategy from 0 to 100 by the figures returned by
+    `Statistics.getperformance()`, higher is better."""
+    # 10% if ham is reported
+    c = 10 if str['ham'] else 0
+    # 40% if fast
+    s = 40-int(str['delay']*20)
+    c += s if s > 0 else 0
+    # 25% if low error rate
+    if str['count']:
+        e = 25-int(1000.0*str['err']/str['count'])
+    else:
+        e = 15
+    c += e if e > 0 else 0
+    # 25% if high answer rate
+    if str['testcount']:
+        a = 25-int(25.0*str['empty']/str['testcount'])
+    else:
+        a = 15
+    c += a if a > 0 else 0
+    return c
+
+def merge_statistics(row, other):
+    """Combine two `(delay, delay_max, delay_min, count, ...)` statistics
+    rows, the remaining values are taken from `row`."""
+    count = int(row[3]) + int(other[3])
+    delay = (float(row[0]) * int(row[3]) +
+             float(other[0]) * int(other[3])) / count
+    return (delay, max(float(row[1]), float(other[1])),
+            min(float(row[2]), float(other[2])), count) + tuple(row[4:])
+
+
+class StatisticsAggregator(object):
+    """Collect statistics in memory, so they can be written to the
+    database at once with `Statistics.merge`."""
+
+    def __init__(self):
+        self.rows = {}
+        self.records = 0
+        self.since = time()
+        self.lock = threading.Lock()
+
+    def add(self, strategy, action, data, status, delay, external):
+        key = (strategy, action, data, status)
+        values = (delay, delay, delay, 1, external, int(time()))
+        with self.lock:
+            if key in self.rows:
+                values = merge_statistics(self.rows[key], values)
+            self.rows[key] = values
+            self.records += 1
+
+    def pending(self):
+        """Return the collected rows which were not written yet."""
+        with self.lock:
+            return dict(self.rows)
+
+    def take(self):
+        """Return the collected rows and start collecting anew."""
+        with self.lock:
+            rows = self.rows
+            self.rows = {}
+            self.records = 0
+            self.since = time()
+        return rows
+
+    def restore(self, rows):
+        """Put back rows returned by `take()` which could not be written."""
+        with self.lock:
+            for key, values in rows.iteritems():
+                if key in self.rows:
+                    values = merge_statistics(self.rows[key], values)
+                self.rows[key] = values
+
 
 class SpamReport(object):
     table = Table('spamfilter_report', key=['id'])[
@@ -516,5 +646,110 @@ class SpamReport(object):
         Column('time', type='int')
     ]
 
-schema = [Bayes.table, LogEntry.table, Statistics.table, SpamReport.table]
-schema_version = 4
+class Throttle(object):
+    """Numbers of submissions per key and time slot, shared by all processes
+    serving the environment."""
+
+    table = Table('spamfilter_throttle', key=['name', 'slot'])[
+        Column('name'),
+        Column('slot', type='int'),
+        Column('count', type='int')
+    ]
+
+    def __init__(self, env):
+        self.env = env
+
+    def add(self, name, slot, since):
+        """Count a submission of `name` in `slot` and return the number of
+        submissions of `name` in the slots after `since`."""
+        if not self._increment(name, slot):
+            try:
+                self.env.db_transaction("INSERT INTO spamfilter_throttle "
+                                        "VALUES (%s,%s,1)", (name, slot))
+            except self.env.db_exc.IntegrityError:
+                # inserted by another process meanwhile
+                self._increment(name, slot)
+        for count, in self.env.db_query(
+                "SELECT SUM(count) FROM spamfilter_throttle "
+                "WHERE name=%s AND slot>%s", (name, since)):
+            return int(count or 0)
+        return 0
+
+    def purge(self, since):
+        """Remove the counts of the slots up to `since`."""
+        self.env.db_transaction(
+            "DELETE FROM spamfilter_throttle WHERE slot<=%s", (since,))
+
+    def _increment(self, name, slot):
+        """Return whether the count of an existing `slot` was increased."""
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            cursor.execute("UPDATE spamfilter_throttle SET count=count+1 "
+                           "WHERE name=%s AND slot=%s", (name, slot))
+            return bool(cursor.rowcount)
+
+class Reputation(object):
+    """Answers of the reputation services per identifier, e.g. the IP or the
+    email address of an author, kept across restarts."""
+
+    table = Table('spamfilter_reputation', key=['service', 'kind', 'value'])[
+        Column('service'),
+        Column('kind'),
+        Column('value'),
+        Column('answer'),
+        Column('time', type='int')
+    ]
+
+    def __init__(self, env):
+        self.env = env
+
+    def get(self, service, kind, value, since):
+        """Return the answer of `service` for `value` and the time it was
+        stored, or `None` if there is none stored after `since`."""
+        for answer, stored in self.env.db_query("""
+                SELECT answer,time FROM spamfilter_reputation
+                WHERE service=%s AND kind=%s AND value=%s AND time>%s
+                """, (service, kind, value, since)):
+            return answer, stored
+
+    def set(self, service, kind, value, answer, when):
+        if not self._update(service, kind, value, answer, when):
+            try:
+                self.env.db_transaction("INSERT INTO spamfilter_reputation "
+                                        "VALUES (%s,%s,%s,%s,%s)",
+                                        (service, kind, value, answer, when))
+            except self.env.db_exc.IntegrityError:
+                # inserted by another process meanwhile
+                self._update(service, kind, value, answer, when)
+
+    def delete(self, kind, value, service=None):
+        """Remove the answers for `value`, of all services if `service` is
+        not given."""
+        if service is None:
+            self.env.db_transaction("""
+                DELETE FROM spamfilter_reputation WHERE kind=%s AND value=%s
+                """, (kind, value))
+        else:
+            self.env.db_transaction("""
+                DELETE FROM spamfilter_reputation
+                WHERE service=%s AND kind=%s AND value=%s
+                """, (service, kind, value))
+
+    def purge(self, since):
+        """Remove the answers stored up to `since`."""
+        self.env.db_transaction(
+            "DELETE FROM spamfilter_reputation WHERE time<=%s", (since,))
+
+    def _update(self, service, kind, value, answer, when):
+        """Return whether an existing answer was replaced."""
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            cursor.execute("UPDATE spamfilter_reputation SET answer=%s,time=%s "
+                           "WHERE service=%s AND kind=%s AND value=%s",
+                           (answer, when, service, kind, value))
+            return bool(cursor.rowcount)
+
+
+schema = [Bayes.table, LogEntry.table, Statistics.table, SpamReport.table,
+          Throttle.table, Reputation.table]
+schema_version = 7
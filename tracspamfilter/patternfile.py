@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import os
+import threading
+import time
+
+__all__ = ['PatternFile']
+
+
+class PatternFile(object):
+    """Entries read from a local file, one per line.
+
+    The lines of the file are passed to `build`, together with the previous
+    matcher, which returns the new matcher.
+
+    `check()` looks at the modification time, inode and size of the file at
+    most once every `interval` seconds. If they changed, the file is read
+    again in a background thread and the new `matcher` replaces the old one
+    when it is complete.
+    """
+
+    def __init__(self, path, log, build, interval=60, name='pattern'):
+        self.path = path
+        self.log = log
+        self.build = build
+        self.interval = interval
+        self.name = name
+        self.matcher = build([], None)
+        self._stamp = None
+        self._checked = 0
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Start reloading the file in the background if it changed."""
+        now = time.time()
+        if now - self._checked < self.interval:
+            return
+        with self._lock:
+            if self._loading or now - self._checked < self.interval:
+                return
+            self._checked = now
+            stamp = self._get_stamp()
+            if stamp is None or stamp == self._stamp:
+                return
+            self._loading = True
+        thread = threading.Thread(target=self.load, args=(stamp,),
+                                  name='SpamFilter-patterns')
+        thread.setDaemon(True)
+        thread.start()
+
+    def load(self, stamp=None):
+        """Read the file now."""
+        try:
+            if stamp is None:
+                stamp = self._get_stamp()
+            if stamp is not None:
+                with open(self.path, 'r') as file:
+                    matcher = self.build(file, self.matcher)
+                self.matcher = matcher
+                self._stamp = stamp
+                self.log.debug('Loaded %s patterns from %s file',
+                               len(matcher), self.name)
+        except Exception, e:
+            self.log.warning('%s file cannot be read: %s', self.name, e)
+        finally:
+            self._loading = False
+            self._checked = time.time()
+
+    # Internal methods
+
+    def _get_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError, e:
+            self.log.warning('%s file cannot be opened: %s', self.name, e)
+            return None
+        return st.st_mtime, st.st_ino, st.st_size
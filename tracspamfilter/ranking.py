@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import threading
+import time
+
+from tracspamfilter.api import get_strategy_name
+from tracspamfilter.model import Statistics, performance_score
+
+__all__ = ['PerformanceRanking']
+
+
+class PerformanceRanking(object):
+    """Order the external strategies by their performance without reading
+    the statistics for every submission.
+
+    The statistics are read at most every `interval` seconds. Calls made
+    since the process started update exponentially weighted moving averages
+    of the delay, the failure rate and the rate of empty answers of every
+    strategy, which replace the figures from the statistics. So a strategy
+    which becomes slow or fails is moved to the end after a few calls.
+    """
+
+    # Weight of the latest call in the moving averages
+    alpha = 0.2
+
+    def __init__(self, env, interval=300):
+        self.env = env
+        self.interval = interval
+        self._stats = {}
+        self._loaded = 0
+        self._recent = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, delay, failed=False, empty=False):
+        """Add a call of the strategy `name` to the moving averages."""
+        values = (delay, failed and 1.0 or 0.0, empty and 1.0 or 0.0)
+        with self._lock:
+            averages = self._recent.get(name)
+            if averages is None:
+                self._recent[name] = list(values)
+                return
+            for idx, value in enumerate(values):
+                averages[idx] += self.alpha * (value - averages[idx])
+
+    def sort(self, strategies):
+        """Return `strategies` ordered by their performance, best first."""
+        self._refresh()
+        scores = {}
+        for strategy in strategies:
+            scores[strategy] = self.get_score(get_strategy_name(strategy))
+        return sorted(strategies, key=scores.get, reverse=True)
+
+    def get_score(self, name):
+        """Return the score of the strategy `name` like
+        `performance_score()`, less the rate of recent failures."""
+        stats = dict(self._stats.get(name) or
+                     {'count': 0, 'delay': 0, 'ham': False, 'err': 0,
+                      'empty': 0, 'testcount': 0})
+        recent = self._recent.get(name)
+        if recent is None:
+            return performance_score(stats)
+        delay, failed, empty = recent
+        stats.update(delay=delay, empty=empty, testcount=1.0)
+        return performance_score(stats) - int(25 * failed)
+
+    # Internal methods
+
+    def _refresh(self):
+        now = time.time()
+        if now - self._loaded < self.interval:
+            return
+        self._loaded = now
+        try:
+            self._stats = Statistics(self.env).getperformance()
+        except Exception, e:
+            self.env.log.warning('Reading the spam filter statistics '
+                                 'failed: %s', e)
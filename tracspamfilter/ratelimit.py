@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+from collections import OrderedDict
+import threading
+import time
+
+__all__ = ['SlidingWindow']
+
+
+class SlidingWindow(object):
+    """Number of events per key within the last `window` seconds.
+
+    The window is divided into `buckets` slots, e.g. one per minute, so a
+    key needs at most `buckets` counters and counting takes the same time
+    however many events there were. At most `size` keys are kept, the
+    least recently used key is dropped first.
+    """
+
+    def __init__(self, window=3600, buckets=60, size=100000):
+        self.window = window
+        self.buckets = buckets
+        self.size = size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def slot(self, when=None):
+        """Return the number of the slot containing the time `when`."""
+        if when is None:
+            when = time.time()
+        return int(when * self.buckets // self.window)
+
+    def add(self, key, when=None, count=1):
+        """Count `count` events of `key` at the time `when`, which defaults
+        to now, and return the number of events of `key` in the window."""
+        slot = self.slot(when)
+        current = self.slot()
+        with self._lock:
+            counts = self._keys.pop(key, None) or {}
+            if slot > current - self.buckets:
+                counts[slot] = counts.get(slot, 0) + count
+            total = self._sum(counts, current)
+            if counts:
+                while self._keys and len(self._keys) >= self.size:
+                    self._keys.popitem(last=False)
+                if self.size > 0:
+                    self._keys[key] = counts
+            return total
+
+    def count(self, key):
+        """Return the number of events of `key` in the window."""
+        current = self.slot()
+        with self._lock:
+            counts = self._keys.get(key)
+            if not counts:
+                return 0
+            return self._sum(counts, current)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+    # Internal methods
+
+    def _sum(self, counts, current):
+        total = 0
+        for slot in counts.keys():
+            if slot <= current - self.buckets:
+                del counts[slot]
+            else:
+                total += counts[slot]
+        return total
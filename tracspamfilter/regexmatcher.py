@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import re
+import sre_constants
+import sre_parse
+import threading
+import time
+
+__all__ = ['PatternMatcher', 'PatternStats', 'compile_patterns',
+           'unsafe_construct']
+
+
+class PatternMatcher(object):
+    """Find which of many regular expressions match a text.
+
+    For every pattern, a set of literal strings is derived of which at least
+    one has to occur in any text the pattern matches. The text is scanned
+    once for all these literals, and only the patterns for which one of them
+    was found are searched with their full regular expression.
+
+    Patterns without usable literals, and case insensitive or locale
+    dependent ones, are always searched.
+
+    A matcher is not changed after it is built, so threads can share it
+    without locking.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self._always = set()
+        self._by_literal = {}
+        for idx, pattern in enumerate(patterns):
+            literals = None
+            if not pattern.flags & (re.IGNORECASE | re.LOCALE):
+                literals = required_literals(pattern.pattern, pattern.flags)
+            if not literals:
+                self._always.add(idx)
+                continue
+            for literal in literals:
+                self._by_literal.setdefault(literal, []).append(idx)
+        self._scanner = None
+        self._prefixes = {}
+        if self._by_literal:
+            literals = self._by_literal.keys()
+            self._scanner = re.compile(u'(?=(%s))' % _trie_regex(literals),
+                                       re.UNICODE)
+            # The scanner reports the longest literal found at a position,
+            # shorter literals starting there are its prefixes.
+            known = set(literals)
+            for literal in literals:
+                self._prefixes[literal] = [literal[:i]
+                                           for i in xrange(1, len(literal))
+                                           if literal[:i] in known]
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def search(self, text, stats=None):
+        """Return the patterns matching `text` in their original order.
+
+        If a `PatternStats` object is given, quarantined patterns are
+        skipped and the time taken by every search is recorded.
+        """
+        candidates = set(self._always)
+        if self._scanner is not None:
+            found = set()
+            for match in self._scanner.finditer(text):
+                literal = match.group(1)
+                if literal not in found:
+                    found.add(literal)
+                    found.update(self._prefixes[literal])
+            for literal in found:
+                candidates.update(self._by_literal[literal])
+        patterns = self.patterns
+        if stats is None:
+            return [patterns[idx] for idx in sorted(candidates)
+                    if patterns[idx].search(text)]
+        matches = []
+        for idx in sorted(candidates):
+            pattern = patterns[idx]
+            if stats.is_quarantined(pattern.pattern):
+                continue
+            start = time.time()
+            match = pattern.search(text)
+            stats.record(pattern.pattern, time.time() - start,
+                         match is not None)
+            if match:
+                matches.append(pattern)
+        return matches
+
+
+def compile_patterns(lines, log, name='pattern', previous=()):
+    """Compile the regular expressions in the non-empty `lines`.
+
+    Invalid expressions are skipped with a warning. Patterns of `previous`
+    are reused for unchanged lines.
+    """
+    known = dict((pattern.pattern, pattern) for pattern in previous)
+    patterns = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        pattern = known.get(line)
+        if pattern is None:
+            try:
+                pattern = re.compile(line)
+            except re.error, e:
+                log.warning('Invalid %s pattern %s: %s', name, line, e)
+                continue
+        patterns.append(pattern)
+    return patterns
+
+
+class PatternStats(object):
+    """Search counts, matches and time spent per pattern.
+
+    A pattern whose search takes longer than `max_time` seconds is put into
+    quarantine, so it is skipped by later searches. `max_time` of 0 disables
+    this. Patterns can also be quarantined explicitly, e.g. when they contain
+    constructs known for catastrophic backtracking.
+    """
+
+    def __init__(self, log, max_time=0):
+        self.log = log
+        self.max_time = max_time
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, pattern, elapsed, matched):
+        with self._lock:
+            stats = self._get(pattern)
+            stats['searches'] += 1
+            if matched:
+                stats['matches'] += 1
+            stats['time'] += elapsed
+            stats['maxtime'] = max(stats['maxtime'], elapsed)
+            if self.max_time and elapsed > self.max_time and \
+                    not stats['quarantined']:
+                stats['quarantined'] = 'slow'
+                self.log.warning('Pattern %s took %.3f seconds and was '
+                                 'quarantined', pattern, elapsed)
+
+    def check(self, patterns):
+        """Quarantine those of `patterns` with unsafe constructs."""
+        for pattern in patterns:
+            reason = unsafe_construct(pattern.pattern, pattern.flags)
+            if reason and not self.is_quarantined(pattern.pattern):
+                self.log.warning('Pattern %s contains a %s and was '
+                                 'quarantined', pattern.pattern, reason)
+                self.quarantine(pattern.pattern, reason)
+
+    def quarantine(self, pattern, reason):
+        with self._lock:
+            self._get(pattern)['quarantined'] = reason
+
+    def is_quarantined(self, pattern):
+        stats = self._stats.get(pattern)
+        return stats is not None and bool(stats['quarantined'])
+
+    def get_stats(self, patterns):
+        """Return the statistics of `patterns` sorted by the total time
+        spent, quarantined patterns first."""
+        with self._lock:
+            result = [dict(self._get(pattern.pattern), pattern=pattern.pattern)
+                      for pattern in patterns]
+        result.sort(key=lambda stats: (not stats['quarantined'],
+                                       -stats['time']))
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    # Internal methods
+
+    def _get(self, pattern):
+        stats = self._stats.get(pattern)
+        if stats is None:
+            stats = self._stats[pattern] = {'searches': 0, 'matches': 0,
+                                            'time': 0.0, 'maxtime': 0.0,
+                                            'quarantined': None}
+        return stats
+
+
+def required_literals(pattern, flags=0):
+    """Return a list of strings of which at least one occurs in every text
+    matched by `pattern`, or `None` if there are no such strings."""
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except (sre_constants.error, RuntimeError):
+        return None
+    literals = _sequence_literals(list(parsed))
+    if literals and all(literals):
+        return sorted(set(literals))
+
+
+def unsafe_construct(pattern, flags=0):
+    """Return a short description of a construct in `pattern` which is
+    known to cause exponential backtracking, or `None`.
+
+    Detected are unbounded repeats which are nested in other unbounded
+    repeats without anything else required between them, like `(a+)+` or
+    `(\w+\s?)*`, and repeated identical alternatives, like `(a|a)*`.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except (sre_constants.error, RuntimeError):
+        return None
+    return _unsafe_items(list(parsed), False)
+
+
+def _unsafe_items(items, repeated):
+    for op, av in items:
+        if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            body = list(av[2])
+            unbounded = av[1] == sre_constants.MAXREPEAT
+            if unbounded and _repeats_alone(body):
+                return 'nested quantifier'
+            found = _unsafe_items(body, repeated or unbounded)
+        elif op == sre_constants.SUBPATTERN:
+            found = _unsafe_items(list(av[-1]), repeated)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            found = _unsafe_items(list(av[1]), repeated)
+        elif op == sre_constants.BRANCH:
+            branches = [list(branch) for branch in av[1]]
+            if repeated and len(set(map(repr, branches))) < len(branches):
+                return 'repeated identical alternatives'
+            found = None
+            for branch in branches:
+                found = found or _unsafe_items(branch, repeated)
+        else:
+            continue
+        if found:
+            return found
+
+
+def _repeats_alone(items):
+    """Return whether the sequence `items` contains an unbounded repeat and
+    everything else in it can match the empty string, so repeating the
+    sequence can split a text in exponentially many ways."""
+    for idx, (op, av) in enumerate(items):
+        if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            unbounded = av[1] == sre_constants.MAXREPEAT
+        elif op == sre_constants.SUBPATTERN:
+            unbounded = _repeats_alone(list(av[-1]))
+        else:
+            unbounded = False
+        if unbounded and _nullable(items[:idx] + items[idx + 1:]):
+            return True
+    return False
+
+
+def _nullable(items):
+    for op, av in items:
+        if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            if av[0] > 0 and not _nullable(list(av[2])):
+                return False
+        elif op == sre_constants.SUBPATTERN:
+            if not _nullable(list(av[-1])):
+                return False
+        elif op == sre_constants.BRANCH:
+            if not any(_nullable(list(branch)) for branch in av[1]):
+                return False
+        elif op not in (sre_constants.AT, sre_constants.ASSERT,
+                        sre_constants.ASSERT_NOT):
+            return False
+    return True
+
+
+def _sequence_literals(items):
+    """Return the most selective set of alternative literals required by
+    the sequence of parsed `items`."""
+    best = None
+    run = []
+    for op, av in items + [(None, None)]:
+        if op == sre_constants.LITERAL:
+            run.append(unichr(av))
+            continue
+        if run:
+            best = _better(best, [u''.join(run)])
+            run = []
+        if op == sre_constants.SUBPATTERN:
+            best = _better(best, _sequence_literals(list(av[-1])))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            if av[0] >= 1:
+                best = _better(best, _sequence_literals(list(av[2])))
+        elif op == sre_constants.BRANCH:
+            alternatives = []
+            for branch in av[1]:
+                literals = _sequence_literals(list(branch))
+                if not literals:
+                    alternatives = None
+                    break
+                alternatives.extend(literals)
+            best = _better(best, alternatives)
+    return best
+
+
+def _better(current, other):
+    if not other:
+        return current
+    if not current or min(map(len, other)) > min(map(len, current)):
+        return other
+    return current
+
+
+def _trie_regex(literals):
+    """Build a regular expression matching the longest of `literals` at a
+    position, structured as a trie so alternatives are not tried one by
+    one."""
+    trie = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[''] = True
+    return _node_regex(trie)
+
+
+def _node_regex(node):
+    end = '' in node
+    branches = []
+    for char in sorted(key for key in node if key):
+        child = node[char]
+        prefix = re.escape(char)
+        # collapse chains of single children
+        while len(child) == 1 and '' not in child:
+            char, child = child.items()[0]
+            prefix += re.escape(char)
+        branches.append(prefix + _node_regex(child))
+    if not branches:
+        return u''
+    if len(branches) == 1 and not end:
+        return branches[0]
+    regex = u'(?:%s)' % u'|'.join(branches)
+    if end:
+        # prefer the longer literals, the shorter ones are implied
+        regex += u'?'
+    return regex
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+from email.Utils import parseaddr
+import threading
+import time
+
+from trac.cache import cached
+from trac.config import BoolOption, IntOption
+from trac.core import *
+from trac.util.text import to_unicode
+from tracspamfilter.cache import LRUCache
+from tracspamfilter.model import Reputation
+
+__all__ = ['ReputationCache', 'get_identifiers']
+
+
+def get_identifiers(author, ip):
+    """Return the `(kind, value)` pairs the reputation services are asked
+    about for a submission: the IP and the name and email address of the
+    author, if known."""
+    # Split up author into name and email, if possible
+    author = author.encode('utf-8')
+    author_name, author_email = parseaddr(author)
+    if not author_name and not author_email:
+        author_name = author
+    elif not author_name and author_email.find("@") < 1:
+        author_name = author
+        author_email = None
+    if author_name == "anonymous":
+        author_name = None
+
+    identifiers = [('ip', ip)]
+    if author_name:
+        identifiers.append(('username', author_name))
+    if author_email:
+        identifiers.append(('email', author_email))
+    return identifiers
+
+
+class ReputationCache(Component):
+    """Cache of the answers of the services rating an IP, user name or
+    email address, like StopForumSpam.
+
+    Answers are kept per service and identifier for `reputation_cache_ttl`
+    seconds, so the same author is not looked up again for every
+    submission. The answers for an identifier are dropped when it is
+    reported as spam, in all processes if `reputation_cache_persistent`
+    is enabled.
+    """
+
+    cache_size = IntOption('spam-filter', 'reputation_cache_size', '10000',
+        """Number of answers of reputation services like StopForumSpam kept
+        in memory. Use 0 to disable.""", doc_domain='tracspamfilter')
+
+    ttl = IntOption('spam-filter', 'reputation_cache_ttl', '3600',
+        """Seconds to keep the answer of a reputation service about an IP,
+        user name or email address.""", doc_domain='tracspamfilter')
+
+    persistent = BoolOption('spam-filter', 'reputation_cache_persistent',
+                            'false',
+        """Whether the answers of reputation services are also stored in the
+        database, so they are kept across restarts and shared by all
+        processes.""", doc_domain='tracspamfilter')
+
+    def __init__(self):
+        self._cache = LRUCache(self.cache_size, self.ttl)
+        self._answers_generation = None
+        self._counts = {}
+        self._purged = 0
+        self._lock = threading.Lock()
+
+    def get(self, service, identifiers):
+        """Return the answers of `service` for all `identifiers`, or `None`
+        if one of them is not cached."""
+        if self.cache_size <= 0:
+            return None
+        self._cache.size = self.cache_size
+        if self.persistent:
+            generation = self._answer_generation
+            if generation is not self._answers_generation:
+                # invalidated by another process
+                self._cache.clear()
+                self._answers_generation = generation
+        answers = []
+        for kind, value in identifiers:
+            answer = self._cache.get((service, kind, value))
+            if answer is None and self.persistent:
+                answer = self._load(service, kind, value)
+            if answer is None:
+                self._count(service, False)
+                return None
+            answers.append(answer)
+        self._count(service, True)
+        return answers
+
+    def set(self, service, identifiers, answers):
+        """Store the `answers` of `service`, one string per identifier."""
+        if self.cache_size <= 0:
+            return
+        now = int(time.time())
+        for (kind, value), answer in zip(identifiers, answers):
+            self._cache.set((service, kind, value), answer, self.ttl)
+        if not self.persistent:
+            return
+        try:
+            model = Reputation(self.env)
+            for (kind, value), answer in zip(identifiers, answers):
+                model.set(service, kind, to_unicode(value), answer, now)
+            if now - self._purged > self.ttl:
+                self._purged = now
+                model.purge(now - self.ttl)
+        except Exception, e:
+            self.log.warning('Storing the answers of %s failed: %s',
+                             service, e)
+
+    def invalidate(self, identifiers, service=None):
+        """Drop the answers for `identifiers`, of all services if `service`
+        is not given."""
+        with self._lock:
+            services = service and [service] or self._counts.keys()
+        for kind, value in identifiers:
+            for name in services:
+                self._cache.delete((name, kind, value))
+            if self.persistent:
+                Reputation(self.env).delete(kind, to_unicode(value), service)
+        if self.persistent:
+            del self._answer_generation
+
+    def get_cache_stats(self):
+        """Return the cache usage of this process per service."""
+        with self._lock:
+            services = [{'name': name, 'hits': hits, 'misses': misses}
+                        for name, (hits, misses)
+                        in sorted(self._counts.iteritems())]
+        return {'enabled': self.cache_size > 0, 'size': len(self._cache),
+                'services': services}
+
+    # Internal methods
+
+    @cached
+    def _answer_generation(self):
+        """Token replaced in all processes by `invalidate()`."""
+        return object()
+
+    def _count(self, service, hit):
+        with self._lock:
+            hits, misses = self._counts.get(service, (0, 0))
+            if hit:
+                hits += 1
+            else:
+                misses += 1
+            self._counts[service] = (hits, misses)
+
+    def _load(self, service, kind, value):
+        now = int(time.time())
+        try:
+            row = Reputation(self.env).get(service, kind, to_unicode(value),
+                                           now - self.ttl)
+        except Exception, e:
+            self.log.warning('Reading the answers of %s failed: %s',
+                             service, e)
+            return None
+        if row is None:
+            return None
+        answer, stored = row
+        self._cache.set((service, kind, value), answer,
+                        stored + self.ttl - now)
+        return answer
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import threading
+import time
+
+from dns.exception import DNSException
+from dns.resolver import NXDOMAIN, NoAnswer, Resolver, Timeout
+
+from trac.config import FloatOption, IntOption
+from trac.core import *
+from tracspamfilter.cache import LRUCache
+from tracspamfilter.threadpool import ThreadPool
+
+__all__ = ['DNSResolver']
+
+
+class DNSResolver(Component):
+    """DNS resolver shared by the DNS based filter strategies.
+
+    Answers are cached for the TTL of their records, names which do not
+    exist for `dns_negative_ttl` seconds and failed lookups for
+    `dns_error_ttl` seconds.
+
+    Requires the dnspython module from http://www.dnspython.org/.
+    """
+
+    timeout = FloatOption('spam-filter', 'dns_timeout', '2',
+        """Seconds to wait for an answer of a single DNS server before the
+        next one is asked.""", doc_domain='tracspamfilter')
+
+    lifetime = FloatOption('spam-filter', 'dns_lifetime', '5',
+        """Maximum number of seconds to wait for the DNS lookups of one
+        check, e.g. for all lists in `ip_blacklist_servers`.""",
+        doc_domain='tracspamfilter')
+
+    threads = IntOption('spam-filter', 'dns_threads', '10',
+        """Number of threads doing DNS lookups concurrently.""",
+        doc_domain='tracspamfilter')
+
+    cache_size = IntOption('spam-filter', 'dns_cache_size', '10000',
+        """Number of DNS answers kept in memory, e.g. whether an IP is
+        listed by a blacklist. Use 0 to disable.""",
+        doc_domain='tracspamfilter')
+
+    negative_ttl = IntOption('spam-filter', 'dns_negative_ttl', '900',
+        """Seconds to remember that a name does not exist, e.g. that an IP
+        is not listed by a blacklist.""", doc_domain='tracspamfilter')
+
+    error_ttl = IntOption('spam-filter', 'dns_error_ttl', '60',
+        """Seconds to remember that a lookup timed out or failed, so a
+        blacklist which does not answer is not asked again for every
+        submission.""", doc_domain='tracspamfilter')
+
+    def __init__(self):
+        self._resolver = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self._cache = LRUCache(self.cache_size)
+
+    def query_all(self, names, rdtype='A'):
+        """Look up all `names` concurrently and return the answers in the
+        same order.
+
+        A lookup which failed is represented by its `DNSException`, a lookup
+        which did not finish within `lifetime` seconds by a `Timeout`.
+        """
+        self._cache.size = self.cache_size
+        keys = [(str(name).rstrip('.').lower(), rdtype) for name in names]
+        answers = [self._cache.get(key) for key in keys]
+        missing = [idx for idx, answer in enumerate(answers) if answer is None]
+        if not missing:
+            return answers
+
+        resolver = self._get_resolver()
+        pool = self._get_pool()
+        jobs = [pool.submit(resolver.query, names[idx], rdtype)
+                for idx in missing]
+        deadline = time.time() + self.lifetime
+        for idx, job in zip(missing, jobs):
+            if not job.wait(max(0, deadline - time.time())):
+                job.cancel()
+                answer = Timeout()
+            else:
+                try:
+                    answer = job.get()
+                except DNSException, e:
+                    answer = e
+            answers[idx] = answer
+            self._cache.set(keys[idx], answer, self._get_ttl(answer))
+        return answers
+
+    def query(self, name, rdtype='A'):
+        """Look up `name` within `lifetime` seconds and return the answer
+        or raise a `DNSException`."""
+        answer = self.query_all([name], rdtype)[0]
+        if isinstance(answer, DNSException):
+            raise answer
+        return answer
+
+    def get_cache_stats(self):
+        """Return the usage of the DNS cache of this process."""
+        cache = self._cache
+        return {'enabled': self.cache_size > 0, 'size': len(cache),
+                'hits': cache.hits, 'misses': cache.misses}
+
+    # Internal methods
+
+    def _get_ttl(self, answer):
+        if isinstance(answer, (NXDOMAIN, NoAnswer)):
+            return self.negative_ttl
+        elif isinstance(answer, DNSException):
+            return self.error_ttl
+        return answer.rrset.ttl
+
+    def _get_resolver(self):
+        with self._lock:
+            if self._resolver is None:
+                self._resolver = Resolver()
+            self._resolver.timeout = self.timeout
+            self._resolver.lifetime = self.lifetime
+            return self._resolver
+
+    def _get_pool(self):
+        with self._lock:
+            pool = self._pool
+            if pool is None or pool.size != max(1, self.threads):
+                if pool is not None:
+                    pool.shutdown()
+                pool = self._pool = ThreadPool(self.threads,
+                                               'SpamFilter-dns')
+            return pool
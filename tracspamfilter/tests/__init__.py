@@ -13,13 +13,31 @@
 
 import unittest
 
-from tracspamfilter.tests import api, model
+from tracspamfilter.tests import api, breaker, diff, httpclient, ipset, \
+                                 model, ranking, ratelimit, regexmatcher, \
+                                 reputation, threadpool, timeoutserverproxy
 from tracspamfilter.filters import tests as filters
+try:
+    from tracspamfilter.tests import resolver
+except ImportError: # dnspython is not installed
+    resolver = None
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(api.suite())
+    suite.addTest(breaker.suite())
+    suite.addTest(diff.suite())
+    suite.addTest(httpclient.suite())
+    suite.addTest(ipset.suite())
     suite.addTest(model.suite())
+    suite.addTest(ranking.suite())
+    suite.addTest(ratelimit.suite())
+    suite.addTest(regexmatcher.suite())
+    suite.addTest(reputation.suite())
+    suite.addTest(threadpool.suite())
+    suite.addTest(timeoutserverproxy.suite())
+    if resolver:
+        suite.addTest(resolver.suite())
     suite.addTest(filters.suite())
     return suite
 
@@ -11,13 +11,17 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://projects.edgewall.com/trac/.
 
+import gc
+import threading
 import time
 import unittest
+import weakref
 
 from trac.core import *
 from trac.db.sqlite_backend import _to_sql
 from trac.test import EnvironmentStub, Mock
-from tracspamfilter.api import IFilterStrategy, RejectContent
+from tracspamfilter.api import IFilterStrategy, RejectContent, \
+                               ServiceUnavailable
 from tracspamfilter.filtersystem import FilterSystem
 from tracspamfilter.model import LogEntry, schema
 
@@ -55,10 +59,45 @@ class DummyStrategy(Component):
     def is_external(self):
         return False
 
+class DummyExternalStrategy(Component):
+    implements(IFilterStrategy)
+
+    def __init__(self):
+        self.karma = 0
+        self.delay = 0
+        self.test_called = False
+        self.calls = 0
+
+    def configure(self, karma, delay=0):
+        self.karma = karma
+        self.delay = delay
+
+    def test(self, req, author, content, ip):
+        self.test_called = True
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.karma, "External"
+
+    def train(self, req, author, content, ip, spam=True):
+        pass
+
+    def is_external(self):
+        return True
+
+class SlowExternalStrategy(DummyExternalStrategy):
+    pass
+
+class FailingExternalStrategy(DummyExternalStrategy):
+
+    def test(self, req, author, content, ip):
+        self.calls += 1
+        raise ServiceUnavailable('Connection refused')
+
 class FilterSystemTestCase(unittest.TestCase):
 
     def setUp(self):
         self.env = EnvironmentStub(enable=[FilterSystem, DummyStrategy])
+        FilterSystem(self.env)._purging = True # no background purge in tests
 
         with self.env.db_transaction as db:
             cursor = db.cursor()
@@ -204,9 +243,232 @@ class FilterSystemTestCase(unittest.TestCase):
         self.assertEqual(False, entry.rejected)
 
 
+class ConcurrentExternalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[FilterSystem, DummyExternalStrategy,
+                                           SlowExternalStrategy])
+        self.env.config.set('spam-filter', 'logging_enabled', 'false')
+        self.env.config.set('spam-filter', 'external_threads', '2')
+        self.env.config.set('spam-filter', 'external_deadline', '1')
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            for table in schema:
+                cursor.execute("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    cursor.execute(stmt)
+        self.req = Mock(environ={}, path_info='/foo', authname='anonymous',
+                        remote_addr='127.0.0.1', args={})
+
+    def tearDown(self):
+        FilterSystem(self.env).flush_statistics()
+        with self.env.db_transaction as db:
+            for table in schema:
+                db("DROP TABLE IF EXISTS %s" % table.name)
+        self.env.reset_db()
+
+    def test_results_combined(self):
+        DummyExternalStrategy(self.env).configure(-5)
+        SlowExternalStrategy(self.env).configure(-5)
+        try:
+            FilterSystem(self.env).test(self.req, 'John Doe',
+                                        [(None, 'Test')])
+            self.fail('Expected RejectContent exception')
+        except RejectContent, e:
+            pass
+        self.assertEqual(True, DummyExternalStrategy(self.env).test_called)
+        self.assertEqual(True, SlowExternalStrategy(self.env).test_called)
+
+    def test_deadline(self):
+        DummyExternalStrategy(self.env).configure(5)
+        SlowExternalStrategy(self.env).configure(-10, 3)
+        start = time.time()
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertTrue(time.time() - start < 2.5)
+
+    def test_deadline_single_external(self):
+        env = EnvironmentStub(enable=[FilterSystem, SlowExternalStrategy])
+        env.config.set('spam-filter', 'logging_enabled', 'false')
+        env.config.set('spam-filter', 'external_threads', '2')
+        env.config.set('spam-filter', 'external_deadline', '1')
+        SlowExternalStrategy(env).configure(-10, 3)
+        start = time.time()
+        FilterSystem(env).test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertTrue(time.time() - start < 2.5)
+        self.assertEqual(True, SlowExternalStrategy(env).test_called)
+        FilterSystem(env)._flush_timer.cancel() # no tables to write to
+
+    def test_pool_resized(self):
+        filtersystem = FilterSystem(self.env)
+        pool = filtersystem._get_pool()
+        self.assertTrue(pool.submit(int).wait(1))
+        threads = list(pool._threads)
+        self.env.config.set('spam-filter', 'external_threads', '3')
+        self.assertEqual(3, filtersystem._get_pool().size)
+        # the workers of the replaced pool exit
+        for thread in threads:
+            thread.join(1)
+            self.assertFalse(thread.isAlive())
+
+
+class VerdictCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[FilterSystem, DummyStrategy,
+                                           DummyExternalStrategy,
+                                           SlowExternalStrategy])
+        self.env.config.set('spam-filter', 'logging_enabled', 'false')
+        self.env.config.set('spam-filter', 'verdict_cache_strategies',
+                            'DummyStrategy, SlowExternalStrategy')
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            for table in schema:
+                cursor.execute("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    cursor.execute(stmt)
+        self.req = Mock(environ={}, path_info='/foo', authname='anonymous',
+                        remote_addr='127.0.0.1', args={})
+
+    def tearDown(self):
+        FilterSystem(self.env).flush_statistics()
+        with self.env.db_transaction as db:
+            for table in schema:
+                db("DROP TABLE IF EXISTS %s" % table.name)
+        self.env.reset_db()
+
+    def test_results_reused(self):
+        DummyStrategy(self.env).configure(5)
+        DummyExternalStrategy(self.env).configure(5)
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+        DummyStrategy(self.env).test_called = False
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertEqual(False, DummyStrategy(self.env).test_called)
+        self.assertEqual(2, DummyExternalStrategy(self.env).calls)
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Other')])
+        self.assertEqual(True, DummyStrategy(self.env).test_called)
+        self.assertEqual(1, FilterSystem(self.env)._verdicts.hits)
+
+    def test_invalidated(self):
+        DummyStrategy(self.env).configure(5)
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+        DummyStrategy(self.env).test_called = False
+        # e.g. the BadContent page was changed in another process
+        del FilterSystem(self.env)._verdict_generation
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertEqual(True, DummyStrategy(self.env).test_called)
+
+    def test_reused_results_not_counted(self):
+        DummyStrategy(self.env).configure(5)
+        DummyExternalStrategy(self.env).configure(5)
+        for i in range(2):
+            FilterSystem(self.env).test(self.req, 'John Doe',
+                                        [(None, 'Test')])
+        counts = {}
+        for (strategy, action, data, status), values in \
+                FilterSystem(self.env).get_pending_statistics().iteritems():
+            if action == 'test':
+                counts[strategy] = counts.get(strategy, 0) + values[3]
+        self.assertEqual({'DummyStrategy': 1, 'SlowExternalStrategy': 1,
+                          'DummyExternalStrategy': 2}, counts)
+
+    def test_single_flight(self):
+        SlowExternalStrategy(self.env).configure(5, 0.5)
+        filtersystem = FilterSystem(self.env)
+        lock = threading.Lock()
+        def test():
+            # the in-memory database must not be used by several threads
+            # at once, so only let them overlap once it was queried
+            with lock:
+                filtersystem._verdict_generation
+            filtersystem.test(self.req, 'John Doe', [(None, 'Test')])
+        threads = [threading.Thread(target=test) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, SlowExternalStrategy(self.env).calls)
+
+
+class ServiceFailureTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[FilterSystem,
+                                           FailingExternalStrategy])
+        self.env.config.set('spam-filter', 'logging_enabled', 'false')
+        self.env.config.set('spam-filter', 'external_breaker_failures', '2')
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            for table in schema:
+                cursor.execute("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    cursor.execute(stmt)
+        self.req = Mock(environ={}, path_info='/foo', authname='anonymous',
+                        remote_addr='127.0.0.1', args={})
+
+    def tearDown(self):
+        FilterSystem(self.env).flush_statistics()
+        with self.env.db_transaction as db:
+            for table in schema:
+                db("DROP TABLE IF EXISTS %s" % table.name)
+        self.env.reset_db()
+
+    def test_fast_failures_open_breaker(self):
+        for i in range(4):
+            FilterSystem(self.env).test(self.req, 'John Doe',
+                                        [(None, 'Test %d' % i)])
+        self.assertEqual(2, FailingExternalStrategy(self.env).calls)
+        states = FilterSystem(self.env).get_breaker_states()
+        self.assertEqual([('FailingExternalStrategy', 'open', 2)],
+                         [(state['name'], state['state'], state['failures'])
+                          for state in states])
+
+
+class StatisticsFlushTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[FilterSystem])
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            for table in schema:
+                cursor.execute("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    cursor.execute(stmt)
+
+    def tearDown(self):
+        FilterSystem(self.env).flush_statistics()
+        with self.env.db_transaction as db:
+            for table in schema:
+                db("DROP TABLE IF EXISTS %s" % table.name)
+        self.env.reset_db()
+
+    def test_written_by_timer(self):
+        self.env.config.set('spam-filter', 'statistics_interval', '1')
+        filtersystem = FilterSystem(self.env)
+        filtersystem._record_action('test', 'spam', 'ok', None, 0.5)
+        filtersystem._record_action('test', 'spam', 'ok', None, 0.5)
+        # written without further submissions
+        filtersystem._flush_timer.join(5)
+        self.assertEqual({}, filtersystem.get_pending_statistics())
+        self.assertEqual([(2,)], self.env.db_query(
+            "SELECT count FROM spamfilter_statistics"))
+
+    def test_not_kept_alive(self):
+        env = EnvironmentStub(enable=[FilterSystem])
+        filtersystem = weakref.ref(FilterSystem(env))
+        writer = weakref.ref(FilterSystem(env)._get_log_writer())
+        del env
+        gc.collect()
+        self.assertEqual(None, filtersystem())
+        self.assertEqual(None, writer())
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(FilterSystemTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ConcurrentExternalTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(VerdictCacheTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ServiceFailureTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(StatisticsFlushTestCase, 'test'))
     return suite
 
 if __name__ == '__main__':
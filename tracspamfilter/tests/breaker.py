@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import unittest
+
+from trac.test import EnvironmentStub
+from tracspamfilter.breaker import CircuitBreaker
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.breaker = CircuitBreaker('Akismet', self.env.log, threshold=2,
+                                      cooldown=60)
+
+    def test_open_and_close(self):
+        breaker = self.breaker
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertEqual('open', breaker.state)
+        self.assertFalse(breaker.allow())
+
+        # after the cool-down a single probe is let through
+        breaker.opened -= 61
+        self.assertTrue(breaker.allow())
+        self.assertEqual('half-open', breaker.state)
+        self.assertFalse(breaker.allow())
+        breaker.success()
+        self.assertEqual('closed', breaker.state)
+        self.assertTrue(breaker.allow())
+
+    def test_probe_fails(self):
+        breaker = self.breaker
+        breaker.failure()
+        breaker.failure()
+        breaker.opened -= 61
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertEqual('open', breaker.state)
+        self.assertFalse(breaker.allow())
+        state = breaker.get_state()
+        self.assertEqual(3, state['failures'])
+        self.assertEqual(breaker.opened + 60, state['until'])
+
+    def test_disabled(self):
+        self.breaker.threshold = 0
+        for i in range(5):
+            self.breaker.failure()
+        self.assertEqual('closed', self.breaker.state)
+        self.assertTrue(self.breaker.allow())
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CircuitBreakerTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
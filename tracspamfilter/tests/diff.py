@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import unittest
+
+from tracspamfilter.diff import get_added_lines
+
+
+class GetAddedLinesTestCase(unittest.TestCase):
+
+    old = '\n'.join('line %d' % i for i in range(100))
+
+    def test_small_change(self):
+        new = self.old.replace('line 50', 'spam\nline 50\nmore spam')
+        self.assertEqual('spam\nmore spam', get_added_lines(self.old, new))
+
+    def test_unchanged(self):
+        self.assertEqual('', get_added_lines(self.old, self.old))
+
+    def test_large_change(self):
+        lines = self.old.splitlines()
+        lines.reverse()
+        lines.insert(30, 'spam')
+        lines.append('more spam')
+        new = '\n'.join(lines)
+        self.assertEqual('spam\nmore spam',
+                         get_added_lines(self.old, new, max_lines=50))
+
+    def test_append_only(self):
+        self.assertEqual('spam', get_added_lines(self.old, self.old + '\nspam',
+                                                 max_lines=0))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(GetAddedLinesTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
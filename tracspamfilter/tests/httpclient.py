@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import errno
+import socket
+import threading
+import unittest
+
+from trac.core import *
+from trac.test import EnvironmentStub, Mock
+from tracspamfilter.httpclient import HTTPClient, HTTPClientError, \
+                                      IHTTPRequestListener
+
+
+class DummyHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self._reply(self.path == '/missing' and 404 or 200, self.path)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._reply(200, self.rfile.read(length))
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DummyConnection(object):
+    """Connection whose requests fail with `error` when reading the
+    response."""
+
+    def __init__(self, error):
+        self.error = error
+        self.sock = Mock(settimeout=lambda timeout: None)
+        self.requests = 0
+
+    def request(self, method, path, body, headers):
+        self.requests += 1
+
+    def getresponse(self):
+        raise self.error
+
+    def close(self):
+        pass
+
+
+class RequestRecorder(Component):
+
+    implements(IHTTPRequestListener)
+
+    def __init__(self):
+        self.requests = []
+
+    def request_finished(self, method, url, status, elapsed):
+        self.requests.append((method, url, status))
+
+
+class HTTPClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[HTTPClient, RequestRecorder])
+        self.server = HTTPServer(('127.0.0.1', 0), DummyHandler)
+        self.server.connections = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.client = HTTPClient(self.env)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        self.assertEqual('/a?b=c', self.client.fetch(self.url + '/a?b=c'))
+        self.assertEqual('x=1', self.client.fetch(self.url + '/', 'x=1'))
+        self.assertEqual('/b', self.client.fetch(self.url + '/b'))
+        self.assertEqual(1, self.server.connections)
+
+    def test_error_status(self):
+        try:
+            self.client.fetch(self.url + '/missing')
+            self.fail('HTTPClientError not raised')
+        except HTTPClientError, e:
+            self.assertEqual(404, e.status)
+        self.assertEqual(404, self.client.request('GET', self.url +
+                                                  '/missing').status)
+        self.assertEqual([('GET', self.url + '/missing', 404)] * 2,
+                         RequestRecorder(self.env).requests)
+
+    def test_stale_connection(self):
+        self.client.fetch(self.url + '/')
+        # the server closes the kept-alive connection meanwhile
+        pool = self.client._pools.values()[0]
+        pool._idle[0].sock.shutdown(2)
+        self.assertEqual('/again', self.client.fetch(self.url + '/again'))
+        self.assertEqual(2, self.server.connections)
+
+    def _fail_with(self, error):
+        """Let the requests fail with `error` after they were sent, on the
+        connection kept from an earlier request and on new ones."""
+        connections = []
+        def connect(scheme, host, proxy):
+            connections.append(DummyConnection(error))
+            return connections[-1]
+        self.client._connect = connect
+        pool, path = self.client._get_pool(self.url)
+        pool.put(connect('http', None, None))
+        return connections
+
+    def test_no_repeat_after_timeout(self):
+        self.env.config.set('spam-filter', 'http_retries', '2')
+        connections = self._fail_with(socket.timeout('timed out'))
+        self.assertRaises(HTTPClientError, self.client.fetch, self.url)
+        self.assertEqual([1], [conn.requests for conn in connections])
+
+    def test_repeat_idempotent_only(self):
+        self.env.config.set('spam-filter', 'http_retries', '2')
+        connections = self._fail_with(socket.error(errno.ECONNRESET,
+                                                   'Connection reset'))
+        self.assertRaises(HTTPClientError, self.client.fetch, self.url,
+                          'x=1')
+        self.assertEqual([1], [conn.requests for conn in connections])
+        self.assertRaises(HTTPClientError, self.client.fetch, self.url)
+        self.assertEqual([1, 1, 1, 1],
+                         [conn.requests for conn in connections])
+
+    def test_connection_refused(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertRaises(HTTPClientError, self.client.fetch, self.url)
+        self.assertEqual([('GET', self.url, None)],
+                         RequestRecorder(self.env).requests)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(HTTPClientTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
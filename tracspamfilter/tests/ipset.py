@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import unittest
+
+from tracspamfilter.ipset import IPSet, RBLZone, format_network, \
+                                 parse_address, parse_networks
+
+
+class ParseTestCase(unittest.TestCase):
+
+    def test_addresses(self):
+        self.assertEqual((4, 0x7f000001), parse_address('127.0.0.1'))
+        self.assertEqual((6, 1), parse_address('::1'))
+        self.assertEqual((6, 0x20010db8 << 96 | 1),
+                         parse_address('2001:db8::1'))
+        self.assertEqual((4, 0xc0000201), parse_address('::ffff:192.0.2.1'))
+        for text in ['', '1.2.3', '1.2.3.256', '1::2::3', 'spam', r'^10\.']:
+            self.assertEqual(None, parse_address(text), text)
+
+    def test_networks(self):
+        self.assertEqual([(4, 0x0a000000, 8)], parse_networks('10.1.2.3/8'))
+        self.assertEqual([(4, 0x0a000005, 32), (4, 0x0a000006, 31),
+                          (4, 0x0a000008, 31)],
+                         parse_networks('10.0.0.5-10.0.0.9'))
+        self.assertEqual(None, parse_networks('10.0.0.9-10.0.0.5'))
+        self.assertEqual(None, parse_networks('10.0.0.0/33'))
+
+    def test_format_network(self):
+        self.assertEqual('10.1.2.0/24', format_network('10.1.2.3', 24))
+        self.assertEqual('2001:db8:1:2::/64',
+                         format_network('2001:db8:1:2:3::4', 64))
+        self.assertEqual('::1/128', format_network('::1', 128))
+        self.assertEqual(None, format_network('10.1.2.3', 64))
+
+
+class IPSetTestCase(unittest.TestCase):
+
+    def test_lookup(self):
+        ipset = IPSet()
+        for entry in ['10.0.0.0/8', '10.1.0.0/16', '10.1.2.3-10.1.2.7',
+                      '2001:db8::/32', '192.0.2.1']:
+            self.assertTrue(ipset.add(entry))
+        self.assertFalse(ipset.add(r'^10\.'))
+        self.assertEqual(5, len(ipset))
+
+        self.assertEqual(['10.1.2.3-10.1.2.7', '10.1.0.0/16', '10.0.0.0/8'],
+                         ipset.lookup('10.1.2.5'))
+        self.assertEqual(['10.0.0.0/8'], ipset.lookup('10.2.0.1'))
+        self.assertEqual(['2001:db8::/32'], ipset.lookup('2001:db8:1::1'))
+        self.assertEqual(['192.0.2.1'], ipset.lookup('::ffff:192.0.2.1'))
+        self.assertEqual([], ipset.lookup('192.0.2.2'))
+        self.assertEqual([], ipset.lookup('unknown'))
+
+
+class RBLZoneTestCase(unittest.TestCase):
+
+    def test_ip4set(self):
+        zone = RBLZone("""# comment
+$TTL 3600
+:127.0.0.3:Listed, see http://example.org/?$
+10.1
+10.2.3.4-10
+192.0.2.0/24 :127.0.0.4:Other
+192.0.2.7:127.0.0.5
+!10.1.2.3
+""".splitlines())
+        self.assertEqual(5, len(zone))
+        self.assertEqual('127.0.0.3', zone.lookup('10.1.9.9'))
+        self.assertEqual(None, zone.lookup('10.1.2.3'))
+        self.assertEqual('127.0.0.3', zone.lookup('10.2.3.10'))
+        self.assertEqual(None, zone.lookup('10.2.3.11'))
+        self.assertEqual('127.0.0.4', zone.lookup('192.0.2.1'))
+        self.assertEqual('127.0.0.5', zone.lookup('192.0.2.7'))
+        self.assertEqual(None, zone.lookup('192.0.3.1'))
+
+    def test_short_value(self):
+        zone = RBLZone("""\
+:2:Listed
+10.1
+192.0.2.7 :4:Other
+""".splitlines())
+        self.assertEqual('127.0.0.2', zone.lookup('10.1.9.9'))
+        self.assertEqual('127.0.0.4', zone.lookup('192.0.2.7'))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ParseTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(IPSetTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(RBLZoneTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -18,7 +18,9 @@ import unittest
 from trac.core import *
 from trac.db.sqlite_backend import _to_sql
 from trac.test import EnvironmentStub, Mock
-from tracspamfilter.model import LogEntry, schema
+from tracspamfilter.logwriter import LogWriter
+from tracspamfilter.model import LogEntry, Statistics, \
+                                 StatisticsAggregator, schema
 
 
 class LogEntryTestCase(unittest.TestCase):
@@ -29,6 +31,7 @@ class LogEntryTestCase(unittest.TestCase):
         with self.env.db_transaction as db:
             cursor = db.cursor()
             for table in schema:
+                cursor.execute("DROP TABLE IF EXISTS %s" % table.name)
                 for stmt in _to_sql(table):
                     cursor.execute(stmt)
 
@@ -50,10 +53,112 @@ class LogEntryTestCase(unittest.TestCase):
         entry = log[0]
         self.assertEqual('anonymous', entry.author)
 
+    def test_purge_chunked(self):
+        now = time.time()
+        for i in range(12):
+            LogEntry(self.env, now - i * 86400 - 3600, '/foo', 'user%d' % i, False,
+                     '127.0.0.1', '', 'Test', False, 5, [], None).insert()
+
+        self.assertEqual(4, LogEntry.purge(self.env, days=8, chunk_size=3))
+        self.assertEqual(3, LogEntry.purge(self.env, days=8, max_entries=5,
+                                           chunk_size=2))
+        self.assertEqual(['user%d' % i for i in range(5)],
+                         [entry.author for entry in LogEntry.select(self.env)])
+
+
+class LogWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            for table in schema:
+                cursor.execute("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    cursor.execute(stmt)
+        self.writer = LogWriter(self.env, size=2)
+        self.writer._thread = True # no background thread in tests
+
+    def _entry(self, author, rejected):
+        return LogEntry(self.env, time.time(), '/foo', author, False,
+                        '127.0.0.1', '', 'Test', rejected, 0, [],
+                        ['/foo', {'field': 'Test'}])
+
+    def test_flush(self):
+        self.writer.put(self._entry('john', False))
+        self.writer.put(self._entry('jane', True))
+        self.assertEqual(0, LogEntry.count(self.env))
+        self.writer.flush()
+        self.assertEqual(0, len(self.writer))
+        log = list(LogEntry.select(self.env))
+        self.assertEqual(set(['john', 'jane']),
+                         set(entry.author for entry in log))
+        self.assertEqual(['/foo', {'field': 'Test'}], log[0].request)
+
+    def test_overflow_drops_ham(self):
+        self.writer.put(self._entry('ham1', False))
+        self.writer.put(self._entry('spam1', True))
+        self.writer.put(self._entry('spam2', True))
+        self.writer.put(self._entry('ham2', False))
+        self.writer.put(self._entry('spam3', True))
+        self.writer.flush()
+        self.assertEqual(3, self.writer.dropped)
+        self.assertEqual(set(['spam2', 'spam3']),
+                         set(entry.author for entry
+                             in LogEntry.select(self.env)))
+
+
+class StatisticsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            for table in schema:
+                cursor.execute("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    cursor.execute(stmt)
+
+    def test_pending_merged(self):
+        stats = Statistics(self.env)
+        stats.insert_or_update('Bayesian', 'test', 'spam', 'ok', 1.0, 0)
+        aggregator = StatisticsAggregator()
+        aggregator.add('Bayesian', 'test', 'spam', 'ok', 2.0, 0)
+        aggregator.add('Bayesian', 'test', 'spam', 'ok', 3.0, 0)
+        aggregator.add('Bayesian', 'test', 'empty', '', 2.0, 0)
+        self.assertEqual(3, aggregator.records)
+        strategies, overall = stats.getstats(aggregator.pending())
+        self.assertEqual(3, strategies['Bayesian']['testspamok'])
+        self.assertEqual(4, strategies['Bayesian']['testtotal'])
+        self.assertEqual(2.0, strategies['Bayesian']['testtime'])
+
+        stats.merge(aggregator.take())
+        self.assertEqual({}, aggregator.pending())
+        self.assertEqual(strategies, stats.getstats()[0])
+        for row in self.env.db_query("SELECT delay_max,delay_min,count "
+                                     "FROM spamfilter_statistics "
+                                     "WHERE data='spam'"):
+            self.assertEqual((3.0, 1.0, 3), row)
+
+    def test_restore(self):
+        aggregator = StatisticsAggregator()
+        aggregator.add('Bayesian', 'test', 'spam', 'ok', 2.0, 0)
+        rows = aggregator.take()
+        aggregator.add('Bayesian', 'test', 'spam', 'ok', 4.0, 0)
+        aggregator.add('Bayesian', 'test', 'empty', '', 1.0, 0)
+        # e.g. the database was locked
+        aggregator.restore(rows)
+        pending = aggregator.pending()
+        self.assertEqual(2, len(pending))
+        self.assertEqual((3.0, 4.0, 2.0, 2),
+                         pending[('Bayesian', 'test', 'spam', 'ok')][:4])
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(LogEntryTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(LogWriterTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(StatisticsTestCase, 'test'))
     return suite
 
 if __name__ == '__main__':
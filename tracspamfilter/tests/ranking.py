@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import unittest
+
+from trac.db.sqlite_backend import _to_sql
+from trac.test import EnvironmentStub, Mock
+from tracspamfilter.model import Statistics, schema
+from tracspamfilter.ranking import PerformanceRanking
+
+
+class PerformanceRankingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            for table in schema:
+                cursor.execute("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    cursor.execute(stmt)
+        stats = Statistics(self.env)
+        stats.insert_or_update('Fast', 'test', 'spam', 'ok', 0.1, 1)
+        stats.insert_or_update('Slow', 'test', 'spam', 'ok', 1.5, 1)
+        self.fast = Mock(_name='Fast')
+        self.slow = Mock(_name='Slow')
+
+    def test_sort(self):
+        ranking = PerformanceRanking(self.env)
+        self.assertEqual([self.fast, self.slow],
+                         ranking.sort([self.slow, self.fast]))
+        self.assertEqual([self.fast, self.slow],
+                         Statistics(self.env).sortbyperformance(
+                             [self.slow, self.fast]))
+
+        # statistics are only read again after the interval
+        Statistics(self.env).cleanall()
+        self.assertEqual([self.fast, self.slow],
+                         ranking.sort([self.slow, self.fast]))
+
+    def test_recent_calls(self):
+        ranking = PerformanceRanking(self.env)
+        ranking.record('Fast', 0.1, failed=True)
+        for i in range(3):
+            ranking.record('Fast', 1.8, empty=True)
+        ranking.record('Slow', 0.2)
+        self.assertEqual([self.slow, self.fast],
+                         ranking.sort([self.fast, self.slow]))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(PerformanceRankingTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import time
+import unittest
+
+from tracspamfilter.ratelimit import SlidingWindow
+
+
+class SlidingWindowTestCase(unittest.TestCase):
+
+    def test_window(self):
+        window = SlidingWindow(3600, 60)
+        now = time.time()
+        self.assertEqual(1, window.add('a', now - 3000))
+        self.assertEqual(2, window.add('a', now - 60))
+        self.assertEqual(2, window.add('a', now - 4000))
+        self.assertEqual(3, window.add('a'))
+        self.assertEqual(1, window.add('b'))
+        self.assertEqual(3, window.count('a'))
+        self.assertEqual(0, window.count('c'))
+
+    def test_size(self):
+        window = SlidingWindow(3600, 60, size=2)
+        window.add('a')
+        window.add('b')
+        window.add('a')
+        window.add('c')
+        self.assertEqual(2, len(window))
+        self.assertEqual(0, window.count('b'))
+        self.assertEqual(2, window.count('a'))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SlidingWindowTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
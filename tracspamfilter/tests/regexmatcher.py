@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import re
+import unittest
+
+from trac.test import Mock
+from tracspamfilter.regexmatcher import PatternMatcher, PatternStats, \
+                                        required_literals, unsafe_construct
+
+
+class RequiredLiteralsTestCase(unittest.TestCase):
+
+    def test_literal(self):
+        self.assertEqual(['cheap-pills'], required_literals(r'cheap-pills'))
+
+    def test_longest_run(self):
+        self.assertEqual(['.example.com'],
+                         required_literals(r'https?://\w+\.example\.com'))
+
+    def test_branch(self):
+        self.assertEqual(['casino', 'poker'],
+                         required_literals(r'(online )?(poker|casino)'))
+
+    def test_no_literals(self):
+        self.assertEqual(None, required_literals(r'\d+|x'))
+        self.assertEqual(None, required_literals(r'(ab)*'))
+        self.assertEqual(None, required_literals(r'[a-z]{5}'))
+
+
+class UnsafeConstructTestCase(unittest.TestCase):
+
+    def test_unsafe(self):
+        for pattern in [r'(a+)+b', r'(\w+\s?)*$', r'(a|a)*b', r'((x*))+']:
+            self.assertNotEqual(None, unsafe_construct(pattern), pattern)
+
+    def test_safe(self):
+        for pattern in [r'foo', r'(a{2})+', r'https?://([a-z0-9-]+\.)+spam',
+                        r'(\w+\s+)+x', r'(foo|bar)+']:
+            self.assertEqual(None, unsafe_construct(pattern), pattern)
+
+
+class PatternMatcherTestCase(unittest.TestCase):
+
+    patterns = [r'viagra', r'via', r'^foo', r'bar$', r'(?i)CaSiNo',
+                r'\bpharm(acy|a)\b', r'[0-9]{4}-[0-9]{4}', r'a+b', r'ab']
+
+    def _naive(self, patterns, text):
+        return [pattern for pattern in patterns if pattern.search(text)]
+
+    def test_same_as_naive(self):
+        patterns = [re.compile(pattern) for pattern in self.patterns]
+        matcher = PatternMatcher(patterns)
+        for text in ['', 'viagra', 'vi agra via', 'foo\nbar', 'xfoo bar',
+                     'casino', 'pharmacy', 'pharmacyx', '1234-5678', 'aab',
+                     u'f\xfc\xdf viagra', 'nothing to see here']:
+            self.assertEqual(self._naive(patterns, text),
+                             matcher.search(text))
+
+    def test_order_preserved(self):
+        patterns = [re.compile(pattern) for pattern in ['zzz', 'aaa', 'mmm']]
+        matcher = PatternMatcher(patterns)
+        self.assertEqual(patterns, matcher.search('aaa mmm zzz'))
+
+    def test_slow_pattern_quarantined(self):
+        patterns = [re.compile(pattern) for pattern in ['spam', 'eggs']]
+        matcher = PatternMatcher(patterns)
+        stats = PatternStats(Mock(warning=lambda *args: None), max_time=0.5)
+        self.assertEqual(patterns, matcher.search('spam eggs', stats))
+        stats.record('eggs', 0.6, True)
+        self.assertEqual(patterns[:1], matcher.search('spam eggs', stats))
+        result = stats.get_stats(patterns)
+        self.assertEqual(['eggs', 'spam'], [p['pattern'] for p in result])
+        self.assertEqual('slow', result[0]['quarantined'])
+        self.assertEqual((2, 2), (result[0]['searches'],
+                                  result[0]['matches']))
+        stats.reset()
+        self.assertEqual(patterns, matcher.search('spam eggs', stats))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(RequiredLiteralsTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(UnsafeConstructTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(PatternMatcherTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import unittest
+
+from trac.db.sqlite_backend import _to_sql
+from trac.test import EnvironmentStub
+from tracspamfilter.model import Reputation, schema
+from tracspamfilter.reputation import ReputationCache, get_identifiers
+
+
+class ReputationCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[ReputationCache])
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            for table in schema:
+                cursor.execute("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    cursor.execute(stmt)
+        self.identifiers = get_identifiers(u'Jöe <joe@example.org>',
+                                           '10.0.0.1')
+
+    def test_get_identifiers(self):
+        self.assertEqual([('ip', '10.0.0.1'), ('username', 'J\xc3\xb6e'),
+                          ('email', 'joe@example.org')], self.identifiers)
+        self.assertEqual([('ip', '10.0.0.1')],
+                         get_identifiers(u'anonymous', '10.0.0.1'))
+
+    def test_cache(self):
+        cache = ReputationCache(self.env)
+        self.assertEqual(None, cache.get('Service', self.identifiers))
+        cache.set('Service', self.identifiers, ['', '90', ''])
+        self.assertEqual(['', '90', ''],
+                         cache.get('Service', self.identifiers))
+        self.assertEqual(None, cache.get('Other', self.identifiers))
+        # a new author is looked up again
+        self.assertEqual(None, cache.get('Service', self.identifiers[:1] +
+                                         [('username', 'jane')]))
+        cache.invalidate(self.identifiers[1:2], 'Service')
+        self.assertEqual(None, cache.get('Service', self.identifiers))
+        self.assertEqual([('Other', 0, 1), ('Service', 1, 3)],
+                         [(s['name'], s['hits'], s['misses'])
+                          for s in cache.get_cache_stats()['services']])
+
+    def test_persistent(self):
+        self.env.config.set('spam-filter', 'reputation_cache_persistent',
+                            'true')
+        cache = ReputationCache(self.env)
+        cache.set('Service', self.identifiers, ['5', '', '90'])
+        # a restart loses the answers in memory only
+        cache._cache.clear()
+        self.assertEqual(['5', '', '90'],
+                         cache.get('Service', self.identifiers))
+        cache._cache.clear()
+        cache.invalidate(self.identifiers[:1])
+        self.assertEqual(None, cache.get('Service', self.identifiers))
+
+    def test_persistent_concurrent_insert(self):
+        model = Reputation(self.env)
+        model.set('Service', 'ip', '10.0.0.1', '5', 1000)
+        update = model._update
+        missed = []
+        def update_late(*args):
+            if not missed:
+                # the row is inserted by another process meanwhile
+                missed.append(args)
+                return False
+            return update(*args)
+        model._update = update_late
+        model.set('Service', 'ip', '10.0.0.1', '90', 1001)
+        self.assertEqual(('90', 1001),
+                         model.get('Service', 'ip', '10.0.0.1', 0))
+
+    def test_invalidated_by_other_process(self):
+        self.env.config.set('spam-filter', 'reputation_cache_persistent',
+                            'true')
+        cache = ReputationCache(self.env)
+        cache.set('Service', self.identifiers, ['5', '', '90'])
+        self.assertEqual(['5', '', '90'],
+                         cache.get('Service', self.identifiers))
+        # another process got a report for the author
+        self.env.db_transaction("DELETE FROM spamfilter_reputation")
+        del cache._answer_generation
+        self.assertEqual(None, cache.get('Service', self.identifiers))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ReputationCacheTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from dns.resolver import NXDOMAIN, Timeout
+
+from trac.test import EnvironmentStub, Mock
+from tracspamfilter.filters.ip_blacklist import IPBlacklistFilterStrategy
+from tracspamfilter.resolver import DNSResolver
+
+
+class DummyAnswer(list):
+
+    def __init__(self, address, ttl):
+        list.__init__(self, [Mock(to_text=lambda: address)])
+        self.rrset = Mock(ttl=ttl)
+
+
+class DummyResolver(object):
+
+    def __init__(self, answers, delay=0.1):
+        self.answers = answers
+        self.delay = delay
+        self.queries = 0
+
+    def query(self, name, rdtype='A'):
+        self.queries += 1
+        time.sleep(self.delay)
+        answer = self.answers.get(str(name).rstrip('.'))
+        if answer is None:
+            raise NXDOMAIN()
+        return DummyAnswer(answer, 60)
+
+
+class DNSResolverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[DNSResolver,
+                                           IPBlacklistFilterStrategy])
+        self.resolver = DNSResolver(self.env)
+        self.resolver._resolver = DummyResolver({
+            '4.3.2.1.bl1.example.org': '127.0.0.2',
+            '4.3.2.1.bl3.example.org': '127.0.0.1'})
+        self.env.config.set('spam-filter', 'ip_blacklist_servers',
+                            'bl1.example.org, bl2.example.org, '
+                            'bl3.example.org')
+
+    def test_concurrent(self):
+        start = time.time()
+        retval = IPBlacklistFilterStrategy(self.env).test(Mock(), None, None,
+                                                          '1.2.3.4')
+        self.assertTrue(time.time() - start < 0.25)
+        self.assertEqual((-10, 'IP %s blacklisted by %s', '1.2.3.4',
+                          'bl1.example.org [2], bl3.example.org'), retval)
+
+    def test_lifetime(self):
+        self.env.config.set('spam-filter', 'dns_lifetime', '0.05')
+        answers = self.resolver.query_all(['4.3.2.1.bl1.example.org'])
+        self.assertTrue(isinstance(answers[0], Timeout))
+        self.assertRaises(Timeout, self.resolver.query, 'bl1.example.org')
+        time.sleep(0.1) # let the abandoned lookups finish
+
+    def test_cache(self):
+        names = ['4.3.2.1.bl1.example.org', '4.3.2.1.bl2.example.org']
+        answers = self.resolver.query_all(names)
+        self.assertEqual(2, self.resolver._resolver.queries)
+        self.assertEqual(answers, self.resolver.query_all(names))
+        self.assertEqual(2, self.resolver._resolver.queries)
+        stats = self.resolver.get_cache_stats()
+        self.assertEqual((2, 2, 2), (stats['size'], stats['hits'],
+                                     stats['misses']))
+
+        self.resolver._cache.clear()
+        self.env.config.set('spam-filter', 'dns_negative_ttl', '0')
+        self.resolver.query_all(names)
+        self.resolver.query_all(names)
+        self.assertEqual(5, self.resolver._resolver.queries)
+
+    def test_zone(self):
+        dirname = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dirname, 'bl2.zone')
+            with open(path, 'w') as f:
+                f.write('1.2.3.0/24 :127.0.0.4:\n')
+            self.env.config.set('spam-filter', 'ip_blacklist_zones',
+                                'bl2.example.org=%s, local=%s' % (path, path))
+            strategy = IPBlacklistFilterStrategy(self.env)
+            retval = strategy.test(Mock(), None, None, '1.2.3.4')
+            self.assertEqual((-20, 'IP %s blacklisted by %s', '1.2.3.4',
+                              'bl1.example.org [2], bl2.example.org [4], '
+                              'bl3.example.org, local [4]'), retval)
+            # bl1 and bl3 are looked up via DNS, bl2 in the zone file
+            self.assertEqual(2, self.resolver._resolver.queries)
+        finally:
+            shutil.rmtree(dirname)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(DNSResolverTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import time
+import unittest
+
+from tracspamfilter.threadpool import ThreadPool
+
+
+class ThreadPoolTestCase(unittest.TestCase):
+
+    def test_result(self):
+        pool = ThreadPool(2)
+        job = pool.submit(divmod, 7, 2)
+        self.assertTrue(job.wait(1))
+        self.assertEqual((3, 1), job.get())
+        job = pool.submit(divmod, 7, 0)
+        self.assertTrue(job.wait(1))
+        self.assertRaises(ZeroDivisionError, job.get)
+        pool.shutdown()
+
+    def test_shutdown(self):
+        pool = ThreadPool(2)
+        jobs = [pool.submit(time.sleep, 0.05) for i in range(4)]
+        threads = list(pool._threads)
+        pool.shutdown()
+        # queued calls are still done
+        for job in jobs:
+            self.assertTrue(job.wait(1))
+        for thread in threads:
+            thread.join(1)
+            self.assertFalse(thread.isAlive())
+
+
+def suite():
+    return unittest.makeSuite(ThreadPoolTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+from SocketServer import ThreadingMixIn
+import socket
+import threading
+import time
+import unittest
+from xmlrpclib import Fault
+
+from tracspamfilter.timeoutserverproxy import get_server_proxy
+
+
+class DummyHandler(SimpleXMLRPCRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        SimpleXMLRPCRequestHandler.setup(self)
+        self.server.connections += 1
+
+
+class DummyServer(ThreadingMixIn, SimpleXMLRPCServer):
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass # e.g. the client gave up on a slow call
+
+
+class PersistentTransportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = DummyServer(('127.0.0.1', 0), DummyHandler,
+                                  logRequests=False)
+        self.server.connections = 0
+        self.server.calls = 0
+        self.server.register_function(lambda x: x * 2, 'double')
+        self.server.register_function(self._sleep, 'sleep')
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.uri = 'http://127.0.0.1:%d/RPC2' % self.server.server_address[1]
+
+    def tearDown(self):
+        get_server_proxy(self.uri)('transport').close()
+        get_server_proxy(self.uri, 0.2)('transport').close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        proxy = get_server_proxy(self.uri)
+        self.assertTrue(proxy is get_server_proxy(self.uri))
+        self.assertEqual(4, proxy.double(2))
+        self.assertEqual(6, get_server_proxy(self.uri).double(3))
+        self.assertEqual(1, self.server.connections)
+
+    def test_reconnect(self):
+        proxy = get_server_proxy(self.uri)
+        self.assertEqual(4, proxy.double(2))
+        transport = proxy('transport')
+        transport._pools.values()[0]._idle[0].sock.shutdown(2)
+        self.assertEqual(6, proxy.double(3))
+        self.assertEqual(2, self.server.connections)
+
+    def test_fault_closes_connection(self):
+        proxy = get_server_proxy(self.uri)
+        transport = proxy('transport')
+        connections = []
+        connect = transport.make_connection
+        def make_connection(host):
+            connections.append(connect(host))
+            return connections[-1]
+        transport.make_connection = make_connection
+        try:
+            self.assertRaises(Fault, proxy.double)
+        finally:
+            del transport.make_connection
+        self.assertEqual(None, connections[0].sock)
+        self.assertEqual(4, proxy.double(2))
+
+    def test_no_repeat_after_timeout(self):
+        proxy = get_server_proxy(self.uri, 0.2)
+        self.assertEqual(4, proxy.double(2))
+        self.assertRaises(socket.timeout, proxy.sleep, 0.5)
+        self.assertEqual(1, self.server.calls)
+        self.assertEqual(1, self.server.connections)
+
+    def _sleep(self, seconds):
+        self.server.calls += 1
+        time.sleep(seconds)
+        return True
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(PersistentTransportTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
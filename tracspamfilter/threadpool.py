@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import sys
+import threading
+import time
+from Queue import Queue
+
+__all__ = ['ThreadPool']
+
+
+class Job(object):
+    """Handle for a call submitted to a `ThreadPool`."""
+
+    def __init__(self, func, args, kwargs, notify=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.notify = notify
+        self.result = None
+        self.exc_info = None
+        self.cancelled = False
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    def cancel(self):
+        """Prevent the call from being started, if it is still queued."""
+        self.cancelled = True
+
+    def done(self):
+        return self._done.isSet()
+
+    def wait(self, timeout=None):
+        """Wait for the call to finish and return whether it did."""
+        self._done.wait(timeout)
+        return self._done.isSet()
+
+    def get(self):
+        """Return the result of the call or re-raise its exception."""
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+    def _run(self):
+        if self.cancelled:
+            return
+        self.started = time.time()
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except Exception:
+            self.exc_info = sys.exc_info()
+        self.finished = time.time()
+        self._done.set()
+        if self.notify is not None:
+            self.notify.put(self)
+
+
+class ThreadPool(object):
+    """A bounded pool of daemon worker threads.
+
+    Threads are started lazily on the first submitted call. Calls that are
+    still running when the caller gives up on them cannot be interrupted,
+    they simply finish in the background and their result is dropped.
+    """
+
+    def __init__(self, size, name='SpamFilter'):
+        self.size = max(1, size)
+        self.name = name
+        self._queue = Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue `func(*args, **kwargs)` for execution and return a `Job`.
+
+        If the `notify` keyword argument is given, it has to be a `Queue`
+        into which the job is put once the call is finished.
+        """
+        notify = kwargs.pop('notify', None)
+        job = Job(func, args, kwargs, notify)
+        self._start_workers()
+        self._queue.put(job)
+        return job
+
+    def shutdown(self):
+        """Let the worker threads exit once the queued calls are done.
+
+        The pool must not be used anymore afterwards.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            self._queue.put(None)
+
+    # Internal methods
+
+    def _start_workers(self):
+        if len(self._threads) >= self.size:
+            return
+        with self._lock:
+            while len(self._threads) < self.size:
+                thread = threading.Thread(target=self._worker,
+                    name='%s-%d' % (self.name, len(self._threads) + 1))
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None: # shut down
+                return
+            job._run()
@@ -14,8 +14,12 @@
 #
 # Author: Dirk Stöcker <trac@dstoecker.de>
 
-from xmlrpclib import ServerProxy, Transport, Error
+from xmlrpclib import ProtocolError, ServerProxy, Transport, Error
 import httplib
+import socket
+import threading
+
+from tracspamfilter.httpclient import ConnectionPool, is_stale_connection
 
 class TimeoutHTTPConnection(httplib.HTTPConnection):
     def __init__(self,host,timeout=3):
@@ -43,7 +47,84 @@ class TimeoutTransport(Transport):
         return conn
 
 
+class PersistentTransport(TimeoutTransport):
+    """Transport keeping connections open for later calls (HTTP/1.1
+    keep-alive).
+
+    Every call takes an idle connection to the host or opens a new one, so
+    the transport can be used by several threads at once. A call on a kept
+    connection which the server closed before getting the call is repeated
+    on a new connection. Other failed calls are not repeated, as the server
+    may have processed them.
+    """
+
+    def __init__(self, timeout=3, pool_size=4, *l, **kw):
+        TimeoutTransport.__init__(self, timeout, *l, **kw)
+        self.pool_size = pool_size
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def request(self, host, handler, request_body, verbose=0):
+        pool = self._get_pool(host)
+        while True:
+            conn, reused = pool.get()
+            sent = kept = False
+            try:
+                self.send_request(conn, handler, request_body)
+                self.send_host(conn, host)
+                self.send_user_agent(conn)
+                self.send_content(conn, request_body)
+                sent = True
+                response = conn.getresponse(buffering=True)
+                if response.status != 200:
+                    response.read()
+                    raise ProtocolError(host + handler, response.status,
+                                        response.reason, response.msg)
+                self.verbose = verbose
+                result = self.parse_response(response)
+                if not response.will_close:
+                    pool.put(conn)
+                    kept = True
+                return result
+            except (socket.error, httplib.HTTPException), e:
+                if not (reused and is_stale_connection(e, sent)):
+                    raise
+            finally:
+                if not kept:
+                    conn.close()
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools.values(), {}
+        for pool in pools:
+            pool.clear()
+
+    def _get_pool(self, host):
+        with self._lock:
+            pool = self._pools.get(host)
+            if pool is None:
+                pool = ConnectionPool(lambda: self.make_connection(host),
+                                      self.pool_size)
+                self._pools[host] = pool
+            return pool
+
+
 class TimeoutServerProxy(ServerProxy):
     def __init__(self,uri,timeout=3,*l,**kw):
-        kw['transport']=TimeoutTransport(timeout=timeout, use_datetime=kw.get('use_datetime',0))
+        kw.setdefault('transport', TimeoutTransport(timeout=timeout, use_datetime=kw.get('use_datetime',0)))
         ServerProxy.__init__(self,uri,*l,**kw)
+
+
+_proxies = {}
+_proxies_lock = threading.Lock()
+
+def get_server_proxy(uri, timeout=3):
+    """Return a proxy for the XML-RPC service at `uri` which is shared by
+    all callers and reuses its connections."""
+    with _proxies_lock:
+        proxy = _proxies.get((uri, timeout))
+        if proxy is None:
+            proxy = TimeoutServerProxy(uri, timeout,
+                transport=PersistentTransport(timeout=timeout))
+            _proxies[(uri, timeout)] = proxy
+        return proxy
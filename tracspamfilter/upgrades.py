@@ -136,9 +136,40 @@ def add_report_table(env, db):
     for stmt in _schema_to_sql(env, db, table):
         cursor.execute(stmt)
 
+def add_time_index_to_log_table(env, db):
+    """Add an index on the time of log entries, used for purging."""
+    db("CREATE INDEX spamfilter_log_time_idx ON spamfilter_log (time)")
+
+def add_throttle_table(env, db):
+    """Add table for counting submissions per IP in all processes."""
+    table = Table('spamfilter_throttle', key=['name', 'slot'])[
+        Column('name'),
+        Column('slot', type='int'),
+        Column('count', type='int')
+    ]
+    cursor = db.cursor()
+    for stmt in _schema_to_sql(env, db, table):
+        cursor.execute(stmt)
+
+def add_reputation_table(env, db):
+    """Add table for keeping the answers of reputation services."""
+    table = Table('spamfilter_reputation', key=['service', 'kind', 'value'])[
+        Column('service'),
+        Column('kind'),
+        Column('value'),
+        Column('answer'),
+        Column('time', type='int')
+    ]
+    cursor = db.cursor()
+    for stmt in _schema_to_sql(env, db, table):
+        cursor.execute(stmt)
+
 version_map = {
     1: [add_log_table],
     2: [add_headers_column_to_log_table],
     3: [add_bayes_table],
-    4: [add_statistics_table, add_request_column_to_log_table, add_report_table]
+    4: [add_statistics_table, add_request_column_to_log_table, add_report_table],
+    5: [add_time_index_to_log_table],
+    6: [add_throttle_table],
+    7: [add_reputation_table]
 }